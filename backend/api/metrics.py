@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..metrics import render_metrics
+
+api = APIRouter(tags=["Metrics"])
+openapi_tags = {
+    "name": "Metrics",
+    "description": "Request, SQL, and upstream timings in the Prometheus text format.",
+}
+
+
+@api.get("/metrics", response_class=PlainTextResponse, tags=["Metrics"])
+def get_metrics() -> PlainTextResponse:
+    """
+    Get the latency of every route, the SQL statements and time per request, and the latency and errors of
+    outbound calls to OpenWeather, Nominatim, and OpenAI by call site. Counted since the server started.
+
+    Returns:
+        PlainTextResponse: The metrics in the Prometheus text exposition format
+    """
+
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,84 @@
+"""Response classes and the route class for the API routes."""
+
+from collections.abc import Callable
+from typing import Any
+import asyncio, functools, time
+
+import orjson
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from ..metrics import request_timer, request_timings
+
+
+class TimedAPIRoute(APIRoute):
+    """
+    Route that marks when its endpoint returns. FastAPI then validates and encodes the result against the response_model
+    before the response renders it, so the request's serialize time covers that step as well as the rendering.
+    """
+
+    def get_route_handler(self) -> Callable:
+        self.dependant.call = _mark_serialize_start(self.dependant.call)
+        return super().get_route_handler()
+
+
+class TimedJSONResponse(JSONResponse):
+    """
+    The default JSON response, which counts the time since the route returned its result, or else the time spent rendering the body, as the request's serialize time.
+    """
+
+    def render(self, content: Any) -> bytes:
+        started = time.perf_counter()
+        body = super().render(content)
+
+        timings = request_timings.get()
+        if timings is not None:
+            if timings.serialize_started is not None:
+                started = min(started, timings.serialize_started)
+                timings.serialize_started = None
+            timings.serialize += time.perf_counter() - started
+
+        return body
+
+
+class ModelListResponse(TimedJSONResponse):
+    """
+    JSON response for lists of Pydantic models that were already validated when they were built from database rows.
+
+    Returning it from a route skips FastAPI's second pass over the response_model, and the models are
+    serialized straight from their fields with orjson instead of being dumped to dicts for the stdlib json module first.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with request_timer("serialize"):
+            # orjson calls vars() for every model it cannot serialize natively, including nested models
+            return orjson.dumps(content, default=vars)
+
+
+def _mark_serialize_start(endpoint: Callable) -> Callable:
+    """
+    Wraps an endpoint so the current request's timings record when it returned. Async endpoints stay async, so FastAPI still awaits them
+    on the event loop, and sync endpoints still run in the threadpool, which shares the timings through the copied context.
+    """
+
+    def mark() -> None:
+        timings = request_timings.get()
+        if timings is not None:
+            timings.serialize_started = time.perf_counter()
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def marked_async(*args: Any, **kwargs: Any) -> Any:
+            result = await endpoint(*args, **kwargs)
+            mark()
+            return result
+
+        return marked_async
+
+    @functools.wraps(endpoint)
+    def marked(*args: Any, **kwargs: Any) -> Any:
+        result = endpoint(*args, **kwargs)
+        mark()
+        return result
+
+    return marked
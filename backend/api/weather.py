@@ -1,17 +1,24 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy import JSON
 
-from ..services.weather import WeatherService
+from ..services.weather import WeatherService, split_cities
+from ..services.weather_prefetcher import weather_prefetcher
+from ..services.geocode import GeocodeService
+from ..services.export import EXPORT_FORMATS, ExportService
+from .responses import ModelListResponse, TimedAPIRoute
 from ..models.weather import Weather
+from ..models.weather_error import WeatherError
+from ..models.geocode_cache_stats import GeocodeCacheStats
 
-api = APIRouter(prefix="/weather", tags=["Weather"])
+api = APIRouter(prefix="/weather", tags=["Weather"], route_class=TimedAPIRoute)
 openapi_tags = {
     "name": "Weather",
     "description": "Create, update, delete, and retrieve Weather Data from a third-party API.",
 }
 
-@api.get("/{city}/forecast", response_model=list[Weather], tags=["Weather"])
-def get_five_day_forecast_by_city(city: str, weather_service: WeatherService = Depends(WeatherService)) -> list[Weather]:
+@api.get("/{city}/forecast", response_model=list[Weather], response_class=ModelListResponse, tags=["Weather"])
+async def get_five_day_forecast_by_city(city: str, weather_service: WeatherService = Depends(WeatherService)) -> ModelListResponse:
     """
     Gets the forecast from OpenWeather's forecast API endpoint for every three hours of the current day, and the next five days.
 
@@ -23,11 +30,14 @@ def get_five_day_forecast_by_city(city: str, weather_service: WeatherService = D
         Weather: All Weather data in the Weather database table
     """
         
-    return weather_service.get_five_day_forecast(city)
+    forecast = await weather_service.get_five_day_forecast(city)
+    weather_prefetcher.track(city)
+
+    return ModelListResponse(forecast)
 
 
 @api.get("/{city}/current", response_model=Weather, tags=["Weather"])
-def get_current_weather_by_location(city: str, weather_service: WeatherService = Depends(WeatherService)) -> Weather:
+async def get_current_weather_by_location(city: str, weather_service: WeatherService = Depends(WeatherService)) -> Weather:
     """
     Gets the current weather for a given location.
 
@@ -39,7 +49,93 @@ def get_current_weather_by_location(city: str, weather_service: WeatherService =
         Weather: The weather forecast for the given date and location
     """
 
-    return weather_service.get_current_weather_by_location(city)
+    weather = await weather_service.get_current_weather_by_location(city)
+    weather_prefetcher.track(city)
+
+    return weather
+
+
+@api.get("/forecast", response_model=dict[str, list[Weather] | WeatherError], tags=["Weather"])
+async def get_five_day_forecasts_by_cities(cities: str = Query(..., description="Comma separated cities, i.e. 'Durham,Raleigh'"), weather_service: WeatherService = Depends(WeatherService)) -> dict[str, list[Weather] | WeatherError]:
+    """
+    Gets the forecast of the current day and the next five days for several cities in one request.
+    Stored forecasts are read with one query, and the missing ones are fetched concurrently. A city that fails gets an error entry instead of failing the request.
+
+    Params:
+        cities: The locations to get the forecast for, separated by commas
+        weather_service: Service for interacting with weather data
+
+    Returns:
+        dict[str, list[Weather] | WeatherError]: The forecast or error by city, in the order the cities were given
+    """
+
+    city_list = split_cities(cities)
+    forecasts = await weather_service.get_five_day_forecasts(city_list)
+    # Cities that failed are not kept fresh, so an unknown city is not looked up again every interval
+    for city, forecast in forecasts.items():
+        if not isinstance(forecast, WeatherError):
+            weather_prefetcher.track(city)
+
+    return forecasts
+
+
+@api.get("/current", response_model=dict[str, Weather | WeatherError], tags=["Weather"])
+async def get_current_weather_by_locations(cities: str = Query(..., description="Comma separated cities, i.e. 'Durham,Raleigh'"), weather_service: WeatherService = Depends(WeatherService)) -> dict[str, Weather | WeatherError]:
+    """
+    Gets the current weather for several cities in one request.
+    Cached and stored weather is read with at most one query, and the missing cities are fetched concurrently. A city that fails gets an error entry instead of failing the request.
+
+    Params:
+        cities: The locations to get the current weather for, separated by commas
+        weather_service: Service for interacting with weather data
+
+    Returns:
+        dict[str, Weather | WeatherError]: The current weather or error by city, in the order the cities were given
+    """
+
+    city_list = split_cities(cities)
+    weather = await weather_service.get_current_weather_by_locations(city_list)
+    for city, city_weather in weather.items():
+        if not isinstance(city_weather, WeatherError):
+            weather_prefetcher.track(city)
+
+    return weather
+
+
+@api.get("/geocode/cache", response_model=GeocodeCacheStats, tags=["Weather"])
+def get_geocode_cache_stats(geocode_service: GeocodeService = Depends(GeocodeService)) -> GeocodeCacheStats:
+    """
+    Gets the hit and miss counters of the geocoding cache in front of Nominatim.
+
+    Params:
+        geocode_service: Service for looking up the location of cities
+
+    Returns:
+        GeocodeCacheStats: The cache counters since the server started
+    """
+
+    return geocode_service.cache_stats()
+
+
+@api.get("/export", response_class=StreamingResponse, tags=["Weather"])
+def export_weather(format: str = Query("csv", pattern="^(csv|parquet|arrow)$"), city: str | None = None, export_service: ExportService = Depends(ExportService)) -> StreamingResponse:
+    """
+    Export the stored weather as a CSV, Parquet, or Arrow IPC file, read from the database and encoded in chunks.
+
+    Params:
+        format: 'csv', 'parquet', or 'arrow'. Parquet and Arrow require the pyarrow package.
+        city: Optionally only export the weather of this city
+        export_service: Service for exporting data
+
+    Returns:
+        StreamingResponse: The exported file
+    """
+
+    return StreamingResponse(
+        export_service.export_weather(format, city),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="weather.{ format }"'}
+    )
 
 
 @api.get("/{weather_id}/", response_model=Weather, tags=["Weather"])
@@ -59,23 +155,24 @@ def get_current_weather_by_id(weather_id: int, weather_service: WeatherService =
 
 
 @api.post("/{city}/forecast", response_model=list[Weather], tags=["Weather"])
-def create_five_day_forecast_by_city(city: str, weather_service: WeatherService = Depends(WeatherService)) -> list[Weather]:
+async def create_five_day_forecast_by_city(city: str, weather_service: WeatherService = Depends(WeatherService)) -> list[Weather]:
     """
-    Creates a new weather forecast for the current day, and the next five days for a given location.
+    Creates the weather forecast for the current day, and the next five days for a given location.
+    The stored forecast is returned as is unless it is older than FORECAST_STALE_SECONDS.
 
     Params:
         weather_service: Service for interacting with weather data
         city: The location to get the forecast for in the form of a string
 
     Returns:
-        list[Weather]: The newly created weather forecasts
+        list[Weather]: The stored weather forecasts
     """
 
-    return weather_service.store_five_day_weather_forecast(city)
+    return await weather_service.get_five_day_forecast(city)
 
 
 @api.post("/{city}/current", response_model=Weather, tags=["Weather"])
-def create_current_weather_by_location(city: str, weather_service: WeatherService = Depends(WeatherService)) -> Weather:
+async def create_current_weather_by_location(city: str, weather_service: WeatherService = Depends(WeatherService)) -> Weather:
     """
     Creates a new current weather forecast for a given location.
 
@@ -87,7 +184,7 @@ def create_current_weather_by_location(city: str, weather_service: WeatherServic
         Weather: The newly created current weather forecast
     """
 
-    return weather_service.store_current_weather(city)
+    return await weather_service.store_current_weather(city)
 
 
 
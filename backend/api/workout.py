@@ -1,31 +1,124 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
 from backend.services.weather import WeatherService
+from backend.services.weather_prefetcher import weather_prefetcher
 
 from ..services.workout import WorkoutService
 from ..models.workout import Workout
+from ..models.workout_stats import WorkoutStats
 from ..services.openai import OpenAIService
+from ..services.workout_import import WorkoutImportService, decode_lines
+from ..services.export import EXPORT_FORMATS, ExportService
+from .responses import ModelListResponse, TimedAPIRoute
+from ..models.workout_import_result import WorkoutImportResult
 
-api = APIRouter(prefix="/workouts", tags=["Workouts"])
+api = APIRouter(prefix="/workouts", tags=["Workouts"], route_class=TimedAPIRoute)
 openapi_tags = {
     "name": "Workouts",
     "description": "Create, update, delete, and retrieve Workouts. Retrieve aggregate data from the last 7 days.",
 }
 
-@api.get("/", response_model=list[Workout], tags=["Workouts"])
-def get_workouts(workout_service: WorkoutService = Depends(WorkoutService)) -> list[Workout]:
+# Keep proxies from caching or buffering server-sent events so each token reaches the client as it is generated
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# The most workouts a single batch advice request may ask for
+ADVICE_BATCH_MAX_SIZE = 100
+
+# Set on a page of workouts that is followed by another one, to the after_id of the next page
+NEXT_AFTER_ID_HEADER = "X-Next-After-Id"
+
+@api.get("/", response_model=list[Workout], response_class=ModelListResponse, tags=["Workouts"])
+def get_workouts(after_id: int | None = None, limit: int = Query(100, ge=1, le=1000), include: str | None = Query(None, pattern="^weather$"), workout_service: WorkoutService = Depends(WorkoutService)) -> ModelListResponse:
+    """
+    Get a page of workouts ordered by ID. If more workouts follow, the X-Next-After-Id header holds the after_id of the next page.
+
+    Params:
+        after_id: Optionally only get workouts with an ID greater than this one
+        limit: The maximum number of workouts to get
+        include: Pass 'weather' to include the weather of each workout
+        workout_service: Service for interacting with workouts
+
+    Returns:
+        list[Workout]: A page of Workouts from the Workouts database table
+    """
+
+    # One workout past the page is read to tell whether another page follows
+    workouts = workout_service.all(after_id, limit + 1, include == "weather")
+    headers = {NEXT_AFTER_ID_HEADER: str(workouts[limit - 1].id)} if len(workouts) > limit else None
+
+    return ModelListResponse(workouts[:limit], headers=headers)
+
+
+@api.get("/stream", response_class=StreamingResponse, tags=["Workouts"])
+def stream_workouts(after_id: int | None = None, include: str | None = Query(None, pattern="^weather$"), workout_service: WorkoutService = Depends(WorkoutService)) -> StreamingResponse:
     """
-    Get all workouts
+    Stream every workout as newline delimited JSON (one Workout per line) without loading them all into memory
 
     Params:
+        after_id: Optionally only stream workouts with an ID greater than this one
+        include: Pass 'weather' to include the weather of each workout
         workout_service: Service for interacting with workouts
 
     Returns:
-        list[Workout]: All Workouts in the Workouts database table
+        StreamingResponse: The workouts in the application/x-ndjson format
     """
-        
-    return workout_service.all()
+
+    return StreamingResponse(workout_service.stream_workouts_ndjson(after_id, include_weather=include == "weather"), media_type="application/x-ndjson")
+
+
+@api.get("/export", response_class=StreamingResponse, tags=["Workouts"])
+def export_workouts(format: str = Query("csv", pattern="^(csv|parquet|arrow)$"), include_weather: bool = False, export_service: ExportService = Depends(ExportService)) -> StreamingResponse:
+    """
+    Export every workout as a CSV, Parquet, or Arrow IPC file, read from the database and encoded in chunks.
+
+    Params:
+        format: 'csv', 'parquet', or 'arrow'. Parquet and Arrow require the pyarrow package.
+        include_weather: Add the weather of each workout to its row
+        export_service: Service for exporting data
+
+    Returns:
+        StreamingResponse: The exported file
+    """
+
+    return StreamingResponse(
+        export_service.export_workouts(format, include_weather),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="workouts.{ format }"'}
+    )
+
+
+@api.get("/stats", response_model=list[WorkoutStats], tags=["Workouts"])
+def get_workout_stats(
+    metric: str = "distance,duration",
+    agg: str = "sum,avg",
+    group_by: str | None = None,
+    start_date: date | None = Query(None, alias="from"),
+    end_date: date | None = Query(None, alias="to"),
+    workout_service: WorkoutService = Depends(WorkoutService)
+) -> list[WorkoutStats]:
+    """
+    Get aggregate stats for workout data points, computed in a single SQL query
+
+    Params:
+        metric: Comma separated data points to aggregate, i.e. 'distance,duration' or 'pace'
+        agg: Comma separated aggregates to apply to each data point, i.e. 'sum,avg,max'
+        group_by: Optionally group the stats by 'week', 'month', or 'city'
+        start_date: Optionally only include workouts on or after this date
+        end_date: Optionally only include workouts on or before this date
+        workout_service: Service for interacting with workouts
+
+    Returns:
+        list[WorkoutStats]: One row of stats per group, or a single row if the stats are not grouped
+    """
+
+    metrics = [value.strip() for value in metric.split(",") if value.strip()]
+    aggregates = [value.strip() for value in agg.split(",") if value.strip()]
+
+    return workout_service.get_workout_stats(metrics, aggregates, group_by, start_date, end_date)
+
 
 @api.get("/{workout_id}", response_model=Workout, tags=["Workouts"])
 def get_workout_by_id(workout_id: int, workout_service: WorkoutService = Depends(WorkoutService)) -> Workout:
@@ -43,19 +136,20 @@ def get_workout_by_id(workout_id: int, workout_service: WorkoutService = Depends
     return workout_service.get_workout_by_id(workout_id)
 
 
-@api.get("/weekly/workouts", response_model=list[Workout], tags=["Workouts"])
-def get_weekly_workouts(workout_service: WorkoutService = Depends(WorkoutService)) -> list[Workout]:
+@api.get("/weekly/workouts", response_model=list[Workout], response_class=ModelListResponse, tags=["Workouts"])
+def get_weekly_workouts(include: str | None = Query(None, pattern="^weather$"), workout_service: WorkoutService = Depends(WorkoutService)) -> ModelListResponse:
     """
     Get all workouts logged from the last 7 days
 
     Params:
+        include: Pass 'weather' to include the weather of each workout
         workout_service: Service for interacting with workouts
 
     Returns:
         list[Workout]: All Workouts from the current week
     """
 
-    return workout_service.get_weekly_workouts()
+    return ModelListResponse(workout_service.get_weekly_workouts(include == "weather"))
 
 
 @api.get("/weekly/{data_point}/sum", response_model=float, tags=["Workouts"])
@@ -120,8 +214,37 @@ def get_personal_best_duration(workout_service: WorkoutService = Depends(Workout
     return workout_service.get_personal_best_duration_per_mile()
 
 
+@api.get("/leaderboards/{metric}", response_model=list[Workout], response_class=ModelListResponse, tags=["Workouts"])
+def get_workout_leaderboard(
+    metric: str,
+    limit: int = Query(10, ge=1, le=100),
+    city: str | None = None,
+    start_date: date | None = Query(None, alias="from"),
+    end_date: date | None = Query(None, alias="to"),
+    include: str | None = Query(None, pattern="^weather$"),
+    workout_service: WorkoutService = Depends(WorkoutService)
+) -> ModelListResponse:
+    """
+    Get the top workouts by fastest pace, longest distance, or longest duration
+
+    Params:
+        metric: The metric to rank workouts by, i.e. 'pace', 'distance', or 'duration'
+        limit: The number of workouts to return
+        city: Optionally only rank workouts from this city
+        start_date: Optionally only rank workouts on or after this date
+        end_date: Optionally only rank workouts on or before this date
+        include: Pass 'weather' to include the weather of each workout
+        workout_service: Service for interacting with workouts
+
+    Returns:
+        list[Workout]: The top workouts, best first
+    """
+
+    return ModelListResponse(workout_service.get_leaderboard(metric, limit, city, start_date, end_date, include == "weather"))
+
+
 @api.get("/advice/weather/outfit/{city}", response_model=str, tags=["Workouts"])
-def get_workout_outfit_advice_by_location(city: str, weather_service: WeatherService = Depends(WeatherService), openai_service: OpenAIService = Depends(OpenAIService)) -> str:
+async def get_workout_outfit_advice_by_location(city: str, refresh: bool = False, weather_service: WeatherService = Depends(WeatherService), openai_service: OpenAIService = Depends(OpenAIService)) -> str:
     """
     Get an outfit suggestion for a workout based on the weather
 
@@ -133,13 +256,62 @@ def get_workout_outfit_advice_by_location(city: str, weather_service: WeatherSer
         str: The outfit suggestion
     """
 
-    weather = weather_service.get_current_weather_by_location(city)
+    weather = await weather_service.get_current_weather_by_location(city)
+    weather_prefetcher.track(city)
+
+    # The OpenAI client is blocking, so keep it off the event loop
+    return await run_in_threadpool(openai_service.generate_workout_outfit, weather, refresh)
+
+
+@api.get("/advice/weather/outfit/{city}/stream", response_class=StreamingResponse, tags=["Workouts"])
+async def stream_workout_outfit_advice_by_location(city: str, refresh: bool = False, weather_service: WeatherService = Depends(WeatherService), openai_service: OpenAIService = Depends(OpenAIService)) -> StreamingResponse:
+    """
+    Stream an outfit suggestion for a workout based on the weather as server-sent events
+
+    Params:
+        city: The city to get the weather for
+        refresh: Generate a new suggestion even if one is cached
+        weather_service: Service for interacting with weather data
+        openai_service: Service for interacting with the OpenAI API
+
+    Returns:
+        StreamingResponse: The outfit suggestion as server-sent events
+    """
 
-    return openai_service.generate_workout_outfit(weather)
+    weather = await weather_service.get_current_weather_by_location(city)
+    weather_prefetcher.track(city)
+
+    # The cache lookup is blocking, so keep it off the event loop
+    events = await run_in_threadpool(openai_service.stream_workout_outfit, weather, refresh)
+
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@api.get("/advice/improvement/stream", response_class=StreamingResponse, tags=["Workouts"])
+def stream_all_workout_improvement_advice(refresh: bool = False, workout_service: WorkoutService = Depends(WorkoutService), openai_service: OpenAIService = Depends(OpenAIService)) -> StreamingResponse:
+    """
+    Stream advice on how to improve a workout based on weekly averages as server-sent events
+
+    Params:
+        refresh: Generate new advice even if it is cached
+        workout_service: Service for interacting with workouts
+        openai_service: Service for interacting with the OpenAI API
+
+    Returns:
+        StreamingResponse: The improvement advice as server-sent events
+    """
+
+    weekly_stats = workout_service.get_weekly_workout_stats(["distance", "duration"], ["avg"])
+    average_distance_per_workout = round(weekly_stats.stats["distance_avg"] or 0.0, 2)
+    average_duration_per_workout = round(weekly_stats.stats["duration_avg"] or 0.0, 2)
+
+    events = openai_service.stream_all_workout_improvement_advice(average_distance_per_workout, average_duration_per_workout, refresh)
+
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @api.get("/advice/improvement/", response_model=str, tags=["Workouts"])
-def get_all_workout_improvement_advice( workout_service: WorkoutService = Depends(WorkoutService), openai_service: OpenAIService = Depends(OpenAIService)) -> str:
+def get_all_workout_improvement_advice(refresh: bool = False, workout_service: WorkoutService = Depends(WorkoutService), openai_service: OpenAIService = Depends(OpenAIService)) -> str:
     """
     Get advice on how to improve a workout based on weekly averages
 
@@ -152,14 +324,44 @@ def get_all_workout_improvement_advice( workout_service: WorkoutService = Depend
         str: The improvement advice
     """
 
-    average_distance_per_workout = workout_service.get_average_weekly_aggreate_workout_data("distance")
-    average_duration_per_workout = workout_service.get_average_weekly_aggreate_workout_data("duration")
+    # Both averages come from a single aggregate query
+    weekly_stats = workout_service.get_weekly_workout_stats(["distance", "duration"], ["avg"])
+    average_distance_per_workout = round(weekly_stats.stats["distance_avg"] or 0.0, 2)
+    average_duration_per_workout = round(weekly_stats.stats["duration_avg"] or 0.0, 2)
+
+    return openai_service.generate_all_workout_improvement_advice(average_distance_per_workout, average_duration_per_workout, refresh)
+
+
+@api.post("/advice/improvement/batch", response_class=StreamingResponse, tags=["Workouts"])
+def get_workout_improvement_advice_batch(workout_ids: list[int] = Body(..., min_length=1, max_length=ADVICE_BATCH_MAX_SIZE), refresh: bool = False, workout_service: WorkoutService = Depends(WorkoutService), openai_service: OpenAIService = Depends(OpenAIService)) -> StreamingResponse:
+    """
+    Get advice on how to improve many workouts at once. The workouts are loaded with one query and advised concurrently.
+    Results are streamed as newline delimited JSON in the order they finish, with failures reported per workout.
+
+    Params:
+        workout_ids: The IDs of the workouts to get advice for
+        refresh: Generate new advice even if it is cached
+        workout_service: Service for interacting with workouts
+        openai_service: Service for interacting with the OpenAI API
+
+    Returns:
+        StreamingResponse: One WorkoutAdvice JSON line per workout
+    """
+
+    # Deduplicate while keeping the requested order
+    workout_ids = list(dict.fromkeys(workout_ids))
+    found_workouts = workout_service.get_workouts_by_ids(workout_ids)
+    workouts = {workout_id: found_workouts.get(workout_id) for workout_id in workout_ids}
 
-    return openai_service.generate_all_workout_improvement_advice(average_distance_per_workout, average_duration_per_workout)
+    async def advice_lines():
+        async for advice in openai_service.generate_workout_improvement_advice_batch(workouts, refresh):
+            yield advice.model_dump_json() + "\n"
+
+    return StreamingResponse(advice_lines(), media_type="application/x-ndjson")
 
 
 @api.get("/advice/improvement/{workout_id}", response_model=str, tags=["Workouts"])
-def get_workout_improvement_advice(workout_id: int, workout_service: WorkoutService = Depends(WorkoutService), openai_service: OpenAIService = Depends(OpenAIService)) -> str:
+def get_workout_improvement_advice(workout_id: int, refresh: bool = False, workout_service: WorkoutService = Depends(WorkoutService), openai_service: OpenAIService = Depends(OpenAIService)) -> str:
     """
     Get advice on how to improve a workout based on the distance and duration of a specific workout
 
@@ -174,11 +376,33 @@ def get_workout_improvement_advice(workout_id: int, workout_service: WorkoutServ
 
     workout = workout_service.get_workout_by_id(workout_id)
 
-    return openai_service.generate_workout_improvement_advice(workout)
+    return openai_service.generate_workout_improvement_advice(workout, refresh)
+
+
+@api.get("/advice/improvement/{workout_id}/stream", response_class=StreamingResponse, tags=["Workouts"])
+def stream_workout_improvement_advice(workout_id: int, refresh: bool = False, workout_service: WorkoutService = Depends(WorkoutService), openai_service: OpenAIService = Depends(OpenAIService)) -> StreamingResponse:
+    """
+    Stream advice on how to improve a specific workout as server-sent events
+
+    Params:
+        workout_id: The ID of the workout to get advice for
+        refresh: Generate new advice even if it is cached
+        workout_service: Service for interacting with workouts
+        openai_service: Service for interacting with the OpenAI API
+
+    Returns:
+        StreamingResponse: The improvement advice as server-sent events
+    """
+
+    workout = workout_service.get_workout_by_id(workout_id)
+
+    events = openai_service.stream_workout_improvement_advice(workout, refresh)
+
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @api.post("/", response_model=Workout, tags=["Workouts"])
-def create_workout(workout: Workout, weather_service: WeatherService = Depends(WeatherService), workout_service: WorkoutService = Depends(WorkoutService)) -> Workout:
+async def create_workout(workout: Workout, weather_service: WeatherService = Depends(WeatherService), workout_service: WorkoutService = Depends(WorkoutService)) -> Workout:
     """
     Create a new workout and generate the weather data for that date.
     
@@ -199,12 +423,37 @@ def create_workout(workout: Workout, weather_service: WeatherService = Depends(W
     weather = None
 
     if workout_date == current_date:
-        weather = weather_service.get_current_weather_by_location(workout.city)
+        weather = await weather_service.get_current_weather_by_location(workout.city)
     # elif workout_date < current_date:
         # If past data could be accessed: use this, but the free version doesn't include historical data, just current and forecast
         # weather = weather_service.get_past_weather_by_location(workout.city, workout_date)
 
-    return workout_service.create_workout(workout, weather)
+    # The insert and commit are blocking, so they run in the threadpool instead of on the event loop
+    created = await run_in_threadpool(workout_service.create_workout, workout, weather)
+    weather_prefetcher.track(workout.city)
+
+    return created
+
+
+@api.post("/import", response_model=WorkoutImportResult, tags=["Workouts"])
+async def import_workouts(request: Request, format: str | None = Query(None, pattern="^(ndjson|csv)$"), workout_import_service: WorkoutImportService = Depends(WorkoutImportService)) -> WorkoutImportResult:
+    """
+    Import workouts in bulk from an NDJSON or CSV body, which is parsed as it is uploaded.
+    The format is taken from the format parameter, or else from the Content-Type header, and defaults to NDJSON.
+
+    Params:
+        request: The request whose body holds the workouts
+        format: 'ndjson' or 'csv'
+        workout_import_service: Service for importing workouts
+
+    Returns:
+        WorkoutImportResult: How many workouts were imported and which rows failed
+    """
+
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+    return await workout_import_service.import_workouts(decode_lines(request.stream()), format)
 
 
 @api.put("/{workout_id}", response_model=Workout, tags=["Workouts"])
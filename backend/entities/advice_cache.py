@@ -0,0 +1,33 @@
+"""Definition of a SQLAlchemy table-backed object mapping entity for cached OpenAI advice."""
+
+import datetime
+from sqlalchemy import Integer, String, Text, DateTime
+
+from ..database import Base
+
+from sqlalchemy.orm import  Mapped, mapped_column
+
+class AdviceCacheEntity(Base):
+    """
+    SQLAlchemy entity representing one generated OpenAI advice, keyed on a fingerprint of the quantized prompt inputs.
+    """
+
+    __tablename__ = "advice_cache"
+
+    # SHA-256 of the advice kind, model, prompt version, and quantized prompt inputs
+    fingerprint: Mapped[str] = mapped_column(String, primary_key=True)
+
+    # The kind of advice, i.e. 'outfit' or 'improvement'
+    kind: Mapped[str] = mapped_column(String, nullable=False)
+
+    # The generated advice
+    advice: Mapped[str] = mapped_column(Text, nullable=False)
+
+    # When the advice was generated (UTC), used to expire it
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=False)
+
+    # When the advice was last served (UTC), used to evict the least recently used advice
+    last_used_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+    # How many times the advice was served from the cache
+    hits: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
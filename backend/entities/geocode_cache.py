@@ -0,0 +1,28 @@
+"""Definition of a SQLAlchemy table-backed object mapping entity for cached geocoding results."""
+
+import datetime
+from sqlalchemy import String, Float, DateTime
+
+from ..database import Base
+
+from sqlalchemy.orm import  Mapped, mapped_column
+
+class GeocodeCacheEntity(Base):
+    """
+    SQLAlchemy entity representing the cached latitude and longitude of a city from Nominatim.
+    Cities Nominatim could not find are stored with no coordinates so they are not looked up again.
+    """
+
+    __tablename__ = "geocode_cache"
+
+    # The normalized city name, i.e. lowercase with single spaces
+    city: Mapped[str] = mapped_column(String, primary_key=True)
+
+    # Latitude of the city, None if the city could not be found
+    latitude: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # Longitude of the city, None if the city could not be found
+    longitude: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # When the city was looked up in Nominatim (UTC)
+    fetched_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=False)
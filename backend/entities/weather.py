@@ -1,12 +1,18 @@
 """Definition of a SQLAlchemy table-backed object mapping entity for workouts."""
 
 import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import Column, Date, Index, Integer, String, Float, DateTime, Boolean, text
 
 from backend.models.weather import Weather
 
 from ..database import Base
 
+# How the date of the current weather is shown in the API: the day and the time it was fetched
+CURRENT_WEATHER_DATE_FORMAT = "%Y-%m-%d %I:%M %p"
+
+# Rows the forecast unique key applies to. The upsert repeats it, so it must stay the same expression.
+FORECAST_ROWS = text("NOT is_current")
+
 from sqlalchemy.orm import  Mapped, mapped_column, relationship
 
 class WeatherEntity(Base):
@@ -14,12 +20,23 @@ class WeatherEntity(Base):
 
     __tablename__ = "weather"
 
+    # At most one current weather row per city and freshness bucket, at most one forecast per city and day, and forecasts are looked up by city and date range
+    __table_args__ = (
+        Index("uq_weather_current_bucket", "city", "is_current", "bucket_start", unique=True),
+        Index("uq_weather_forecast_day", "city", "date", "is_current", unique=True, sqlite_where=FORECAST_ROWS, postgresql_where=FORECAST_ROWS),
+        Index("ix_weather_city_current_date", "city", "is_current", "date"),
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
 
     # Just city for ease, but could be changed to a specific location
     city: Mapped[str] = mapped_column(String, nullable=False)
 
-    date: Mapped[str] = mapped_column(String, nullable=False)
+    # The day of the forecast or current weather
+    date: Mapped[datetime.date] = mapped_column(Date, nullable=False)
+
+    # When the weather was last fetched in the app's timezone
+    fetched_at: Mapped[datetime.datetime | None] = mapped_column(DateTime, nullable=True)
 
     # Average feels like temp for the day
     feels_like: Mapped[float] = mapped_column(Float, nullable=False)
@@ -48,6 +65,9 @@ class WeatherEntity(Base):
     # Boolean to determine if the weather is the current weather or a forecast
     is_current: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
 
+    # Start of the freshness bucket (seconds since the epoch) the current weather was fetched in, None for forecasts
+    bucket_start: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
     # Relationship to WorkoutEntity
     workouts: Mapped[list["WorkoutEntity"]] = relationship("WorkoutEntity", back_populates="weather")
 
@@ -59,10 +79,11 @@ class WeatherEntity(Base):
             Weather: A Weather Pydantic Model object
         """
 
-        return Weather(
+        # Stored weather was validated when it was written, so it is not validated again on every read
+        return Weather.model_construct(
             id=self.id,
             city=self.city,
-            date=self.date,
+            date=self.fetched_at.strftime(CURRENT_WEATHER_DATE_FORMAT) if self.is_current and self.fetched_at else self.date.isoformat(),
             feels_like=self.feels_like,
             humidity=self.humidity,
             temp_min=self.temp_min,
@@ -86,10 +107,14 @@ class WeatherEntity(Base):
             WeatherEntity: Entity created from model
         """
 
+        # The current weather is shown with the time it was fetched
+        fetched_at = datetime.datetime.strptime(weather.date, CURRENT_WEATHER_DATE_FORMAT) if len(weather.date) > 10 else None
+
         return cls(
             id=weather.id,
             city=weather.city,
-            date=weather.date,
+            date=fetched_at.date() if fetched_at else datetime.date.fromisoformat(weather.date),
+            fetched_at=fetched_at,
             feels_like=weather.feels_like,
             humidity=weather.humidity,
             temp_min=weather.temp_min,
@@ -1,7 +1,7 @@
 """Definition of a SQLAlchemy table-backed object mapping entity for workouts."""
 
 import datetime
-from sqlalchemy import Column, ForeignKey, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import Column, Date, ForeignKey, Index, Integer, String, Float, DateTime, Boolean
 
 from backend.entities.weather import WeatherEntity
 
@@ -17,6 +17,14 @@ class WorkoutEntity(Base):
 
     __tablename__ = "workout"
 
+    # Composite indexes so city filtered leaderboards and date ranges are served with an index seek
+    __table_args__ = (
+        Index("ix_workout_city_pace", "city", "pace"),
+        Index("ix_workout_city_distance", "city", "distance"),
+        Index("ix_workout_city_duration", "city", "duration"),
+        Index("ix_workout_city_date", "city", "date"),
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
 
     # Name of the workout
@@ -26,13 +34,16 @@ class WorkoutEntity(Base):
     city: Mapped[str] = mapped_column(String, nullable=False)
 
     # Distance of the workout in miles
-    distance: Mapped[float] = mapped_column(Float, nullable=False)
+    distance: Mapped[float] = mapped_column(Float, nullable=False, index=True)
 
     # Duration of the workout in minutes
-    duration: Mapped[int] = mapped_column(Integer, nullable=False)
+    duration: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+
+    # Minutes per mile, stored on write so personal bests and leaderboards can use an index. None if the distance is 0
+    pace: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
 
-    # The day in which the workout was created
-    date: Mapped[str] = mapped_column(String, nullable=False, default=datetime.datetime.now(tz).strftime("%Y-%m-%d"))
+    # The day in which the workout was created, indexed for date range queries such as the last 7 days
+    date: Mapped[datetime.date] = mapped_column(Date, nullable=False, index=True, default=lambda: datetime.datetime.now(tz).date())
 
     # Store the weather ID foreign key
     weather_id: Mapped[int] = mapped_column(ForeignKey("weather.id"), nullable=True)
@@ -40,23 +51,28 @@ class WorkoutEntity(Base):
     # Relationship field for the weather entity
     weather: Mapped["WeatherEntity"] = relationship("WeatherEntity", back_populates="workouts")
 
-    def to_model(self) -> Workout:
+    def to_model(self, include_weather: bool = True) -> Workout:
         """
         Converts a Workout Entity object into a Workout Pydantic Model object
 
+        Params:
+            include_weather: Include the weather. Unless the weather was eager loaded, this lazy loads it with one query per workout.
+
         Returns:
             Workout: A Workout Pydantic Model object
         """
 
-        return Workout(
+        # Stored workouts were validated when they were written, so they are not validated again on every read
+        return Workout.model_construct(
             id=self.id,
             name=self.name,
             city=self.city,
             distance=self.distance,
             duration=self.duration,
-            date=self.date,
+            date=self.date.isoformat(),
+            pace=self.pace,
             weather_id=self.weather_id,
-            weather=self.weather.to_model() if self.weather else None
+            weather=self.weather.to_model() if include_weather and self.weather else None
         )
     
     @classmethod
@@ -77,6 +93,41 @@ class WorkoutEntity(Base):
             city=workout.city,
             distance=workout.distance,
             duration=workout.duration,
-            date=workout.date,
+            date=workout_date(workout.date),
+            pace=workout_pace(workout.distance, workout.duration),
             weather_id=workout.weather_id,
-        )
\ No newline at end of file
+        )
+
+
+def workout_pace(distance: float, duration: int) -> float | None:
+    """
+    Calculates the pace of a workout in minutes per mile.
+
+    Params:
+        distance: The distance of the workout in miles
+        duration: The duration of the workout in minutes
+
+    Returns:
+        float | None: The pace of the workout, None if the workout has no distance
+    """
+
+    if not distance or distance <= 0:
+        return None
+
+    return duration / distance
+
+def workout_date(value: str | None) -> datetime.date:
+    """
+    Converts the 'YYYY-MM-DD' date of a Workout model to the value of the date column.
+
+    Params:
+        value: The date of the workout, None for today
+
+    Returns:
+        datetime.date: The date of the workout
+    """
+
+    if value is None:
+        return datetime.datetime.now(tz).date()
+
+    return datetime.date.fromisoformat(value)
@@ -0,0 +1,38 @@
+"""Definition of a SQLAlchemy table-backed object mapping entity for daily workout rollups."""
+
+import datetime
+from sqlalchemy import Date, Integer, String, Float
+
+from ..database import Base
+
+from sqlalchemy.orm import  Mapped, mapped_column
+
+class WorkoutDailyRollupEntity(Base):
+    """
+    SQLAlchemy entity representing the aggregate of every workout logged in one city on one day.
+    Rows are maintained by WorkoutService in the same transaction as the workout writes, so stats
+    can be read from one row per day instead of scanning the workout table.
+    """
+
+    __tablename__ = "workout_daily_rollup"
+
+    # The day of the workouts
+    date: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+
+    # Location of the workouts
+    city: Mapped[str] = mapped_column(String, primary_key=True)
+
+    # Number of workouts logged on this day in this city
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    # Sum of the workout distances in miles
+    total_distance: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+
+    # Sum of the workout durations in minutes
+    total_duration: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    # Fastest minutes per mile of the workouts, None if every workout has a distance of 0
+    min_pace: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # Longest workout distance in miles
+    max_distance: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
@@ -0,0 +1,250 @@
+"""
+Load tests the API offline and reports the latency and throughput of every route as JSON.
+
+Boots the app from backend/main.py with uvicorn against a seeded SQLite database, with Nominatim, OpenWeather,
+and OpenAI replaced by the local stubs, then drives every scenario at a fixed concurrency.
+Seeded databases are kept in the data directory and copied for each run, so writes never leak into the next run.
+
+Run from the root directory of the repo:
+    python -m backend.loadtest.run --rows 100000 --concurrency 16 --requests 200 --output results.json
+"""
+
+from datetime import datetime, timezone
+import argparse, asyncio, json, os, platform, shutil, socket, sqlite3, subprocess, sys, time
+
+import httpx
+
+from .scenarios import SCENARIOS, Scenario
+from .seed import seed_database
+
+# How long the app and the stubs may take to start
+STARTUP_TIMEOUT_SECONDS = 60
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """
+    Calculates a percentile with the nearest rank method.
+
+    Params:
+        sorted_values: The values in ascending order
+        percent: The percentile, between 0 and 100
+
+    Returns:
+        float: The smallest value that at least percent of the values are less than or equal to
+    """
+
+    if not sorted_values:
+        return 0.0
+
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(name: str, latencies: list[float], statuses: list[int], elapsed: float) -> dict:
+    """
+    Summarizes the requests of one scenario.
+
+    Params:
+        name: The name of the scenario
+        latencies: The latency of every request in seconds
+        statuses: The status code of every request, 0 if it failed to connect
+        elapsed: How long the scenario ran for in seconds
+
+    Returns:
+        dict: The request and error counts, the throughput, and the latency percentiles in milliseconds
+    """
+
+    latencies = sorted(latencies)
+    status_counts = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+
+    return {
+        "name": name,
+        "requests": len(statuses),
+        "errors": sum(1 for status in statuses if not 200 <= status < 400),
+        "status_counts": status_counts,
+        "throughput_rps": round(len(statuses) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+    }
+
+
+async def drive(client: httpx.AsyncClient, scenario: Scenario, context: dict, requests: int, concurrency: int, warmup: int) -> dict:
+    """
+    Sends the requests of one scenario with a fixed number of concurrent workers, reading every body to the end.
+
+    Params:
+        client: Client pointed at the app
+        scenario: The scenario to drive
+        context: The 'rows' and 'weather_rows' of the seeded database
+        requests: How many requests are measured
+        concurrency: How many requests are in flight at once
+        warmup: How many requests are sent first without being measured
+
+    Returns:
+        dict: The summary of the measured requests
+    """
+
+    async def send(i: int) -> tuple[float, int]:
+        started = time.perf_counter()
+        try:
+            async with client.stream(**scenario.build(i, context)) as response:
+                async for _ in response.aiter_raw():
+                    pass
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+
+        return time.perf_counter() - started, status
+
+    for i in range(warmup):
+        await send(i)
+
+    latencies, statuses = [], []
+    next_request = iter(range(warmup, warmup + requests))
+
+    async def worker() -> None:
+        for i in next_request:
+            latency, status = await send(i)
+            latencies.append(latency)
+            statuses.append(status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return summarize(scenario.name, latencies, statuses, time.perf_counter() - started)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, process: subprocess.Popen) -> None:
+    """
+    Polls a URL until it answers, raising if the process exits or the startup timeout passes.
+    """
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{ url } exited with code { process.returncode } before it was ready")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+
+    raise RuntimeError(f"{ url } was not ready after { STARTUP_TIMEOUT_SECONDS } seconds")
+
+
+def prepare_database(data_dir: str, rows: int, seed: int) -> tuple[str, dict]:
+    """
+    Copies the seeded database for this run, seeding it first if it does not exist yet.
+
+    Returns:
+        tuple[str, dict]: The path of the copy, and its 'rows' and 'weather_rows'
+    """
+
+    os.makedirs(data_dir, exist_ok=True)
+    template = os.path.join(data_dir, f"seed-{ rows }-{ seed }.db")
+
+    if not os.path.exists(template):
+        print(f"Seeding { rows } workouts into { template }", file=sys.stderr)
+        seed_database(template + ".tmp", rows, seed)
+        os.replace(template + ".tmp", template)
+
+    path = os.path.join(data_dir, "run.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.copyfile(template, path)
+
+    with sqlite3.connect(template) as connection:
+        weather_rows = connection.execute("SELECT count(*) FROM weather").fetchone()[0]
+
+    return path, {"rows": rows, "weather_rows": weather_rows}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="Seeded workouts, i.e. 10000, 100000, or 1000000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per scenario")
+    parser.add_argument("--scenarios", default="", help="Only run scenarios whose name contains this text")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latency of the Nominatim and OpenWeather stubs")
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--openai-latency-ms", type=float, default=200, help="Latency of the OpenAI stub")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of stub requests that fail, between 0 and 1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default="loadtest-data")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    database, context = prepare_database(args.data_dir, args.rows, args.seed)
+    stub_port, app_port = free_port(), free_port()
+    stub_url = f"http://127.0.0.1:{ stub_port }"
+
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{ database }",
+        "NOMINATIM_URL": f"{ stub_url }/nominatim/search",
+        "OPENWEATHER_FORECAST_URL": f"{ stub_url }/openweather/forecast",
+        "OPENWEATHER_CURRENT_URL": f"{ stub_url }/openweather/weather",
+        "OPENAI_BASE_URL": f"{ stub_url }/openai/v1",
+        "OPENAI_API_KEY": "loadtest",
+        "WEATHER_API_KEY": "loadtest",
+    }
+
+    stubs = subprocess.Popen([
+        sys.executable, "-m", "backend.loadtest.stubs", "--port", str(stub_port), "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms), "--openai-latency-ms", str(args.openai_latency_ms), "--error-rate", str(args.error_rate), "--seed", str(args.seed)
+    ], env=env)
+    app = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(app_port), "--log-level", "warning"], env=env)
+
+    try:
+        wait_until_ready(f"{ stub_url }/docs", stubs)
+        wait_until_ready(f"http://127.0.0.1:{ app_port }/docs", app)
+
+        async def run_all() -> list[dict]:
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{ app_port }", timeout=120, limits=limits) as client:
+                results = []
+                for scenario in SCENARIOS:
+                    if args.scenarios in scenario.name:
+                        print(f"Running { scenario.name }", file=sys.stderr)
+                        results.append(await drive(client, scenario, context, args.requests, args.concurrency, args.warmup))
+                return results
+
+        results = asyncio.run(run_all())
+    finally:
+        for process in (app, stubs):
+            process.terminate()
+            process.wait()
+
+    report = {
+        "started_at": started_at,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "data_dir")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "scenarios": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+The requests the load tests drive, at least one per route of the API.
+
+Each scenario builds its i-th request from the seeded database, so reads hit existing rows and writes never collide.
+Scenarios run in order, so the ones that delete rows come last.
+"""
+
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import date
+import json
+
+from .seed import SEED_CITIES
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """
+    A request to drive repeatedly. request(i, context) returns the keyword arguments of the i-th httpx request,
+    where context holds the 'rows' and 'weather_rows' of the seeded database.
+    """
+
+    method: str
+    route: str
+    request: Callable[[int, dict], dict] = field(default=lambda i, context: {})
+    variant: str | None = None
+
+    @property
+    def name(self) -> str:
+        return f"{ self.method } { self.route }" + (f" [{ self.variant }]" if self.variant else "")
+
+    def build(self, i: int, context: dict) -> dict:
+        """
+        Builds the i-th request: the method and URL plus the keyword arguments from request.
+        """
+
+        arguments = self.request(i, context)
+        path = arguments.pop("path", self.route)
+
+        return {"method": self.method, "url": path, **arguments}
+
+
+# A home screen's worth of saved cities for the batch weather routes
+SAVED_CITIES = ",".join(city.title() for city in SEED_CITIES)
+
+
+def workout_id(i: int, context: dict) -> int:
+    """
+    Cycles through the seeded workouts.
+    """
+
+    return i % context["rows"] + 1
+
+
+def new_workout(i: int) -> dict:
+    return {"name": f"Load test { i }", "city": "Chapel Hill", "distance": 3.1, "duration": 28, "date": date.today().strftime("%Y-%m-%d")}
+
+
+SCENARIOS = [
+    Scenario("GET", "/workouts/", lambda i, context: {"params": {"limit": 100}}),
+    Scenario("GET", "/workouts/", lambda i, context: {"params": {"limit": 100, "include": "weather"}}, "include=weather"),
+    Scenario("GET", "/workouts/", lambda i, context: {"params": {"limit": 100, "after_id": workout_id(i * 100, context)}}, "after_id"),
+    Scenario("GET", "/workouts/stream"),
+    Scenario("GET", "/workouts/export"),
+    Scenario("GET", "/workouts/stats", lambda i, context: {"params": {"group_by": "week"}}),
+    Scenario("GET", "/workouts/{workout_id}", lambda i, context: {"path": f"/workouts/{ workout_id(i, context) }"}),
+    Scenario("GET", "/workouts/weekly/workouts"),
+    Scenario("GET", "/workouts/weekly/workouts", lambda i, context: {"params": {"include": "weather"}}, "include=weather"),
+    Scenario("GET", "/workouts/weekly/{data_point}/sum", lambda i, context: {"path": "/workouts/weekly/distance/sum"}),
+    Scenario("GET", "/workouts/weekly/{data_point}/average", lambda i, context: {"path": "/workouts/weekly/duration/average"}),
+    Scenario("GET", "/workouts/personal-bests/distance"),
+    Scenario("GET", "/workouts/personal-bests/duration"),
+    Scenario("GET", "/workouts/leaderboards/{metric}", lambda i, context: {"path": "/workouts/leaderboards/pace", "params": {"limit": 100}}),
+    Scenario("GET", "/workouts/advice/weather/outfit/{city}", lambda i, context: {"path": "/workouts/advice/weather/outfit/Durham"}),
+    Scenario("GET", "/workouts/advice/weather/outfit/{city}", lambda i, context: {"path": "/workouts/advice/weather/outfit/Durham", "params": {"refresh": True}}, "refresh"),
+    Scenario("GET", "/workouts/advice/weather/outfit/{city}/stream", lambda i, context: {"path": "/workouts/advice/weather/outfit/Durham/stream", "params": {"refresh": True}}),
+    Scenario("GET", "/workouts/advice/improvement/"),
+    Scenario("GET", "/workouts/advice/improvement/stream", lambda i, context: {"params": {"refresh": True}}),
+    Scenario("POST", "/workouts/advice/improvement/batch", lambda i, context: {"json": [workout_id(i * 10 + offset, context) for offset in range(10)]}),
+    Scenario("GET", "/workouts/advice/improvement/{workout_id}", lambda i, context: {"path": f"/workouts/advice/improvement/{ workout_id(i, context) }"}),
+    Scenario("GET", "/workouts/advice/improvement/{workout_id}/stream", lambda i, context: {"path": f"/workouts/advice/improvement/{ workout_id(i, context) }/stream"}),
+    Scenario("GET", "/weather/{city}/forecast", lambda i, context: {"path": "/weather/Raleigh/forecast"}),
+    Scenario("GET", "/weather/{city}/current", lambda i, context: {"path": "/weather/Raleigh/current"}),
+    Scenario("GET", "/weather/forecast", lambda i, context: {"params": {"cities": SAVED_CITIES}}),
+    Scenario("GET", "/weather/current", lambda i, context: {"params": {"cities": SAVED_CITIES}}),
+    Scenario("GET", "/weather/geocode/cache"),
+    Scenario("GET", "/weather/export"),
+    Scenario("GET", "/weather/{weather_id}/", lambda i, context: {"path": f"/weather/{ i % context['weather_rows'] + 1 }/"}),
+    Scenario("GET", "/metrics"),
+    Scenario("POST", "/weather/{city}/forecast", lambda i, context: {"path": "/weather/Boone/forecast"}),
+    Scenario("POST", "/weather/{city}/current", lambda i, context: {"path": "/weather/Boone/current"}),
+    Scenario("POST", "/workouts/", lambda i, context: {"json": new_workout(i)}),
+    Scenario("POST", "/workouts/import", lambda i, context: {
+        "content": "\n".join(json.dumps(new_workout(i * 100 + offset)) for offset in range(100)),
+        "headers": {"Content-Type": "application/x-ndjson"}
+    }),
+    Scenario("PUT", "/workouts/{workout_id}", lambda i, context: {
+        "path": f"/workouts/{ workout_id(i, context) }",
+        "json": {**new_workout(i), "id": workout_id(i, context)}
+    }),
+    # Deletes count down from the last seeded row, so every request deletes a row that still exists
+    Scenario("DELETE", "/workouts/{workout_id}", lambda i, context: {"path": f"/workouts/{ context['rows'] - i % context['rows'] }"}),
+    Scenario("DELETE", "/weather/{weather_id}/", lambda i, context: {"path": f"/weather/{ context['weather_rows'] - i % context['weather_rows'] }/"}),
+]
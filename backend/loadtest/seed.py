@@ -0,0 +1,90 @@
+"""
+Seeds a SQLite database with a reproducible set of workouts and their weather for the load tests.
+
+Run from the root directory of the repo:
+    python -m backend.loadtest.seed loadtest.db 100000
+"""
+
+from datetime import date, timedelta
+import random, sys
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from ..database import Base
+from ..entities.weather import WeatherEntity
+from ..entities.workout import WorkoutEntity, workout_pace
+from ..migrations import run_migrations
+from ..services.workout import WorkoutService
+
+# Cities the seeded workouts are logged in
+SEED_CITIES = ("chapel hill", "durham", "raleigh", "charlotte", "asheville", "boone", "wilmington", "greensboro")
+
+# Seeded workouts are spread over this many days up to today
+SEED_DAYS = 365
+
+# Rows inserted per statement
+SEED_BATCH_SIZE = 50000
+
+
+def seed_database(path: str, rows: int, seed: int = 0) -> int:
+    """
+    Creates the schema in a new SQLite file and fills it with workouts, one weather row per city and day, and the daily rollup.
+    The same rows and seed always produce the same database.
+
+    Params:
+        path: The SQLite file to create
+        rows: How many workouts to insert
+        seed: Seed of the generated workouts
+
+    Returns:
+        int: How many weather rows were inserted
+    """
+
+    engine = create_engine(f"sqlite:///{ path }")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    rng = random.Random(seed)
+    today = date.today()
+    days = [today - timedelta(days=offset) for offset in range(SEED_DAYS)]
+
+    with Session(engine) as session:
+        weather_rows = [
+            {
+                "city": city, "date": day, "feels_like": 60, "humidity": 50, "temp_min": 55, "temp_max": 70, "temp_avg": 62,
+                "wind_speed": 5, "weather_main": "Clear", "weather_description": "clear sky", "is_current": False
+            }
+            for city in SEED_CITIES for day in days
+        ]
+        session.execute(insert(WeatherEntity), weather_rows)
+        # Weather IDs follow the insertion order, so each city and day can be linked without reading them back
+        weather_ids = {(row["city"], row["date"]): index + 1 for index, row in enumerate(weather_rows)}
+
+        for start in range(0, rows, SEED_BATCH_SIZE):
+            batch = []
+            for id in range(start + 1, min(start + SEED_BATCH_SIZE, rows) + 1):
+                city, day = rng.choice(SEED_CITIES), rng.choice(days)
+                distance, duration = round(rng.uniform(1, 15), 2), rng.randint(8, 150)
+                batch.append({
+                    "id": id, "name": f"Run { id }", "city": city.title(), "distance": distance, "duration": duration,
+                    "pace": workout_pace(distance, duration), "date": day, "weather_id": weather_ids[(city, day)]
+                })
+            session.execute(insert(WorkoutEntity), batch)
+
+        session.commit()
+        WorkoutService(session, read_session=session).rebuild_daily_rollup()
+
+    engine.dispose()
+
+    return len(weather_rows)
+
+
+def main() -> None:
+    path, rows = sys.argv[1], int(sys.argv[2])
+    weather_rows = seed_database(path, rows)
+    print(f"Seeded {path} with {rows} workouts and {weather_rows} weather rows")
+
+
+if __name__ == "__main__":
+    main()
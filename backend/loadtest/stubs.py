@@ -0,0 +1,142 @@
+"""
+Local stand-ins for Nominatim, OpenWeather, and OpenAI, so the load tests never leave the machine.
+
+Every stub waits for a configurable latency before it answers and fails a configurable share of requests,
+so the API can be measured against slow or flaky upstreams as well as fast ones.
+
+Run from the root directory of the repo:
+    python -m backend.loadtest.stubs --port 8100 --latency-ms 50 --error-rate 0.01
+"""
+
+from datetime import datetime, timedelta
+import argparse, asyncio, hashlib, json, random, time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Cities Nominatim does not know, to exercise the negative geocoding cache
+UNKNOWN_CITIES = {"atlantis"}
+
+# Advice returned by the OpenAI stub, streamed one word at a time
+ADVICE_TEXT = "Keep an easy pace for the first mile, then settle into a steady effort and finish with a short stretch."
+
+
+def create_stub_app(latency_ms: float = 0, jitter_ms: float = 0, openai_latency_ms: float = 0, error_rate: float = 0, seed: int = 0) -> FastAPI:
+    """
+    Creates the stub upstream app.
+
+    Params:
+        latency_ms: How long Nominatim and OpenWeather take to answer
+        jitter_ms: Random extra latency added to every answer, up to this many milliseconds
+        openai_latency_ms: How long OpenAI takes before it starts answering
+        error_rate: Share of requests answered with a 500, between 0 and 1
+        seed: Seed of the latency jitter and the injected errors, so runs are reproducible
+
+    Returns:
+        FastAPI: The app serving /nominatim/search, /openweather/forecast, /openweather/weather, and /openai/v1/chat/completions
+    """
+
+    app = FastAPI(title="Load test upstream stubs")
+    rng = random.Random(seed)
+
+    async def respond(base_latency_ms: float) -> bool:
+        """
+        Waits out the latency of one answer and decides whether it fails.
+        """
+
+        await asyncio.sleep((base_latency_ms + rng.uniform(0, jitter_ms)) / 1000)
+
+        return rng.random() < error_rate
+
+    def failure() -> JSONResponse:
+        return JSONResponse({"error": {"message": "Injected upstream failure", "type": "server_error"}}, status_code=500)
+
+    @app.get("/nominatim/search")
+    async def search(q: str):
+        if await respond(latency_ms):
+            return failure()
+
+        if q.lower() in UNKNOWN_CITIES:
+            return []
+
+        # Stable coordinates per city
+        digest = hashlib.sha256(q.lower().encode()).digest()
+        return [{"lat": str(25 + digest[0] / 255 * 20), "lon": str(-120 + digest[1] / 255 * 50)}]
+
+    @app.get("/openweather/forecast")
+    async def forecast():
+        if await respond(latency_ms):
+            return failure()
+
+        now = datetime.now()
+        entries = [
+            {
+                "dt_txt": (now + timedelta(hours=3 * index)).strftime("%Y-%m-%d %H:00:00"),
+                "main": {"feels_like": 60 + index % 5, "humidity": 50, "temp_min": 55, "temp_max": 70, "temp": 62},
+                "wind": {"speed": 5},
+                "weather": [{"main": "Rain", "description": "light rain"} if index % 3 == 0 else {"main": "Clear", "description": "clear sky"}],
+            }
+            for index in range(40)
+        ]
+
+        return {"list": entries}
+
+    @app.get("/openweather/weather")
+    async def current_weather():
+        if await respond(latency_ms):
+            return failure()
+
+        return {
+            "main": {"feels_like": 60, "humidity": 50, "temp_min": 55, "temp_max": 70, "temp": 62},
+            "wind": {"speed": 5},
+            "weather": [{"main": "Clear", "description": "clear sky"}],
+        }
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+
+        if await respond(openai_latency_ms):
+            return failure()
+
+        completion = {"id": "chatcmpl-stub", "created": int(time.time()), "model": body.get("model", "stub")}
+
+        if not body.get("stream"):
+            return {
+                **completion,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ADVICE_TEXT}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+
+        def chunks():
+            for index, word in enumerate(ADVICE_TEXT.split(" ")):
+                delta = {"content": word if index == 0 else " " + word}
+                yield "data: " + json.dumps({**completion, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}) + "\n\n"
+            yield "data: " + json.dumps({**completion, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}) + "\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--openai-latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_stub_app(args.latency_ms, args.jitter_ms, args.openai_latency_ms, args.error_rate, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,24 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from .database import engine, Base
-from .api import workout, weather
+from .migrations import run_migrations
+from .api import metrics, workout, weather
+from .api.responses import TimedJSONResponse
+from .services.http_client import close_http_client
+from .services.weather_prefetcher import WEATHER_PREFETCH_ENABLED, weather_prefetcher
+from .middleware import GZipMiddleware, MetricsMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep the weather of recently requested cities fresh so requests rarely wait on OpenWeather
+    if WEATHER_PREFETCH_ENABLED:
+        weather_prefetcher.start()
+    yield
+    await weather_prefetcher.stop()
+    # Close the pooled connections to OpenWeather and Nominatim on shutdown
+    await close_http_client()
+
 
 app = FastAPI(
     title="Running Workouts API: App Team Takehome",
@@ -8,11 +26,21 @@ app = FastAPI(
     version="0.1",
     openapi_tags=[
         workout.openapi_tags,
-        weather.openapi_tags
-    ]
+        weather.openapi_tags,
+        metrics.openapi_tags
+    ],
+    default_response_class=TimedJSONResponse,
+    lifespan=lifespan
 )
 
+# Compress large JSON and CSV responses. Server-sent events and NDJSON streams are sent uncompressed so they are not held back.
+app.add_middleware(GZipMiddleware)
+# Added last so it runs first and its timings include compression
+app.add_middleware(MetricsMiddleware)
+
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app.include_router(workout.api)
-app.include_router(weather.api)
\ No newline at end of file
+app.include_router(weather.api)
+app.include_router(metrics.api)
\ No newline at end of file
@@ -0,0 +1,245 @@
+"""
+In-process metrics of request latency, SQL statements, and outbound calls, rendered in the Prometheus text format.
+
+Every request gets its own RequestTimings through a context variable. The threadpool copies the context, so sync
+routes and the SQLAlchemy hooks running in worker threads add to the timings of the request they belong to.
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from threading import Lock
+import time
+
+from sqlalchemy import Engine, event
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the SQL statements per request buckets
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+@dataclass
+class RequestTimings:
+    """
+    Where the time of one request went, in seconds.
+    """
+
+    db: float = 0.0
+    db_statements: int = 0
+    upstream: float = 0.0
+    serialize: float = 0.0
+    # When the route returned its result, which FastAPI then validates, encodes, and renders as the serialize phase
+    serialize_started: float | None = None
+
+
+request_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """
+    Cumulative histogram per label set, like a Prometheus histogram.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Label values -> (count per bucket, sum, count)
+        self._series: dict[tuple, tuple[list[int], float, int]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            counts, total, count = self._series.get(label_values) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._series[label_values] = (counts, total + value, count + 1)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP { self.name } { self.help }"
+        yield f"# TYPE { self.name } histogram"
+
+        with self._lock:
+            series = sorted(self._series.items())
+
+        for label_values, (counts, total, count) in series:
+            labels = _format_labels(self.labels, label_values)
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{ self.name }_bucket{ _format_labels(self.labels + ('le',), label_values + (_format_number(bound),)) } { bucket_count }"
+            yield f"{ self.name }_bucket{ _format_labels(self.labels + ('le',), label_values + ('+Inf',)) } { count }"
+            yield f"{ self.name }_sum{ labels } { _format_number(total) }"
+            yield f"{ self.name }_count{ labels } { count }"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+class Counter:
+    """
+    Counter per label set, like a Prometheus counter.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series: dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP { self.name } { self.help }"
+        yield f"# TYPE { self.name } counter"
+
+        with self._lock:
+            series = sorted(self._series.items())
+
+        for label_values, value in series:
+            yield f"{ self.name }{ _format_labels(self.labels, label_values) } { _format_number(value) }"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+http_request_duration = Histogram("http_request_duration_seconds", "Latency of HTTP requests until the whole response is sent.", ("method", "route", "status"))
+http_request_db_duration = Histogram("http_request_db_duration_seconds", "Time spent executing SQL statements per HTTP request.", ("method", "route"))
+http_request_db_statements = Histogram("http_request_db_statements", "SQL statements executed per HTTP request.", ("method", "route"), STATEMENT_COUNT_BUCKETS)
+db_statement_duration = Histogram("db_statement_duration_seconds", "Latency of single SQL statements.", ())
+upstream_request_duration = Histogram("upstream_request_duration_seconds", "Latency of outbound calls by upstream and call site.", ("upstream", "call_site"))
+upstream_errors = Counter("upstream_errors_total", "Outbound calls that raised or returned an error status.", ("upstream", "call_site"))
+weather_prefetches = Counter("weather_prefetches_total", "Background weather refreshes by kind and outcome.", ("kind", "outcome"))
+weather_fallbacks = Counter("weather_fallbacks_total", "Requests served stored weather because the weather provider was too slow or unavailable.", ("kind", "reason"))
+
+METRICS = (http_request_duration, http_request_db_duration, http_request_db_statements, db_statement_duration, upstream_request_duration, upstream_errors, weather_prefetches, weather_fallbacks)
+
+
+def render_metrics() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics, one sample per line
+    """
+
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+def clear_metrics() -> None:
+    """
+    Clears every metric. Used by the tests.
+    """
+
+    for metric in METRICS:
+        metric.clear()
+
+
+@contextmanager
+def request_timer(phase: str) -> Iterator[None]:
+    """
+    Adds the time spent in the block to a phase of the current request's timings, i.e. 'serialize'.
+    Does nothing outside of a request.
+    """
+
+    timings = request_timings.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            setattr(timings, phase, getattr(timings, phase) + time.perf_counter() - started)
+
+
+class UpstreamCall:
+    """
+    An outbound call being timed. Set error when the call answered with an error status.
+    """
+
+    error = False
+
+
+@contextmanager
+def upstream_call(upstream: str, call_site: str) -> Iterator[UpstreamCall]:
+    """
+    Times an outbound call and counts it as an error if it raises or is marked as failed.
+
+    Params:
+        upstream: The upstream being called, i.e. 'openweather'
+        call_site: The method making the call, i.e. 'fetch_current_weather_from_api'
+
+    Returns:
+        Iterator[UpstreamCall]: The call, to mark as failed on an error status
+    """
+
+    call = UpstreamCall()
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        upstream_request_duration.observe(elapsed, upstream, call_site)
+        if call.error:
+            upstream_errors.inc(upstream, call_site)
+
+        timings = request_timings.get()
+        if timings is not None:
+            timings.upstream += elapsed
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    connection.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    _record_statement(connection)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context) -> None:
+    if exception_context.connection is not None:
+        _record_statement(exception_context.connection)
+
+
+def _record_statement(connection) -> None:
+    """
+    Records a finished SQL statement, globally and in the timings of the request that executed it.
+    """
+
+    started = connection.info.get("statement_started")
+    if not started:
+        return
+
+    elapsed = time.perf_counter() - started.pop()
+    db_statement_duration.observe(elapsed)
+
+    timings = request_timings.get()
+    if timings is not None:
+        timings.db += elapsed
+        timings.db_statements += 1
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+
+    return "{" + ",".join(f'{ name }="{ value }"' for name, value in zip(names, escaped)) + "}"
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
@@ -0,0 +1,160 @@
+"""ASGI middleware for the API."""
+
+import os, time, zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import RequestTimings, http_request_db_duration, http_request_db_statements, http_request_duration, request_timings
+
+# Responses smaller than this are not worth compressing
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", 1000))
+GZIP_COMPRESS_LEVEL = int(os.getenv("GZIP_COMPRESS_LEVEL", 6))
+
+# zlib window size that writes a gzip header and trailer around the deflate stream
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Streams that have to reach the client as they are written, and files that are already compressed.
+# gzip holds small writes back until it has a full block, which would stall server-sent events and streamed advice.
+GZIP_EXCLUDED_MEDIA_TYPES = {"text/event-stream", "application/x-ndjson", "application/vnd.apache.parquet"}
+
+
+class GZipMiddleware:
+    """
+    Compresses responses for clients that accept gzip, except the GZIP_EXCLUDED_MEDIA_TYPES, which are sent as is.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = GZIP_MINIMUM_SIZE, compresslevel: int = GZIP_COMPRESS_LEVEL) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("Accept-Encoding", ""):
+            await self.app(scope, receive, send)
+            return
+
+        responder = GZipResponder(send, self.minimum_size, self.compresslevel)
+        await self.app(scope, receive, responder.send)
+
+
+class GZipResponder:
+    """
+    Compresses the messages of one response as they are sent. It only relies on the ASGI messages, not on Starlette internals.
+    The start of the response is held back until the first body message, which tells if the response is large enough or streamed.
+    """
+
+    def __init__(self, send: Send, minimum_size: int, compresslevel: int) -> None:
+        self._send = send
+        self._minimum_size = minimum_size
+        self._compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, GZIP_WBITS)
+        self._start: Message | None = None
+        self._state = "start"
+
+    async def send(self, message: Message) -> None:
+        if self._state == "passthrough" or message["type"] not in ("http.response.start", "http.response.body"):
+            await self._send(message)
+            return
+
+        if message["type"] == "http.response.start":
+            # The media type is known once the response starts, before any of the body is sent
+            headers = Headers(raw=message["headers"])
+            media_type = headers.get("content-type", "").split(";")[0].strip()
+
+            if media_type in GZIP_EXCLUDED_MEDIA_TYPES or "content-encoding" in headers:
+                self._state = "passthrough"
+                await self._send(message)
+            else:
+                self._start = message
+
+            return
+
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+
+        if self._state == "start":
+            if not more_body and len(body) < self._minimum_size:
+                self._state = "passthrough"
+                await self._send(self._start)
+                await self._send(message)
+                return
+
+            compressed = self._compressor.compress(body) + (b"" if more_body else self._compressor.flush())
+            headers = MutableHeaders(scope=self._start)
+            headers["Content-Encoding"] = "gzip"
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                # A streamed response's compressed length is only known once it ends
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(compressed))
+
+            self._state = "compressing"
+            await self._send(self._start)
+            await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+            return
+
+        compressed = self._compressor.compress(body) + (b"" if more_body else self._compressor.flush())
+        await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, SQL time, and SQL statement count of every request per route,
+    and adds a Server-Timing header that breaks the request down into db, upstream, and serialize time.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+
+            # Headers can only be added before the body, so streamed responses report the time until they start
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", server_timing(timings, time.perf_counter() - started))
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+
+            # The router stores the matched route in the scope, and its path template keeps the label count bounded
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], path, str(status))
+            http_request_db_duration.observe(timings.db, scope["method"], path)
+            http_request_db_statements.observe(timings.db_statements, scope["method"], path)
+
+
+def server_timing(timings: RequestTimings, total: float) -> str:
+    """
+    Formats request timings as a Server-Timing header, in milliseconds.
+
+    Params:
+        timings: Where the time of the request went so far
+        total: The time since the request was received, in seconds
+
+    Returns:
+        str: The header value, i.e. 'db;dur=1.2;desc="3 queries", upstream;dur=0, serialize;dur=0.4, total;dur=2.1'
+    """
+
+    return ", ".join([
+        f'db;dur={ timings.db * 1000:.2f};desc="{ timings.db_statements } queries"',
+        f"upstream;dur={ timings.upstream * 1000:.2f}",
+        f"serialize;dur={ timings.serialize * 1000:.2f}",
+        f"total;dur={ total * 1000:.2f}",
+    ])
@@ -0,0 +1,193 @@
+"""
+Idempotent schema upgrades for databases created by older versions of the app.
+
+Base.metadata.create_all only creates missing tables, so new columns and indexes on
+existing tables are applied here when the server starts.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import Connection, Engine, inspect, text
+
+from .database import Base
+from .entities.weather import CURRENT_WEATHER_DATE_FORMAT
+
+# Bumped in SQLite's user_version once the date columns hold 'YYYY-MM-DD' dates only
+DATE_COLUMNS_SCHEMA_VERSION = 1
+
+# Tables whose date column became a Date column
+DATE_COLUMN_TABLES = ("workout", "weather", "workout_daily_rollup")
+
+
+def run_migrations(engine: Engine) -> None:
+    """
+    Applies every schema upgrade that has not been applied to the database yet.
+
+    Params:
+        engine: The engine connected to the database to upgrade
+    """
+
+    with engine.begin() as connection:
+        _add_workout_pace_column(connection)
+        _add_weather_bucket_start_column(connection)
+        _convert_date_columns(connection)
+        _backfill_workout_rollup(connection)
+        _dedupe_forecast_rows(connection)
+        _create_missing_indexes(connection)
+
+
+def _add_column(connection: Connection, table: str, column: str, definition: str) -> bool:
+    """
+    Adds a column to a table if it does not exist yet.
+
+    Returns:
+        bool: True if the column was added
+    """
+
+    columns = {existing["name"] for existing in inspect(connection).get_columns(table)}
+    if column in columns:
+        return False
+
+    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+    return True
+
+
+def _add_workout_pace_column(connection: Connection) -> None:
+    """
+    Adds the stored pace column to the workout table and backfills it from the distance and duration.
+    """
+
+    if _add_column(connection, "workout", "pace", "FLOAT"):
+        connection.execute(text("UPDATE workout SET pace = duration * 1.0 / distance WHERE distance > 0"))
+
+
+def _add_weather_bucket_start_column(connection: Connection) -> None:
+    """
+    Adds the current weather freshness bucket column to the weather table.
+    Existing rows are left without a bucket, so they are never served as the current weather again.
+    """
+
+    _add_column(connection, "weather", "bucket_start", "INTEGER")
+
+
+def _convert_date_columns(connection: Connection) -> None:
+    """
+    Upgrades the date columns, which used to be strings, to hold dates only.
+    The current weather kept its time in the date, so the time moves to the new fetched_at column.
+    Workout dates that were stored unpadded, i.e. '2024-9-13', are padded and the daily rollup is rebuilt from them.
+    SQLite stores Date columns as 'YYYY-MM-DD' text, so only the values change and user_version records the upgrade.
+    PostgreSQL columns are altered to DATE.
+    """
+
+    dialect = connection.dialect.name
+
+    if dialect == "sqlite":
+        if connection.exec_driver_sql("PRAGMA user_version").scalar() >= DATE_COLUMNS_SCHEMA_VERSION:
+            return
+    elif all(_column_type(connection, table, "date") == "DATE" for table in DATE_COLUMN_TABLES):
+        return
+
+    _add_column(connection, "weather", "fetched_at", "TIMESTAMP")
+
+    for value in connection.execute(text("SELECT DISTINCT date FROM weather")).scalars():
+        if not isinstance(value, str):
+            continue
+        if len(value) > 10:
+            fetched_at = datetime.strptime(value, CURRENT_WEATHER_DATE_FORMAT)
+            connection.execute(text("UPDATE weather SET date = :date, fetched_at = :fetched_at WHERE date = :value"), {"date": fetched_at.strftime("%Y-%m-%d"), "fetched_at": fetched_at, "value": value})
+        elif _padded_date(value) != value:
+            connection.execute(text("UPDATE weather SET date = :date WHERE date = :value"), {"date": _padded_date(value), "value": value})
+
+    workout_dates_changed = False
+    for value in connection.execute(text("SELECT DISTINCT date FROM workout")).scalars():
+        if isinstance(value, str) and _padded_date(value) != value:
+            connection.execute(text("UPDATE workout SET date = :date WHERE date = :value"), {"date": _padded_date(value), "value": value})
+            workout_dates_changed = True
+
+    if workout_dates_changed:
+        _rebuild_workout_rollup(connection)
+
+    if dialect == "sqlite":
+        connection.exec_driver_sql(f"PRAGMA user_version = {DATE_COLUMNS_SCHEMA_VERSION}")
+    else:
+        for table in DATE_COLUMN_TABLES:
+            connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN date TYPE DATE USING date::date"))
+
+
+def _backfill_workout_rollup(connection: Connection) -> None:
+    """
+    Builds the daily rollup of databases whose workouts were logged before the rollup table existed, which create_all creates empty.
+    """
+
+    if connection.execute(text("SELECT 1 FROM workout_daily_rollup LIMIT 1")).first() is not None:
+        return
+
+    if connection.execute(text("SELECT 1 FROM workout LIMIT 1")).first() is not None:
+        _rebuild_workout_rollup(connection)
+
+
+def _rebuild_workout_rollup(connection: Connection) -> None:
+    """
+    Replaces every daily rollup row with one computed from the workout table.
+    """
+
+    connection.execute(text("DELETE FROM workout_daily_rollup"))
+    connection.execute(text(
+        "INSERT INTO workout_daily_rollup (date, city, count, total_distance, total_duration, min_pace, max_distance) "
+        "SELECT date, city, count(id), sum(distance), sum(duration), min(pace), max(distance) FROM workout GROUP BY date, city"
+    ))
+
+
+def _dedupe_forecast_rows(connection: Connection) -> None:
+    """
+    Keeps only the most recently stored forecast per city and day, which used to be appended on every fetch, so their unique key can be created.
+    Workouts linked to a removed forecast are linked to the kept one.
+    """
+
+    if "uq_weather_forecast_day" in {index["name"] for index in inspect(connection).get_indexes("weather")}:
+        return
+
+    # The newest forecast of the same city and day as the weather row 'forecast'
+    newest = "SELECT max(newest.id) FROM weather AS newest WHERE newest.city = forecast.city AND newest.date = forecast.date AND NOT newest.is_current"
+
+    connection.execute(text(
+        f"UPDATE workout SET weather_id = (SELECT ({ newest }) FROM weather AS forecast WHERE forecast.id = workout.weather_id) "
+        f"WHERE weather_id IN (SELECT forecast.id FROM weather AS forecast WHERE NOT forecast.is_current AND forecast.id < ({ newest }))"
+    ))
+    connection.execute(text(
+        f"DELETE FROM weather WHERE id IN (SELECT forecast.id FROM weather AS forecast WHERE NOT forecast.is_current AND forecast.id < ({ newest }))"
+    ))
+
+
+def _column_type(connection: Connection, table: str, column: str) -> str:
+    """
+    Looks up the type of a column as the database names it, i.e. 'DATE' or 'VARCHAR'.
+    """
+
+    for existing in inspect(connection).get_columns(table):
+        if existing["name"] == column:
+            return str(existing["type"]).upper()
+
+    return ""
+
+
+def _padded_date(value: str) -> str:
+    """
+    Formats a stored date as 'YYYY-MM-DD'. Raises a ValueError naming the date if it is not a date at all, so it can be fixed by hand.
+    """
+
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Cannot migrate the date '{ value }' to a date column, fix it to be formatted as YYYY-MM-DD")
+
+
+def _create_missing_indexes(connection: Connection) -> None:
+    """
+    Creates the indexes declared on the entities that do not exist in the database yet.
+    """
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+class GeocodeCacheStats(BaseModel):
+    """
+    Pydantic model to represent the hit and miss counters of the geocoding cache since the server started.
+    """
+
+    memory_hits: int
+    database_hits: int
+    misses: int
+    negative_hits: int
+    memory_size: int
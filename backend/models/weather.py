@@ -23,3 +23,5 @@ class Weather(BaseModel):
     weather_main: str
     weather_description: str
     is_current: bool
+    # True when the stored weather is served because fresh weather could not be fetched in time
+    stale: bool = False
@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+class WeatherError(BaseModel):
+    """
+    Pydantic model to represent a city of a batch weather request whose weather could not be retrieved.
+
+    'status_code' is the status the city would have gotten on its own, i.e. 404 for a city that could not be found, so one failed city does not fail the whole batch.
+    """
+
+    status_code: int
+    error: str
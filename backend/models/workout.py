@@ -1,5 +1,6 @@
 import datetime
-from pydantic import BaseModel
+from functools import lru_cache
+from pydantic import BaseModel, Field, field_validator
 from pytz import timezone
 
 from backend.models.weather import Weather
@@ -18,8 +19,28 @@ class Workout(BaseModel):
     city: str
     distance: float
     duration: int
-    date: str | None = datetime.datetime.now(tz).strftime("%Y-%m-%d")
+    # The day of the workout as 'YYYY-MM-DD', today if it is not given
+    date: str | None = Field(default_factory=lambda: datetime.datetime.now(tz).strftime("%Y-%m-%d"))
+    pace: float | None = None
     weather_id: int | None = None
     weather: Weather | None = None    
 
-    
\ No newline at end of file
+    @field_validator("date")
+    @classmethod
+    def check_date(cls, value: str | None) -> str | None:
+        if value is not None:
+            validate_date(value)
+        return value
+
+
+@lru_cache(maxsize=4096)
+def validate_date(value: str) -> None:
+    """
+    Raises a ValueError unless a date is formatted as 'YYYY-MM-DD'. Workouts repeat the same dates, so results are memoized.
+    Unpadded months and days are rejected too, so every stored date sorts correctly.
+    """
+
+    if len(value) != 10:
+        raise ValueError(f"Date '{ value }' is not formatted as YYYY-MM-DD")
+
+    datetime.datetime.strptime(value, "%Y-%m-%d")
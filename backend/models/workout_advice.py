@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+class WorkoutAdvice(BaseModel):
+    """
+    Pydantic model to represent the improvement advice for one workout of a batch.
+
+    Exactly one of 'advice' and 'error' is set, so one failed workout does not fail the whole batch.
+    """
+
+    workout_id: int
+    advice: str | None = None
+    error: str | None = None
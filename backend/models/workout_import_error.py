@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+class WorkoutImportError(BaseModel):
+    """
+    Pydantic model to represent one row of a workout import that could not be imported.
+
+    'line' is the 1-based line of the row in the uploaded file, so the row can be found and fixed.
+    """
+
+    line: int
+    error: str
@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+
+from backend.models.workout_import_error import WorkoutImportError
+
+class WorkoutImportResult(BaseModel):
+    """
+    Pydantic model to represent the outcome of a bulk workout import.
+
+    Rows that fail are skipped and reported in 'errors' while the rest of the file is imported.
+    Only the first errors are listed, 'failed' counts every row that was skipped.
+    """
+
+    imported: int = 0
+    failed: int = 0
+    errors: list[WorkoutImportError] = []
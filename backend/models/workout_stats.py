@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+
+class WorkoutStats(BaseModel):
+    """
+    Pydantic model to represent one row of aggregated workout statistics.
+
+    Each row is the result of a single SQL aggregate query over the 'Workout' database table.
+    When the statistics are grouped (by week, month, or city), 'group' holds the group key,
+    otherwise it is None and the row covers every workout in the requested date range.
+
+    Stats are keyed by '<metric>_<aggregate>', i.e. 'distance_sum' or 'duration_avg'.
+    """
+
+    group: str | None = None
+    count: int
+    stats: dict[str, float | None]
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of how fast list endpoints turn workout rows into a JSON response body.
+
+Compares the previous path, which converted every row and its weather into models, had FastAPI validate the
+list again against the response_model, and serialized it with the stdlib json module, with the fast path, which
+converts each weather row once, skips the response_model pass, and serializes with orjson through ModelListResponse.
+
+Run from the root directory of the repo:
+    python -m backend.scripts.benchmark_serialization [rows]
+"""
+
+from datetime import date
+import asyncio, json, sys, time
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from ..api.responses import ModelListResponse
+from ..entities.weather import WeatherEntity
+from ..entities.workout import WorkoutEntity
+from ..models.workout import Workout
+from ..services.workout import workout_models
+
+
+# Workouts per weather row, i.e. workouts logged in the same city on the same day
+WORKOUTS_PER_WEATHER = 20
+
+
+def build_entities(rows: int) -> list[WorkoutEntity]:
+    weathers = [
+        WeatherEntity(id=id, city="chapel hill", date=date(2024, 9, 13), feels_like=60, humidity=50, temp_min=55, temp_max=70, temp_avg=62, wind_speed=5, weather_main="Clear", weather_description="clear sky", is_current=True)
+        for id in range(rows // WORKOUTS_PER_WEATHER + 1)
+    ]
+
+    return [
+        WorkoutEntity(id=id, name=f"Run {id}", city="Chapel Hill", distance=3.1, duration=30, pace=30 / 3.1, date=date(2024, 9, 13), weather_id=id // WORKOUTS_PER_WEATHER, weather=weathers[id // WORKOUTS_PER_WEATHER])
+        for id in range(1, rows + 1)
+    ]
+
+
+def before(entities: list[WorkoutEntity], field, include_weather: bool) -> bytes:
+    models = [entity.to_model(include_weather) for entity in entities]
+    content = asyncio.run(serialize_response(field=field, response_content=models))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def after(entities: list[WorkoutEntity], include_weather: bool) -> bytes:
+    return ModelListResponse(workout_models(entities, include_weather)).body
+
+
+def rows_per_second(function, rows: int, repeat: int = 5) -> float:
+    function()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+
+    return rows * repeat / (time.perf_counter() - started)
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    entities = build_entities(rows)
+    field = create_model_field(name="Response", type_=list[Workout], mode="serialization")
+
+    for include_weather in (False, True):
+        assert json.loads(before(entities, field, include_weather)) == json.loads(after(entities, include_weather))
+
+        before_rate = rows_per_second(lambda: before(entities, field, include_weather), rows)
+        after_rate = rows_per_second(lambda: after(entities, include_weather), rows)
+
+        print(f"Serializing {rows} workouts {'with' if include_weather else 'without'} their weather")
+        print(f"  before (to_model per row, response_model, json): {before_rate:>10,.0f} rows/s")
+        print(f"  after  (shared weather models, orjson):          {after_rate:>10,.0f} rows/s")
+        print(f"  speedup: {after_rate / before_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
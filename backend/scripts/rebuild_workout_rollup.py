@@ -0,0 +1,24 @@
+"""
+Rebuilds the workout_daily_rollup table from the workout table.
+
+Run from the root directory of the repo after upgrading an existing sql_app.db:
+    python -m backend.scripts.rebuild_workout_rollup
+"""
+
+from sqlalchemy.orm import Session
+
+from ..database import engine, Base
+from ..services.workout import WorkoutService
+
+
+def main() -> None:
+    Base.metadata.create_all(bind=engine)
+
+    with Session(engine) as session:
+        rows = WorkoutService(session, read_session=session).rebuild_daily_rollup()
+
+    print(f"Rebuilt {rows} workout_daily_rollup rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+import hashlib, json, os
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+from fastapi import Depends
+
+from backend.entities.advice_cache import AdviceCacheEntity
+from ..database import db_session, dialect_insert
+
+# How long generated advice is reused for, and how many advices are kept
+ADVICE_CACHE_TTL_SECONDS = int(os.getenv("ADVICE_CACHE_TTL_SECONDS", 24 * 60 * 60))
+ADVICE_CACHE_MAX_ENTRIES = int(os.getenv("ADVICE_CACHE_MAX_ENTRIES", 10000))
+
+
+def quantize(value: float, step: float) -> float:
+    """
+    Rounds a value to the nearest multiple of a step, so nearly identical prompt inputs share a cached advice.
+
+    Params:
+        value: The value to round
+        step: The step to round to, i.e. 5 for temperatures or 0.5 for distances
+
+    Returns:
+        float: The rounded value
+    """
+
+    return round(round(value / step) * step, 2)
+
+
+def advice_fingerprint(kind: str, inputs: dict) -> str:
+    """
+    Creates the cache key of an advice from its kind and quantized prompt inputs.
+
+    Params:
+        kind: The kind of advice, i.e. 'outfit' or 'improvement'
+        inputs: The quantized inputs the prompt is built from
+
+    Returns:
+        str: The SHA-256 fingerprint of the advice
+    """
+
+    payload = json.dumps({"kind": kind, "inputs": inputs}, sort_keys=True)
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class AdviceCacheService:
+    """
+    Stores the business logic for caching generated OpenAI advice in the advice_cache table.
+    Advice expires after ADVICE_CACHE_TTL_SECONDS, and the least recently used advice is evicted past ADVICE_CACHE_MAX_ENTRIES.
+    """
+
+    def __init__(self, session: Session = Depends(db_session)):
+        self._session = session
+
+
+    def get(self, fingerprint: str) -> str | None:
+        """
+        Retrieves a cached advice and marks it as recently used.
+
+        Params:
+            fingerprint: The fingerprint of the advice
+
+        Returns:
+            str | None: The cached advice, None if it is not cached or has expired
+        """
+
+        entity = self._session.get(AdviceCacheEntity, fingerprint)
+
+        if entity is None or entity.created_at + timedelta(seconds=ADVICE_CACHE_TTL_SECONDS) <= _utc_now():
+            return None
+
+        entity.last_used_at = _utc_now()
+        entity.hits += 1
+        advice = entity.advice
+        self._session.commit()
+
+        return advice
+
+
+    def store(self, fingerprint: str, kind: str, advice: str) -> None:
+        """
+        Caches a generated advice, replacing any previous advice with the same fingerprint, then evicts expired and least recently used advice.
+
+        Params:
+            fingerprint: The fingerprint of the advice
+            kind: The kind of advice, i.e. 'outfit' or 'improvement'
+            advice: The generated advice
+        """
+
+        now = _utc_now()
+
+        statement = dialect_insert(self._session, AdviceCacheEntity).values(fingerprint=fingerprint, kind=kind, advice=advice, created_at=now, last_used_at=now, hits=0)
+        statement = statement.on_conflict_do_update(
+            index_elements=[AdviceCacheEntity.fingerprint],
+            set_={"advice": statement.excluded.advice, "created_at": statement.excluded.created_at, "last_used_at": statement.excluded.last_used_at, "hits": 0}
+        )
+        self._session.execute(statement)
+
+        self._session.execute(delete(AdviceCacheEntity).where(AdviceCacheEntity.created_at <= now - timedelta(seconds=ADVICE_CACHE_TTL_SECONDS)))
+
+        overflow = self._session.scalar(select(func.count()).select_from(AdviceCacheEntity)) - ADVICE_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            least_recently_used = select(AdviceCacheEntity.fingerprint).order_by(AdviceCacheEntity.last_used_at).limit(overflow)
+            self._session.execute(delete(AdviceCacheEntity).where(AdviceCacheEntity.fingerprint.in_(least_recently_used)))
+
+        self._session.commit()
+
+
+def _utc_now() -> datetime:
+    """
+    Returns the current UTC time without a timezone, matching how SQLite stores DateTime columns.
+    """
+
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,84 @@
+import asyncio, time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency while its circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while, so requests fail fast instead of waiting on it.
+    Calls that raise one of the failure types or pass their deadline count as failures. After failure_threshold failures in a row the circuit opens,
+    and calls raise CircuitOpenError without running. After reset_seconds a single trial call is let through: the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, failures: tuple[type[BaseException], ...] = (Exception,)):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        # asyncio.wait_for raises TimeoutError once a call passes its deadline
+        self.failures = failures + (TimeoutError,)
+        self._failure_count = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+
+
+    @property
+    def state(self) -> str:
+        """
+        The state of the circuit: 'closed', 'open', or 'half_open' once a trial call may run.
+        """
+
+        if self._opened_at is None:
+            return "closed"
+
+        return "open" if time.monotonic() - self._opened_at < self.reset_seconds else "half_open"
+
+
+    async def call(self, function: Callable[[], Awaitable[Any]], deadline_seconds: float) -> Any:
+        """
+        Runs the function unless the circuit is open, cancelling it once it runs longer than the deadline.
+
+        Params:
+            function: The coroutine function calling the dependency
+            deadline_seconds: How long the call may take before it is cancelled and counted as a failure
+
+        Returns:
+            Any: The result of the function
+        """
+
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_running):
+            raise CircuitOpenError("The circuit is open")
+
+        trial = state == "half_open"
+        self._trial_running = self._trial_running or trial
+
+        try:
+            result = await asyncio.wait_for(function(), deadline_seconds)
+        except self.failures:
+            self._failure_count += 1
+            if trial or self._failure_count >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            raise
+        finally:
+            if trial:
+                self._trial_running = False
+
+        self._failure_count = 0
+        self._opened_at = None
+
+        return result
+
+
+    def reset(self) -> None:
+        """
+        Closes the circuit and forgets the failures. Used by the tests.
+        """
+
+        self._failure_count = 0
+        self._opened_at = None
+        self._trial_running = False
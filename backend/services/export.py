@@ -0,0 +1,221 @@
+from collections.abc import Iterator
+import csv, io, os
+
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException
+
+from backend.entities.weather import WeatherEntity
+from backend.entities.workout import WorkoutEntity
+from ..database import db_read_session
+
+# Parquet and Arrow IPC need pyarrow, which the requirements pin. CSV still works in an environment without it.
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# How many rows are read from the database and encoded at a time
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 10000))
+
+# Media type of every export format
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Exported columns: name -> (column, Arrow type)
+WORKOUT_EXPORT_COLUMNS = {
+    "id": (WorkoutEntity.id, "int64"),
+    "name": (WorkoutEntity.name, "string"),
+    "city": (WorkoutEntity.city, "string"),
+    "distance": (WorkoutEntity.distance, "float64"),
+    "duration": (WorkoutEntity.duration, "int64"),
+    "date": (WorkoutEntity.date, "date32"),
+    "pace": (WorkoutEntity.pace, "float64"),
+    "weather_id": (WorkoutEntity.weather_id, "int64"),
+}
+
+# Weather columns added to each workout when the export includes its weather
+WORKOUT_WEATHER_EXPORT_COLUMNS = {
+    "weather_date": (WeatherEntity.date, "date32"),
+    "feels_like": (WeatherEntity.feels_like, "float64"),
+    "humidity": (WeatherEntity.humidity, "float64"),
+    "temp_min": (WeatherEntity.temp_min, "float64"),
+    "temp_max": (WeatherEntity.temp_max, "float64"),
+    "temp_avg": (WeatherEntity.temp_avg, "float64"),
+    "wind_speed": (WeatherEntity.wind_speed, "float64"),
+    "weather_main": (WeatherEntity.weather_main, "string"),
+    "weather_description": (WeatherEntity.weather_description, "string"),
+    "weather_is_current": (WeatherEntity.is_current, "bool_"),
+}
+
+WEATHER_EXPORT_COLUMNS = {
+    "id": (WeatherEntity.id, "int64"),
+    "city": (WeatherEntity.city, "string"),
+    "date": (WeatherEntity.date, "date32"),
+    "feels_like": (WeatherEntity.feels_like, "float64"),
+    "humidity": (WeatherEntity.humidity, "float64"),
+    "temp_min": (WeatherEntity.temp_min, "float64"),
+    "temp_max": (WeatherEntity.temp_max, "float64"),
+    "temp_avg": (WeatherEntity.temp_avg, "float64"),
+    "wind_speed": (WeatherEntity.wind_speed, "float64"),
+    "weather_main": (WeatherEntity.weather_main, "string"),
+    "weather_description": (WeatherEntity.weather_description, "string"),
+    "is_current": (WeatherEntity.is_current, "bool_"),
+}
+
+
+class ExportService:
+    """
+    Stores the business logic for exporting workouts and weather as CSV, Parquet, or Arrow IPC files.
+    Rows are read from the database and encoded in chunks of EXPORT_CHUNK_SIZE, so memory stays bounded however large the table is.
+    """
+
+    def __init__(self, read_session: Session = Depends(db_read_session)):
+        self._read_session = read_session
+
+
+    def export_workouts(self, format: str, include_weather: bool = False) -> Iterator[bytes]:
+        """
+        Exports every workout ordered by ID.
+
+        Params:
+            format: 'csv', 'parquet', or 'arrow'
+            include_weather: Add the weather of each workout, joined in the same query
+
+        Returns:
+            Iterator[bytes]: The encoded file, chunk by chunk
+        """
+
+        columns = dict(WORKOUT_EXPORT_COLUMNS)
+        query = select(*(column.label(name) for name, (column, _) in columns.items())).order_by(WorkoutEntity.id)
+
+        if include_weather:
+            columns.update(WORKOUT_WEATHER_EXPORT_COLUMNS)
+            query = query.add_columns(*(column.label(name) for name, (column, _) in WORKOUT_WEATHER_EXPORT_COLUMNS.items()))
+            query = query.outerjoin(WeatherEntity, WorkoutEntity.weather_id == WeatherEntity.id)
+
+        return self._export(query, columns, format)
+
+
+    def export_weather(self, format: str, city: str | None = None) -> Iterator[bytes]:
+        """
+        Exports the stored weather ordered by ID.
+
+        Params:
+            format: 'csv', 'parquet', or 'arrow'
+            city: Optionally only export the weather of this city
+
+        Returns:
+            Iterator[bytes]: The encoded file, chunk by chunk
+        """
+
+        query = select(*(column.label(name) for name, (column, _) in WEATHER_EXPORT_COLUMNS.items())).order_by(WeatherEntity.id)
+
+        if city is not None:
+            query = query.filter(WeatherEntity.city == city.lower())
+
+        return self._export(query, WEATHER_EXPORT_COLUMNS, format)
+
+
+    def _export(self, query: Select, columns: dict, format: str) -> Iterator[bytes]:
+        """
+        Checks that a format can be exported before the response starts, then returns the encoder for it.
+        """
+
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported export format: { format }")
+
+        if format != "csv" and pyarrow is None:
+            raise HTTPException(status_code=501, detail=f"Exporting { format } requires the pyarrow package")
+
+        if format == "csv":
+            return self._encode_csv(query, columns)
+
+        return self._encode_arrow(query, columns, format)
+
+
+    def _chunks(self, query: Select) -> Iterator[list]:
+        """
+        Reads the rows of a query in chunks of EXPORT_CHUNK_SIZE.
+        Uses its own session because a streamed response outlives the request's session.
+        """
+
+        with Session(self._read_session.get_bind()) as session:
+            yield from session.execute(query.execution_options(yield_per=EXPORT_CHUNK_SIZE)).partitions()
+
+
+    def _encode_csv(self, query: Select, columns: dict) -> Iterator[bytes]:
+        """
+        Encodes the rows of a query as CSV with a header row.
+        """
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+
+        for rows in self._chunks(query):
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+        # The header of an empty export
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+
+    def _encode_arrow(self, query: Select, columns: dict, format: str) -> Iterator[bytes]:
+        """
+        Encodes the rows of a query as a Parquet file with one row group per chunk, or as an Arrow IPC stream with one record batch per chunk.
+        """
+
+        schema = pyarrow.schema([(name, getattr(pyarrow, arrow_type)()) for name, (_, arrow_type) in columns.items()])
+        sink = _ChunkSink()
+
+        if format == "parquet":
+            writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        else:
+            writer = pyarrow.ipc.new_stream(sink, schema)
+
+        try:
+            for rows in self._chunks(query):
+                values = list(zip(*rows))
+                writer.write_batch(pyarrow.record_batch([pyarrow.array(values[index], type=field.type) for index, field in enumerate(schema)], schema=schema))
+                yield sink.drain()
+        finally:
+            writer.close()
+
+        # The Parquet footer, or the end of the Arrow stream
+        yield sink.drain()
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write only file that hands out what was written since it was last drained, so encoders can stream instead of buffering the whole file.
+    It keeps counting positions across drains, because Parquet records absolute offsets in its footer.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
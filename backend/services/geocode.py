@@ -0,0 +1,254 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+import asyncio, os, time
+
+import httpx
+from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from backend.entities.geocode_cache import GeocodeCacheEntity
+from backend.metrics import upstream_call
+from backend.models.geocode_cache_stats import GeocodeCacheStats
+from backend.services.http_client import get_http_client
+from ..database import db_session, dialect_insert
+
+# Nominatim search endpoint to get the latitude and longitude of a city
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+
+# Nominatim allows at most one request per second from an application, see https://operations.osmfoundation.org/policies/nominatim/
+NOMINATIM_MIN_INTERVAL_SECONDS = float(os.getenv("NOMINATIM_MIN_INTERVAL_SECONDS", 1))
+
+# How long found and not found cities are cached for
+GEOCODE_CACHE_TTL_SECONDS = int(os.getenv("GEOCODE_CACHE_TTL_SECONDS", 30 * 24 * 60 * 60))
+GEOCODE_NEGATIVE_CACHE_TTL_SECONDS = int(os.getenv("GEOCODE_NEGATIVE_CACHE_TTL_SECONDS", 24 * 60 * 60))
+
+# Maximum number of cities kept in the in-process cache
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", 1024))
+
+# In-process LRU shared by every request: normalized city -> (expires at, (latitude, longitude) or None)
+_memory_cache: OrderedDict[str, tuple[float, tuple[float, float] | None]] = OrderedDict()
+_memory_cache_lock = Lock()
+_counters = {"memory_hits": 0, "database_hits": 0, "misses": 0, "negative_hits": 0}
+
+# Calls to Nominatim from every request and the prefetcher go out one at a time, NOMINATIM_MIN_INTERVAL_SECONDS apart
+_nominatim_throttle = {"lock": asyncio.Lock(), "last_call": float("-inf")}
+
+
+def normalize_city(city: str) -> str:
+    """
+    Normalizes a city name so different spellings of the same name share a cache entry.
+
+    Params:
+        city: The city name
+
+    Returns:
+        str: The lowercase city name with single spaces
+    """
+
+    return " ".join(city.lower().split())
+
+
+def clear_geocode_cache() -> None:
+    """
+    Clears the in-process geocoding cache and resets its counters and the Nominatim throttle. The database cache is left untouched.
+    """
+
+    with _memory_cache_lock:
+        _memory_cache.clear()
+        for counter in _counters:
+            _counters[counter] = 0
+
+    _nominatim_throttle.update(lock=asyncio.Lock(), last_call=float("-inf"))
+
+
+class GeocodeService:
+    """
+    Stores the business logic for looking up the latitude and longitude of a city.
+    Lookups go through an in-process LRU, then the geocode_cache table, and only then Nominatim.
+    """
+
+    def __init__(self, session: Session = Depends(db_session)):
+        self._session = session
+
+
+    async def geocode(self, city: str) -> tuple[float, float]:
+        """
+        Retrieves the latitude and longitude of a city.
+        Raises an error if the city could not be found.
+
+        Params:
+            city: The city to get the latitude and longitude for
+
+        Returns:
+            tuple[float, float]: The latitude and longitude of the city
+        """
+
+        key = normalize_city(city)
+        cached, coordinates = self._get_from_memory(key)
+
+        if not cached:
+            # The database is queried in the threadpool so a slow query does not hold up the event loop
+            cached, coordinates = await run_in_threadpool(self._get_from_database, key)
+
+            if not cached:
+                self._count("misses")
+                coordinates = await self.fetch_coordinates_from_api(city)
+                await run_in_threadpool(self._store_in_database, key, coordinates)
+
+            self._store_in_memory(key, coordinates)
+
+        if coordinates is None:
+            # Cities Nominatim could not find are cached too, so they never hit Nominatim twice
+            if cached:
+                self._count("negative_hits")
+            raise HTTPException(status_code=404, detail=f"Could not find the location of { city }")
+
+        return coordinates
+
+
+    async def fetch_coordinates_from_api(self, city: str) -> tuple[float, float] | None:
+        """
+        Uses the Nominatim search API to get the latitude and longitude of a city.
+        Calls are throttled process wide to one every NOMINATIM_MIN_INTERVAL_SECONDS, so batches and the prefetcher wait their turn.
+        Raises an error if Nominatim could not be reached.
+
+        Params:
+            city: The city to get the latitude and longitude for
+
+        Returns:
+            tuple[float, float] | None: The latitude and longitude of the city, None if Nominatim could not find it
+        """
+
+        params = {
+            "q": city,
+            "format": "json",
+            "limit": 1
+        }
+
+        async with _nominatim_throttle["lock"]:
+            delay = _nominatim_throttle["last_call"] + NOMINATIM_MIN_INTERVAL_SECONDS - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            _nominatim_throttle["last_call"] = time.monotonic()
+
+            try:
+                with upstream_call("nominatim", "fetch_coordinates_from_api") as call:
+                    response = await get_http_client().get(NOMINATIM_URL, params=params)
+                    call.error = response.status_code != 200
+            except httpx.HTTPError:
+                raise HTTPException(status_code=502, detail="Could not reach the geocoding service")
+
+        if response.status_code != 200:
+            raise HTTPException(status_code=502, detail="Could not reach the geocoding service")
+
+        results = response.json()
+        if not results:
+            return None
+
+        return float(results[0]["lat"]), float(results[0]["lon"])
+
+
+    def cache_stats(self) -> GeocodeCacheStats:
+        """
+        Retrieves the hit and miss counters of the geocoding cache.
+
+        Returns:
+            GeocodeCacheStats: The counters since the server started
+        """
+
+        with _memory_cache_lock:
+            return GeocodeCacheStats(**_counters, memory_size=len(_memory_cache))
+
+
+    def _get_from_memory(self, key: str) -> tuple[bool, tuple[float, float] | None]:
+        """
+        Looks up a city in the in-process LRU, evicting it if it has expired.
+        """
+
+        with _memory_cache_lock:
+            entry = _memory_cache.get(key)
+
+            if entry is None:
+                return False, None
+
+            expires_at, coordinates = entry
+            if expires_at <= time.monotonic():
+                del _memory_cache[key]
+                return False, None
+
+            _memory_cache.move_to_end(key)
+            _counters["memory_hits"] += 1
+
+            return True, coordinates
+
+
+    def _store_in_memory(self, key: str, coordinates: tuple[float, float] | None) -> None:
+        """
+        Stores a city in the in-process LRU, evicting the least recently used cities over the size limit.
+        """
+
+        ttl = GEOCODE_CACHE_TTL_SECONDS if coordinates else GEOCODE_NEGATIVE_CACHE_TTL_SECONDS
+
+        with _memory_cache_lock:
+            _memory_cache[key] = (time.monotonic() + ttl, coordinates)
+            _memory_cache.move_to_end(key)
+
+            while len(_memory_cache) > GEOCODE_CACHE_MAX_ENTRIES:
+                _memory_cache.popitem(last=False)
+
+
+    def _get_from_database(self, key: str) -> tuple[bool, tuple[float, float] | None]:
+        """
+        Looks up a city in the geocode_cache table, ignoring it if it has expired.
+        """
+
+        # Looking up the cache must not flush pending changes of the request that shares the session
+        with self._session.no_autoflush:
+            entity = self._session.get(GeocodeCacheEntity, key)
+
+        if entity is None:
+            return False, None
+
+        coordinates = (entity.latitude, entity.longitude) if entity.latitude is not None else None
+        ttl = GEOCODE_CACHE_TTL_SECONDS if coordinates else GEOCODE_NEGATIVE_CACHE_TTL_SECONDS
+
+        if entity.fetched_at + timedelta(seconds=ttl) <= _utc_now():
+            return False, None
+
+        self._count("database_hits")
+
+        return True, coordinates
+
+
+    def _store_in_database(self, key: str, coordinates: tuple[float, float] | None) -> None:
+        """
+        Upserts a city into the geocode_cache table with a short-lived session of its own, so the commit never includes pending changes
+        of the request that shares the service's session.
+        """
+
+        latitude, longitude = coordinates if coordinates else (None, None)
+
+        statement = dialect_insert(self._session, GeocodeCacheEntity).values(city=key, latitude=latitude, longitude=longitude, fetched_at=_utc_now())
+        statement = statement.on_conflict_do_update(
+            index_elements=[GeocodeCacheEntity.city],
+            set_={"latitude": statement.excluded.latitude, "longitude": statement.excluded.longitude, "fetched_at": statement.excluded.fetched_at}
+        )
+
+        with Session(self._session.get_bind()) as session:
+            session.execute(statement)
+            session.commit()
+
+
+    def _count(self, counter: str) -> None:
+        with _memory_cache_lock:
+            _counters[counter] += 1
+
+
+def _utc_now() -> datetime:
+    """
+    Returns the current UTC time without a timezone, matching how SQLite stores DateTime columns.
+    """
+
+    return datetime.now(timezone.utc).replace(tzinfo=None)
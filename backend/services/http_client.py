@@ -0,0 +1,54 @@
+import importlib.util, os
+
+import httpx
+
+# Timeouts for outbound requests to OpenWeather and Nominatim
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", 10))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", 5))
+
+# Connection pool limits. Idle connections are kept alive so repeat calls skip the TCP and TLS handshakes.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", 30))
+
+# HTTP/2 is only used when the optional h2 package is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Retrieves the async HTTP client shared by every outbound request, creating it on first use.
+
+    Returns:
+        httpx.AsyncClient: The shared, connection pooled client
+    """
+
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+            ),
+            http2=HTTP2_AVAILABLE,
+            headers={"User-Agent": "app-team-takehome"}
+        )
+
+    return _client
+
+
+async def close_http_client() -> None:
+    """
+    Closes the shared HTTP client and its pooled connections. Called when the server shuts down.
+    """
+
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
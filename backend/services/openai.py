@@ -1,3 +1,4 @@
+from collections.abc import AsyncIterator, Iterator
 from datetime import datetime, timedelta
 from pytz import timezone
 
@@ -6,14 +7,18 @@ from dotenv import load_dotenv
 from sqlalchemy import JSON, select
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 from backend.entities.weather import WeatherEntity
 from backend.models.weather import Weather
 from backend.models.workout import Workout
+from backend.models.workout_advice import WorkoutAdvice
 from backend.entities.workout import WorkoutEntity
+from backend.metrics import upstream_call
+from backend.services.advice_cache import AdviceCacheService, advice_fingerprint, quantize
 from ..database import db_session
 
-import requests, os
+import asyncio, json, requests, os
 from openai import OpenAI
 
 load_dotenv()
@@ -22,113 +27,363 @@ client = OpenAI(api_key=api_key)
 
 tz = timezone("EST")
 
+MODEL = "gpt-4o-mini"
+
+# Bump when a prompt changes so advice generated from the old prompt is no longer served from the cache
+PROMPT_VERSION = 1
+
+# How many OpenAI calls a batch makes at once, and how long each workout of a batch may take
+ADVICE_BATCH_CONCURRENCY = int(os.getenv("ADVICE_BATCH_CONCURRENCY", 8))
+ADVICE_BATCH_TIMEOUT_SECONDS = float(os.getenv("ADVICE_BATCH_TIMEOUT_SECONDS", 30))
+
 class OpenAIService:
     """
     Stores the business logic for interacting with the OpenAI API.
+    Generated advice is cached on a fingerprint of the quantized prompt inputs, so nearly identical requests share one generation.
     """
 
-    def __init__(self, session: Session = Depends(db_session)) -> dict:
+    def __init__(self, session: Session = Depends(db_session), advice_cache: AdviceCacheService = Depends(AdviceCacheService)) -> dict:
         self._session = session
+        self._advice_cache = advice_cache
 
     
-    def generate_workout_outfit(self, weather: Weather) -> str:
+    def generate_workout_outfit(self, weather: Weather, bypass_cache: bool = False) -> str:
         """
-        Uses the OpenAI API to generate an outfit suggestion based on the weather
+        Uses the OpenAI API to generate an outfit suggestion based on the weather.
+        Temperatures are rounded to 5°F and humidity to 10% so similar weather shares a cached suggestion.
 
         Params:
             weather: The weather data for the location
+            bypass_cache: Generate a new suggestion even if one is cached
         
         Returns:
             str: The outfit suggestion
         """
 
-        
-        prompt = f"""
-            Generate an outfit suggestion for a workout in {weather.city} 
-            with this weather data measured in imperial units: max-temp: {weather.temp_max}, min-temp: {weather.temp_min}, avg-temp: {weather.temp_avg}, weather description: {weather.weather_description}, humidity (percentage): {weather.humidity}, feels-like {weather.feels_like}.
-            List out each stat I gave at the end.
-            """
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages= [
-            {
-                "role": "system",
-                "content": "You are a fitness bot."
-            },
-            {
-                "role": "user",
-                "content": prompt
-            }
-            ],
-        )
+        return self._generate_cached_advice(*self._workout_outfit_prompt(weather), bypass_cache)
 
-        generated_text = response.choices[0].message.content
-        
-        return generated_text
+
+    def stream_workout_outfit(self, weather: Weather, bypass_cache: bool = False) -> Iterator[str]:
+        """
+        Streams an outfit suggestion based on the weather as server-sent events while the OpenAI API generates it.
+
+        Params:
+            weather: The weather data for the location
+            bypass_cache: Generate a new suggestion even if one is cached
+
+        Returns:
+            Iterator[str]: The outfit suggestion as server-sent events
+        """
+
+        return self._stream_cached_advice(*self._workout_outfit_prompt(weather), bypass_cache)
     
     
-    def generate_all_workout_improvement_advice(self, avg_distance: float, avg_duration: float) -> str:
+    def generate_all_workout_improvement_advice(self, avg_distance: float, avg_duration: float, bypass_cache: bool = False) -> str:
         """
         Uses the OpenAI API to generate a recommendation for improving a workout based on the average distance and duration across all workouts.
+        The distance is rounded to 0.5 miles and the duration to 5 minutes so similar weeks share a cached recommendation.
 
         Params:
-            workout: The workout data
+            avg_distance: The average distance per workout over the last 7 days
+            avg_duration: The average duration per workout over the last 7 days
+            bypass_cache: Generate a new recommendation even if one is cached
         
         Returns:
             str: The workout advice
         """
 
-        
-        prompt = f"Generate advice for how to improve the distance and time of a runner with {avg_distance} miles and {avg_duration} minutes over the course of their workouts for the last 7 days. Include things like speed, endurance, form, and how often they should be running."
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages= [
-            {
-                "role": "system",
-                "content": "You are a fitness bot that is giving advice to a user for a running workout application."
-            },
-            {
-                "role": "user",
-                "content": prompt
-            }
-            ],
-        )
+        return self._generate_cached_advice(*self._all_workout_improvement_prompt(avg_distance, avg_duration), bypass_cache)
 
-        generated_text = response.choices[0].message.content
-        
-        return generated_text
+
+    def stream_all_workout_improvement_advice(self, avg_distance: float, avg_duration: float, bypass_cache: bool = False) -> Iterator[str]:
+        """
+        Streams a recommendation for improving a workout based on the weekly averages as server-sent events while the OpenAI API generates it.
+
+        Params:
+            avg_distance: The average distance per workout over the last 7 days
+            avg_duration: The average duration per workout over the last 7 days
+            bypass_cache: Generate a new recommendation even if one is cached
+
+        Returns:
+            Iterator[str]: The workout advice as server-sent events
+        """
+
+        return self._stream_cached_advice(*self._all_workout_improvement_prompt(avg_distance, avg_duration), bypass_cache)
     
 
-    def generate_workout_improvement_advice(self, workout: Workout) -> str:
+    def generate_workout_improvement_advice(self, workout: Workout, bypass_cache: bool = False, timeout: float | None = None) -> str:
         """
         Uses the OpenAI API to generate a recommendation for improving a single workout based on the distance and duration.
+        The distance is rounded to 0.5 miles and the duration to 5 minutes so similar workouts share a cached recommendation.
 
         Params:
             workout: The workout data
+            bypass_cache: Generate a new recommendation even if one is cached
+            timeout: Optionally give up on the OpenAI call after this many seconds, without retrying
         
         Returns:
             str: The workout advice
         """
 
+        return self._generate_cached_advice(*self._workout_improvement_prompt(workout), bypass_cache, timeout)
+
+
+    def stream_workout_improvement_advice(self, workout: Workout, bypass_cache: bool = False) -> Iterator[str]:
+        """
+        Streams a recommendation for improving a single workout as server-sent events while the OpenAI API generates it.
+
+        Params:
+            workout: The workout data
+            bypass_cache: Generate a new recommendation even if one is cached
+
+        Returns:
+            Iterator[str]: The workout advice as server-sent events
+        """
+
+        return self._stream_cached_advice(*self._workout_improvement_prompt(workout), bypass_cache)
+
+
+    async def generate_workout_improvement_advice_batch(self, workouts: dict[int, Workout | None], bypass_cache: bool = False) -> AsyncIterator[WorkoutAdvice]:
+        """
+        Generates improvement advice for many workouts at once, with at most ADVICE_BATCH_CONCURRENCY OpenAI calls in flight.
+        Each workout gets ADVICE_BATCH_TIMEOUT_SECONDS, and its advice is yielded as soon as it finishes, so results arrive in completion order.
+        A call that timed out keeps its slot until its worker thread returns, which the OpenAI client's own timeout bounds.
+        A missing workout, a timeout, or a failed call is reported on that workout only.
+
+        Params:
+            workouts: The workouts to advise, keyed by ID. None marks a workout that does not exist.
+            bypass_cache: Generate new advice even if it is cached
+
+        Returns:
+            AsyncIterator[WorkoutAdvice]: The advice or error for every workout
+        """
+
+        semaphore = asyncio.Semaphore(ADVICE_BATCH_CONCURRENCY)
+        bind = self._session.get_bind()
+
+        def generate(workout: Workout) -> str:
+            # Sessions are not thread safe, so every call caches through its own session
+            with Session(bind) as session:
+                return OpenAIService(session, AdviceCacheService(session)).generate_workout_improvement_advice(workout, bypass_cache, ADVICE_BATCH_TIMEOUT_SECONDS)
+
+        def finish(call: asyncio.Future) -> None:
+            semaphore.release()
+            # The call may outlive the workout's timeout, so its error is retrieved here instead of being reported as never retrieved
+            call.cancelled() or call.exception()
+
+        async def advise(workout_id: int, workout: Workout) -> WorkoutAdvice:
+            await semaphore.acquire()
+            # A worker thread cannot be interrupted, so the slot is only freed once the call returns, even if the workout timed out before
+            call = asyncio.ensure_future(run_in_threadpool(generate, workout))
+            call.add_done_callback(finish)
+
+            try:
+                advice = await asyncio.wait_for(asyncio.shield(call), ADVICE_BATCH_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                return WorkoutAdvice(workout_id=workout_id, error="Advice generation timed out")
+            except Exception:
+                return WorkoutAdvice(workout_id=workout_id, error="Advice generation failed")
+
+            return WorkoutAdvice(workout_id=workout_id, advice=advice)
+
+        for workout_id, workout in workouts.items():
+            if workout is None:
+                yield WorkoutAdvice(workout_id=workout_id, error=f"Workout with ID: { workout_id } does not exist")
+
+        tasks = [asyncio.ensure_future(advise(workout_id, workout)) for workout_id, workout in workouts.items() if workout is not None]
+
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Stop waiting on the remaining calls if the client disconnects
+            for task in tasks:
+                task.cancel()
+
+
+    def _workout_outfit_prompt(self, weather: Weather) -> tuple[str, dict, str, str]:
+        """
+        Builds the outfit prompt from the rounded weather data.
+
+        Returns:
+            tuple[str, dict, str, str]: The advice kind, the rounded inputs, the system prompt, and the user prompt
+        """
+
+        inputs = {
+            "city": weather.city.lower(),
+            "temp_max": quantize(weather.temp_max, 5),
+            "temp_min": quantize(weather.temp_min, 5),
+            "temp_avg": quantize(weather.temp_avg, 5),
+            "weather_description": weather.weather_description,
+            "humidity": quantize(weather.humidity, 10),
+            "feels_like": quantize(weather.feels_like, 5)
+        }
         
-        prompt = f"Generate advice for how to improve the distance and time of a runner with {workout.distance} miles and {workout.duration} minutes. Include things like speed, endurance, form, and how often they should be running."
+        prompt = f"""
+            Generate an outfit suggestion for a workout in {weather.city} 
+            with this weather data measured in imperial units: max-temp: {inputs["temp_max"]}, min-temp: {inputs["temp_min"]}, avg-temp: {inputs["temp_avg"]}, weather description: {inputs["weather_description"]}, humidity (percentage): {inputs["humidity"]}, feels-like {inputs["feels_like"]}.
+            List out each stat I gave at the end.
+            """
+
+        return "outfit", inputs, "You are a fitness bot.", prompt
+
+
+    def _all_workout_improvement_prompt(self, avg_distance: float, avg_duration: float) -> tuple[str, dict, str, str]:
+        """
+        Builds the weekly improvement prompt from the rounded averages.
+
+        Returns:
+            tuple[str, dict, str, str]: The advice kind, the rounded inputs, the system prompt, and the user prompt
+        """
+
+        inputs = {
+            "avg_distance": quantize(avg_distance, 0.5),
+            "avg_duration": quantize(avg_duration, 5)
+        }
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages= [
-            {
-                "role": "system",
-                "content": "You are a fitness bot that is giving advice to a user for a running workout application."
-            },
-            {
-                "role": "user",
-                "content": prompt
-            }
-            ],
-        )
+        prompt = f"Generate advice for how to improve the distance and time of a runner with {inputs['avg_distance']} miles and {inputs['avg_duration']} minutes over the course of their workouts for the last 7 days. Include things like speed, endurance, form, and how often they should be running."
+
+        return "weekly_improvement", inputs, "You are a fitness bot that is giving advice to a user for a running workout application.", prompt
+
+
+    def _workout_improvement_prompt(self, workout: Workout) -> tuple[str, dict, str, str]:
+        """
+        Builds the single workout improvement prompt from the rounded distance and duration.
+
+        Returns:
+            tuple[str, dict, str, str]: The advice kind, the rounded inputs, the system prompt, and the user prompt
+        """
+
+        inputs = {
+            "distance": quantize(workout.distance, 0.5),
+            "duration": quantize(workout.duration, 5)
+        }
+        
+        prompt = f"Generate advice for how to improve the distance and time of a runner with {inputs['distance']} miles and {inputs['duration']} minutes. Include things like speed, endurance, form, and how often they should be running."
+
+        return "improvement", inputs, "You are a fitness bot that is giving advice to a user for a running workout application.", prompt
+
+
+    def _generate_cached_advice(self, kind: str, inputs: dict, system_prompt: str, prompt: str, bypass_cache: bool, timeout: float | None = None) -> str:
+        """
+        Serves an advice from the cache, or generates it with the OpenAI API and caches it.
+
+        Params:
+            kind: The kind of advice, part of the cache key
+            inputs: The quantized inputs the prompt was built from, part of the cache key
+            system_prompt: The system message of the chat completion
+            prompt: The user message of the chat completion
+            bypass_cache: Generate a new advice even if one is cached. The new advice still replaces the cached one.
+            timeout: Optionally give up on the OpenAI call after this many seconds. Retrying would outlast the timeout, so it is off.
+
+        Returns:
+            str: The advice
+        """
+
+        fingerprint = advice_fingerprint(kind, {"model": MODEL, "prompt_version": PROMPT_VERSION, **inputs})
+
+        if not bypass_cache:
+            cached_advice = self._advice_cache.get(fingerprint)
+            if cached_advice is not None:
+                return cached_advice
+
+        openai_client = client if timeout is None else client.with_options(timeout=timeout, max_retries=0)
+
+        # Outbound calls are timed per kind of advice
+        with upstream_call("openai", kind):
+            response = openai_client.chat.completions.create(model=MODEL, messages=_chat_messages(system_prompt, prompt))
 
         generated_text = response.choices[0].message.content
+
+        self._advice_cache.store(fingerprint, kind, generated_text)
         
-        return generated_text
\ No newline at end of file
+        return generated_text
+
+
+    def _stream_cached_advice(self, kind: str, inputs: dict, system_prompt: str, prompt: str, bypass_cache: bool) -> Iterator[str]:
+        """
+        Replays an advice from the cache as a single server-sent event, or streams it from the OpenAI API token by token and caches it once complete.
+        The cache is checked right away, while the request's session is still open.
+
+        Params:
+            kind: The kind of advice, part of the cache key
+            inputs: The quantized inputs the prompt was built from, part of the cache key
+            system_prompt: The system message of the chat completion
+            prompt: The user message of the chat completion
+            bypass_cache: Generate a new advice even if one is cached. The new advice still replaces the cached one.
+
+        Returns:
+            Iterator[str]: 'message' events carrying the advice text, followed by a 'done' event, or an 'error' event if the generation fails
+        """
+
+        fingerprint = advice_fingerprint(kind, {"model": MODEL, "prompt_version": PROMPT_VERSION, **inputs})
+
+        if not bypass_cache:
+            cached_advice = self._advice_cache.get(fingerprint)
+            if cached_advice is not None:
+                return iter([sse_event({"text": cached_advice}), sse_event({"cached": True}, "done")])
+
+        return self._stream_and_cache_advice(fingerprint, kind, system_prompt, prompt)
+
+
+    def _stream_and_cache_advice(self, fingerprint: str, kind: str, system_prompt: str, prompt: str) -> Iterator[str]:
+        """
+        Forwards the chat completion tokens as server-sent events as they arrive, then caches the complete advice.
+        Uses its own session because a streamed response outlives the request's session.
+        """
+
+        chunks = []
+
+        try:
+            with upstream_call("openai", f"{kind}_stream"):
+                stream = client.chat.completions.create(model=MODEL, messages=_chat_messages(system_prompt, prompt), stream=True)
+
+                for chunk in stream:
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        chunks.append(text)
+                        yield sse_event({"text": text})
+        except Exception:
+            # The response has already started, so report the failure in the stream and cache nothing
+            yield sse_event({"detail": "Advice generation failed"}, "error")
+            return
+
+        with Session(self._session.get_bind()) as session:
+            AdviceCacheService(session).store(fingerprint, kind, "".join(chunks))
+
+        yield sse_event({"cached": False}, "done")
+
+
+def sse_event(data: dict, event: str | None = None) -> str:
+    """
+    Formats a server-sent event with a JSON payload, so newlines in the advice cannot break the event framing.
+
+    Params:
+        data: The payload of the event
+        event: The event type, omitted for plain 'message' events
+
+    Returns:
+        str: The encoded event
+    """
+
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data)}")
+
+    return "\n".join(lines) + "\n\n"
+
+
+def _chat_messages(system_prompt: str, prompt: str) -> list[dict]:
+    """
+    Builds the messages of a chat completion from a system and user prompt.
+    """
+
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
@@ -0,0 +1,37 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+    The first caller starts the call while every other caller with the same key awaits it and receives the same result or error.
+    Once the call finishes, the next caller with that key starts a new execution.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs the function unless a call with the same key is already in flight, in which case it awaits that call instead.
+
+        Params:
+            key: Identifies calls that can share a result, i.e. the city being fetched
+            function: The coroutine function to run if no call with the same key is in flight
+
+        Returns:
+            Any: The result of the in-flight call
+        """
+
+        task = self._calls.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(function())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # Shield the shared call so one caller disconnecting does not cancel it for every other caller
+        return await asyncio.shield(task)
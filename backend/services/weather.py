@@ -1,43 +1,290 @@
-from datetime import datetime, timedelta
-from pytz import timezone
+from collections import Counter, OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any, TypeVar
+from datetime import date, datetime, timedelta
+from pytz import timezone, utc
 
 from dotenv import load_dotenv
 
 from sqlalchemy import JSON, select
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 
-from backend.entities.weather import WeatherEntity
+from backend.entities.weather import FORECAST_ROWS, WeatherEntity
+from backend.metrics import weather_fallbacks
 from backend.models.weather import Weather
-from ..database import db_session
+from backend.models.weather_error import WeatherError
+from backend.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from backend.services.geocode import GeocodeService
+from backend.services.single_flight import SingleFlight
+from backend.services.weather_providers import FORECAST_TIME_FORMAT, WeatherProvider, WeatherUnavailableError, get_weather_provider
+from ..database import db_read_session, db_session, dialect_insert
 
-import requests, os
-# Geolocator to get the latitude and longitude of a city
-from geopy.geocoders import Nominatim
-from geopy.adapters import RequestsAdapter
-geolocator = Nominatim(user_agent="app-team-takehome", adapter_factory=RequestsAdapter, ssl_context=None)
+from threading import Lock
+import asyncio, os, time
 
 load_dotenv()
-api_key = os.getenv("WEATHER_API_KEY")
-FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast?"
-CURRENT_URL = "https://api.openweathermap.org/data/2.5/weather?"
 
 tz = timezone("EST")
 
+# How long a request waits on the weather provider before serving the stored weather instead, and how long a call to the provider may take at all
+WEATHER_REQUEST_DEADLINE_SECONDS = float(os.getenv("WEATHER_REQUEST_DEADLINE_SECONDS", 2))
+WEATHER_CALL_DEADLINE_SECONDS = float(os.getenv("WEATHER_CALL_DEADLINE_SECONDS", 10))
+
+# Failed calls in a row that open the circuit breaker in front of the weather provider, and how long it stays open before a trial call
+WEATHER_BREAKER_FAILURE_THRESHOLD = int(os.getenv("WEATHER_BREAKER_FAILURE_THRESHOLD", 5))
+WEATHER_BREAKER_RESET_SECONDS = float(os.getenv("WEATHER_BREAKER_RESET_SECONDS", 30))
+
+# How long a stored current weather snapshot is served before it is fetched again
+CURRENT_WEATHER_BUCKET_SECONDS = int(os.getenv("CURRENT_WEATHER_BUCKET_SECONDS", 10 * 60))
+
+# Fields refreshed when the current weather is stored again within the same bucket
+CURRENT_WEATHER_FIELDS = ("date", "fetched_at", "feels_like", "humidity", "temp_min", "temp_max", "temp_avg", "wind_speed", "weather_main", "weather_description")
+
+# How long a stored forecast is served before it is fetched again. OpenWeather updates its forecast every three hours.
+FORECAST_STALE_SECONDS = int(os.getenv("FORECAST_STALE_SECONDS", 3 * 60 * 60))
+
+# Fields refreshed when the forecast of a day is stored again
+FORECAST_FIELDS = tuple(field for field in CURRENT_WEATHER_FIELDS if field != "date")
+
+# Maximum number of cities whose current weather is kept in memory
+CURRENT_WEATHER_CACHE_MAX_ENTRIES = int(os.getenv("CURRENT_WEATHER_CACHE_MAX_ENTRIES", 1024))
+
+# In-memory LRU in front of the stored current weather: city -> (bucket start, weather)
+current_weather_cache: OrderedDict[str, tuple[int, Weather]] = OrderedDict()
+_current_weather_cache_lock = Lock()
+
+# Forecast fields averaged over each day, and where to find them in a three hour forecast entry
+AVERAGED_FORECAST_FIELDS = {
+    "feels_like": lambda entry: entry['main']['feels_like'],
+    "humidity": lambda entry: entry['main']['humidity'],
+    "temp_min": lambda entry: entry['main']['temp_min'],
+    "temp_max": lambda entry: entry['main']['temp_max'],
+    "temp_avg": lambda entry: entry['main']['temp'],
+    "wind_speed": lambda entry: entry['wind']['speed'],
+}
+
+# Most cities per batch request, and how many of their misses are fetched from the API at the same time
+WEATHER_BATCH_MAX_CITIES = int(os.getenv("WEATHER_BATCH_MAX_CITIES", 20))
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", 10))
+
+# Concurrent requests that miss the database for the same city share one upstream fetch
+forecast_flight = SingleFlight()
+current_weather_flight = SingleFlight()
+
+# Shared by every request, so a failing provider is skipped for all of them. Unknown cities are not failures of the provider.
+weather_breaker = CircuitBreaker(WEATHER_BREAKER_FAILURE_THRESHOLD, WEATHER_BREAKER_RESET_SECONDS, failures=(WeatherUnavailableError,))
+
+T = TypeVar("T")
+
+
+def current_weather_bucket_start() -> int:
+    """
+    Calculates the start of the current weather freshness bucket.
+
+    Returns:
+        int: The start of the bucket in seconds since the epoch
+    """
+
+    now = int(time.time())
+
+    return now - now % CURRENT_WEATHER_BUCKET_SECONDS
+
+
+def cached_current_weather(city: str, bucket_start: int) -> Weather | None:
+    """
+    Looks up the current weather of a city in memory.
+
+    Params:
+        city: The lowercase city
+        bucket_start: The start of the current freshness bucket
+
+    Returns:
+        Weather | None: The weather cached during the bucket, None if there is none
+    """
+
+    with _current_weather_cache_lock:
+        cached = current_weather_cache.get(city)
+        if cached is None or cached[0] != bucket_start:
+            return None
+
+        current_weather_cache.move_to_end(city)
+
+        return cached[1]
+
+
+def cache_current_weather(city: str, bucket_start: int, weather: Weather) -> None:
+    """
+    Keeps the current weather of a city in memory, evicting the least recently used cities over CURRENT_WEATHER_CACHE_MAX_ENTRIES.
+
+    Params:
+        city: The lowercase city
+        bucket_start: The start of the freshness bucket the weather was stored in
+        weather: The current weather
+    """
+
+    with _current_weather_cache_lock:
+        current_weather_cache[city] = (bucket_start, weather)
+        current_weather_cache.move_to_end(city)
+
+        while len(current_weather_cache) > CURRENT_WEATHER_CACHE_MAX_ENTRIES:
+            current_weather_cache.popitem(last=False)
+
+
+def split_cities(cities: str) -> list[str]:
+    """
+    Splits a comma separated list of cities for the batch routes, dropping blanks and repeats of the same city.
+    Raises an error if there are no cities or more than WEATHER_BATCH_MAX_CITIES.
+
+    Params:
+        cities: The cities, i.e. 'Durham,Raleigh,Chapel Hill'
+
+    Returns:
+        list[str]: The cities in the order they were given
+    """
+
+    unique = {}
+    for city in cities.split(","):
+        if city.strip():
+            unique.setdefault(city.strip().lower(), city.strip())
+
+    if not unique:
+        raise HTTPException(status_code=400, detail="Enter at least one city")
+    if len(unique) > WEATHER_BATCH_MAX_CITIES:
+        raise HTTPException(status_code=400, detail=f"Enter at most { WEATHER_BATCH_MAX_CITIES } cities")
+
+    return list(unique.values())
+
+
+async def gather_limited(coroutines: Iterable[Awaitable[Any]], limit: int) -> list[Any]:
+    """
+    Awaits coroutines concurrently, at most limit at a time.
+
+    Params:
+        coroutines: The coroutines to await
+        limit: How many run at the same time
+
+    Returns:
+        list[Any]: Their results, in the same order
+    """
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine: Awaitable[Any]) -> Any:
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+
+
+async def or_weather_error(weather: Awaitable[T]) -> T | WeatherError:
+    """
+    Awaits the weather of one city of a batch, turning an error into a WeatherError so it does not fail the other cities.
+
+    Params:
+        weather: Retrieves the weather of the city
+
+    Returns:
+        T | WeatherError: The weather, or the error the city would have gotten on its own
+    """
+
+    try:
+        return await weather
+    except HTTPException as error:
+        return WeatherError(status_code=error.status_code, error=str(error.detail))
+
+
+def mark_stale(weather: Weather) -> Weather:
+    """
+    Copies stored weather that is served because fresh weather could not be fetched, marked as stale.
+
+    Params:
+        weather: The stored weather
+
+    Returns:
+        Weather: The weather marked as stale
+    """
+
+    return weather.model_copy(update={"stale": True})
+
+
+def fetched_now() -> datetime:
+    """
+    The current time as fetched_at is stored: in the app's timezone, to the minute, and without the timezone, which is always the app's.
+
+    Returns:
+        datetime: The current time
+    """
+
+    return datetime.now(tz).replace(second=0, microsecond=0, tzinfo=None)
+
+
+def forecast_is_stale(entities: list[WeatherEntity], lead_seconds: float = 0) -> bool:
+    """
+    Checks if the stored forecast was last fetched more than FORECAST_STALE_SECONDS ago, or will be within lead_seconds.
+    Only the newest fetch counts: late in the evening the forecast no longer includes the current day, so that day keeps the fetched_at
+    of an earlier fetch and fetching again would not refresh it. A forecast stored before fetched_at was tracked is stale.
+
+    Params:
+        entities: The stored forecast days
+        lead_seconds: How long before going stale the forecast counts as stale
+
+    Returns:
+        bool: True if the forecast should be fetched again
+    """
+
+    fresh_after = fetched_now() - timedelta(seconds=FORECAST_STALE_SECONDS - lead_seconds)
+    fetched = [entity.fetched_at for entity in entities if entity.fetched_at is not None]
+
+    return not fetched or max(fetched) < fresh_after
+
+
+def forecast_day(dt_txt: str) -> date:
+    """
+    The day of a three hour forecast entry in the app's timezone. OpenWeather writes dt_txt in UTC, so evening entries would otherwise
+    be counted towards the next day.
+
+    Params:
+        dt_txt: The time of the entry in UTC, i.e. '2024-09-14 03:00:00'
+
+    Returns:
+        date: The day of the entry in the app's timezone
+    """
+
+    return utc.localize(datetime.strptime(dt_txt, FORECAST_TIME_FORMAT)).astimezone(tz).date()
+
 
 class WeatherService:
     """
     Stores the business logic for interacting with weather data and the Open Weather API.
     """
 
-    def __init__(self, session: Session = Depends(db_session)) -> dict:
+    def __init__(self, session: Session = Depends(db_session), geocode_service: GeocodeService = Depends(GeocodeService), read_session: Session = Depends(db_read_session)) -> dict:
         self._session = session
+        # Reads go through a read only session, writes keep using the session they always have
+        self._read_session = read_session
+        self._geocode_service = geocode_service
+        # Sessions are not thread safe, so the database work of one service runs in the threadpool one call at a time
+        self._session_lock = Lock()
+
+
+    async def _run_db(self, function: Callable[..., T], *args: Any) -> T:
+        """
+        Runs blocking database work in the threadpool, so the event loop keeps serving other requests while it waits on the database.
+        """
 
+        def run_locked() -> T:
+            with self._session_lock:
+                return function(*args)
 
-    def fetch_five_day_forecast_from_api(self, city: str) -> dict:
+        return await run_in_threadpool(run_locked)
+
+
+    async def fetch_five_day_forecast_from_api(self, city: str) -> dict:
         """
-        Uses geolocator to get the latitude and longitude of a city.
-        Uses the OpenWeather API to get the weather forecast for every three hours of the next five days.
+        Uses the weather provider to get the weather forecast for every three hours of the next five days.
+        Raises a WeatherUnavailableError if the provider failed, took too long, or its circuit breaker is open.
         
         Params:
             city: The city to get the weather data for
@@ -46,35 +293,13 @@ class WeatherService:
             dict: Weather data for the given location
         """
 
-        # Use geolocator to get longitude and latitude from the specified city
-        location = geolocator.geocode(city)
-        latitude, longitude = location.latitude, location.longitude
-
-
-        params = {
-            "lat": latitude,
-            "lon": longitude,
-            "appid": api_key,
-            "units": "imperial"
-        }
-
-        # Make a request to the OpenWeather API and store it
-        response = requests.get(FORECAST_URL, params)
-
-        # Simple check to see if the request was successful
-        if response is None or response.status_code != 200:
-            raise HTTPException(status_code=404, detail="Weather data not found")
-
-        # Ensure the response a dictionary
-        data = response.json()
-
-        return data
+        return await self._call_provider(lambda provider: provider.fetch_forecast(city, self._geocode_service.geocode))
     
     
-    def fetch_current_weather_from_api(self, city: str) -> dict:
+    async def fetch_current_weather_from_api(self, city: str) -> dict:
         """
-        Uses geolocator to get the latitude and longitude of a city.
-        Uses the OpenWeather API to get the current weather data.
+        Uses the weather provider to get the current weather data.
+        Raises a WeatherUnavailableError if the provider failed, took too long, or its circuit breaker is open.
         
         Params:
             city: The city to get the weather data for
@@ -83,120 +308,180 @@ class WeatherService:
             dict: Weather data for the given location
         """
 
-        # Use geolocator to get longitude and latitude from the specified city
-        location = geolocator.geocode(city)
-        latitude, longitude = location.latitude, location.longitude
+        return await self._call_provider(lambda provider: provider.fetch_current(city, self._geocode_service.geocode))
+
+
+    async def _call_provider(self, fetch: Callable[[WeatherProvider], Awaitable[dict]]) -> dict:
+        """
+        Calls the weather provider through the circuit breaker, cancelling the call after WEATHER_CALL_DEADLINE_SECONDS.
+        """
+
+        provider = get_weather_provider()
+
+        try:
+            return await weather_breaker.call(lambda: fetch(provider), WEATHER_CALL_DEADLINE_SECONDS)
+        except CircuitOpenError:
+            raise WeatherUnavailableError("The weather service is failing, try again shortly")
+        except TimeoutError:
+            raise WeatherUnavailableError("The weather service took too long to answer")
+
+
+    async def _with_stale_fallback(self, kind: str, fetch: Callable[["WeatherService"], Awaitable[T]], stale: Callable[[], T | None]) -> T:
+        """
+        Waits up to WEATHER_REQUEST_DEADLINE_SECONDS for weather being fetched. If it takes longer or the weather is unavailable,
+        serves the stored weather from stale() instead. A fetch that is still running keeps going in the background and stores the weather for the next request.
+        Without stored weather to fall back on, the fetch is awaited to the end.
+
+        Params:
+            kind: What is fetched, 'current' or 'forecast', for the fallback metric
+            fetch: Fetches and stores the weather with the service it is given, which has sessions of its own
+            stale: Reads the stored weather marked as stale, None if there is none
 
-        params = {
-            "lat": latitude,
-            "lon": longitude,
-            "appid": api_key,
-            "units": "imperial"
-        }
+        Returns:
+            T: The fetched weather, or the stored weather marked as stale
+        """
 
-        # Make a request to the OpenWeather API and store it
-        response = requests.get(CURRENT_URL, params)
+        task = asyncio.ensure_future(self._with_own_sessions(fetch))
+        # The fetch may outlive the request, so its error is retrieved here instead of being reported as never retrieved
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
 
-        # Simple check to see if the request was successful
-        if response is None or response.status_code != 200:
-            return HTTPException(status_code=404, detail="Weather data not found")
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), WEATHER_REQUEST_DEADLINE_SECONDS)
+        except TimeoutError:
+            reason = "timeout"
+        except HTTPException as error:
+            # Unknown cities and other client errors are not served stale weather
+            if error.status_code < 500:
+                raise
+            reason = "unavailable"
 
-        # Ensure the response a dictionary
-        data = response.json()
+        fallback = await self._run_db(stale)
+        if fallback is None:
+            return await task
 
-        return data
+        weather_fallbacks.inc(kind, reason)
+
+        return fallback
+
+
+    async def _with_own_sessions(self, fetch: Callable[["WeatherService"], Awaitable[T]]) -> T:
+        """
+        Runs a fetch with a service that has sessions of its own on the same databases, as the prefetcher does.
+        The fetch may keep running after the request ends and closes its sessions.
+        """
+
+        with Session(self._session.get_bind()) as session, Session(self._read_session.get_bind(), autoflush=False, expire_on_commit=False) as read_session:
+            return await fetch(WeatherService(session=session, geocode_service=GeocodeService(session=session), read_session=read_session))
+
+
+    def _last_current_weather(self, city: str) -> Weather | None:
+        """
+        Reads the most recently stored current weather of a location marked as stale, None if it was never stored.
+        """
+
+        query = select(WeatherEntity).filter(WeatherEntity.city == city.lower(), WeatherEntity.is_current == True).order_by(WeatherEntity.id.desc()).limit(1)
+        entity = self._read_session.scalars(query).first()
+
+        return mark_stale(entity.to_model()) if entity is not None else None
     
     
-    def store_five_day_weather_forecast(self, city: str) -> list[Weather]:
+    async def store_five_day_weather_forecast(self, city: str) -> list[Weather]:
         """
         Retrieves the weather forecast for the next five days for a given location and stores it in the database.
-        This function is only called if the data doesn't already exist in the database.
+        Days that are already stored are updated in place, so workouts linked to them keep their weather.
         
         Params:
             city: The location to get the forecast for
             
         Returns:
-            list[Weather]: List of weather forecasts for the next seven days
+            list[Weather]: List of weather forecasts for the fetched days
         """
 
-        data = self.fetch_five_day_forecast_from_api(city)
+        data = await self.fetch_five_day_forecast_from_api(city)
+        fetched_at = fetched_now()
         daily_data = {}
 
-        # Iterate through the dict and aggregate the data from every three hours of a given day
+        # Aggregate the data from every three hours of a given day in a single pass over the forecast
         for entry in data['list']:
-            # Split the string such that we only get the date 'YYYY-MM-DD'
-            date_str = entry['dt_txt'].split(" ")[0]
-
-            # If the date is not in the dictionary, add it with empty lists for each data point
-            if date_str not in daily_data:
-                daily_data[date_str] = {
-                    "feels_like": [],
-                    "humidity": [],
-                    "temp_min": [],
-                    "temp_max": [],
-                    "temp_avg": [],
-                    "wind_speed": [],
-                    "weather_main": [],
-                    "weather_description": []
+            entry_day = forecast_day(entry['dt_txt'])
+
+            # If the date is not in the dictionary, add it with empty running totals and condition counters
+            day = daily_data.get(entry_day)
+            if day is None:
+                day = daily_data[entry_day] = {
+                    "count": 0,
+                    "totals": dict.fromkeys(AVERAGED_FORECAST_FIELDS, 0.0),
+                    "weather_main": Counter(),
+                    "weather_description": Counter()
                 }
 
-            # Append the data to the respective lists
-            daily_data[date_str]['feels_like'].append(entry['main']['feels_like'])
-            daily_data[date_str]['humidity'].append(entry['main']['humidity'])
-            daily_data[date_str]['temp_min'].append(entry['main']['temp_min'])
-            daily_data[date_str]['temp_max'].append(entry['main']['temp_max'])
-            daily_data[date_str]['temp_avg'].append(entry['main']['temp'])
-            daily_data[date_str]['wind_speed'].append(entry['wind']['speed'])
-            daily_data[date_str]['weather_main'].append(entry['weather'][0]['main'])
-            daily_data[date_str]['weather_description'].append(entry['weather'][0]['description'])
-
-        new_entities = []
-
-        # Iterate through the dictionary and store the data in the database
-        for date_str, values in daily_data.items():
-            entity = WeatherEntity(
-                city=city.lower(),
-                date=date_str,
-                feels_like=round(sum(values['feels_like']) / len(values['feels_like']), 0),
-                humidity=round(sum(values['humidity']) / len(values['humidity']), 0),
-                temp_min=round(sum(values['temp_min']) / len(values['temp_min']), 0),
-                temp_max=round(sum(values['temp_max']) / len(values['temp_max']), 0),
-                temp_avg=round(sum(values['temp_avg']) / len(values['temp_avg']), 0),
-                wind_speed=round(sum(values['wind_speed']) / len(values['wind_speed']), 0),
-                weather_main=max(set(values['weather_main']), key=values['weather_main'].count),
-                weather_description=max(set(values['weather_description']), key=values['weather_description'].count),
-                is_current=False
-            )
+            day["count"] += 1
+            for field, get_value in AVERAGED_FORECAST_FIELDS.items():
+                day["totals"][field] += get_value(entry)
+            day["weather_main"][entry['weather'][0]['main']] += 1
+            day["weather_description"][entry['weather'][0]['description']] += 1
+
+        rows = [
+            {
+                "city": city.lower(),
+                "date": entry_day,
+                "fetched_at": fetched_at,
+                **{field: round(total / day["count"], 0) for field, total in day["totals"].items()},
+                "weather_main": day["weather_main"].most_common(1)[0][0],
+                "weather_description": day["weather_description"].most_common(1)[0][0],
+                "is_current": False
+            }
+            for entry_day, day in daily_data.items()
+        ]
+
+        return await self._run_db(self._upsert_forecast, rows)
+
+
+    def _upsert_forecast(self, rows: list[dict]) -> list[Weather]:
+        """
+        Stores the days of a forecast with one batched upsert ... RETURNING and a single commit, ordered by date.
+        """
 
-            self._session.add(entity)
-            self._session.commit()
+        statement = dialect_insert(self._session, WeatherEntity)
 
-            new_entities.append(entity)
-        
+        # One row per city and day: storing a day again refreshes its row instead of adding one
+        statement = statement.on_conflict_do_update(
+            index_elements=[WeatherEntity.city, WeatherEntity.date, WeatherEntity.is_current],
+            index_where=FORECAST_ROWS,
+            set_={field: statement.excluded[field] for field in FORECAST_FIELDS}
+        )
 
-        return new_entities    
+        new_entities = self._session.scalars(statement.returning(WeatherEntity).execution_options(populate_existing=True), rows).all()
+        forecast = sorted((entity.to_model() for entity in new_entities), key=lambda weather: weather.date)
+        self._session.commit()
+
+        return forecast
     
     
-    def store_current_weather(self, city: str) -> Weather:
+    async def store_current_weather(self, city: str, bucket_start: int | None = None) -> Weather:
         """
         Retrieves the current weather data for a given location and stores it in the database.
         This function is only called if the data doesn't already exist in the database.
 
         Params:
             city: The location to get the forecast for
+            bucket_start: The freshness bucket to store the weather for, defaults to the current one
             
         Returns:
             Weather: The current weather data for the given location
         """
 
-        data = self.fetch_current_weather_from_api(city)
+        data = await self.fetch_current_weather_from_api(city)
+
+        if bucket_start is None:
+            bucket_start = current_weather_bucket_start()
 
-        if data is None:
-            return HTTPException(status_code=404, detail="No data found after fetching from the API")
+        fetched_at = fetched_now()
 
-        entity = WeatherEntity(
+        statement = dialect_insert(self._session, WeatherEntity).values(
             city=city.lower(),
-            date=datetime.now(tz).date().strftime('%Y-%m-%d') + " " + datetime.now(tz).strftime('%I:%M %p'),
+            date=fetched_at.date(),
+            fetched_at=fetched_at,
             feels_like=round(data['main']['feels_like'], 0),
             humidity=round(data['main']['humidity'], 0),
             temp_min=round(data['main']['temp_min'], 0),
@@ -205,15 +490,37 @@ class WeatherService:
             wind_speed=round(data['wind']['speed'], 0),
             weather_main=data['weather'][0]['main'],
             weather_description=data['weather'][0]['description'],
-            is_current=True
+            is_current=True,
+            bucket_start=bucket_start
         )
 
-        self._session.add(entity)
-        self._session.commit()
+        # One row per city and freshness bucket: storing again within the bucket refreshes the row instead of adding one
+        statement = statement.on_conflict_do_update(
+            index_elements=[WeatherEntity.city, WeatherEntity.is_current, WeatherEntity.bucket_start],
+            set_={field: statement.excluded[field] for field in CURRENT_WEATHER_FIELDS}
+        )
 
-        return entity.to_model()
+        weather = await self._run_db(self._upsert_returning, statement)
+
+        # Weather stored ahead for the next bucket is read from the database once that bucket starts
+        if bucket_start == current_weather_bucket_start():
+            cache_current_weather(city.lower(), bucket_start, weather)
+
+        return weather
     
 
+    def _upsert_returning(self, statement) -> Weather:
+        """
+        Executes an upsert ... RETURNING of one weather row and commits it.
+        """
+
+        entity = self._session.scalars(statement.returning(WeatherEntity)).one()
+        weather = entity.to_model()
+        self._session.commit()
+
+        return weather
+
+
     def get_weather_by_id(self, weather_id: int) -> Weather:
         """
         Retrieves a weather entity by its ID.
@@ -226,7 +533,7 @@ class WeatherService:
             Weather: The weather entity with the specified ID
         """
 
-        entity = self._session.query(WeatherEntity).filter(WeatherEntity.id == weather_id).one_or_none()
+        entity = self._read_session.query(WeatherEntity).filter(WeatherEntity.id == weather_id).one_or_none()
 
         if entity is None:
             raise HTTPException(status_code=404, detail=f"Weather with ID: { weather_id } does not exist")
@@ -234,9 +541,10 @@ class WeatherService:
         return entity.to_model()
     
 
-    def get_five_day_forecast(self, city: str) -> list[Weather]:
+    async def get_five_day_forecast(self, city: str) -> list[Weather]:
         """
         Retrieves the weather forecast for the current day and next five days for a given location.
+        The forecast is only fetched from the API if it is not stored or older than FORECAST_STALE_SECONDS.
         
         Params:
             city: The location to get the forecast for
@@ -245,48 +553,216 @@ class WeatherService:
             dict: Weather data for the given location
         """
 
-        start_date = datetime.now(tz).date()
-        end_date = start_date + timedelta(days=5)
+        existing = await self._run_db(self._stored_five_day_forecasts, [city])
+        if existing and not forecast_is_stale(existing):
+            return [entity.to_model() for entity in existing]
 
-        # Search for existing data in the database by city, date, and is_current
-        query = select(WeatherEntity).filter(WeatherEntity.city == city.lower(), WeatherEntity.date >= start_date, WeatherEntity.date <= end_date, WeatherEntity.is_current == False)
+        # A stale forecast is still served while the weather provider is slow or unavailable
+        return await self._with_stale_fallback("forecast", lambda service: service._fetch_five_day_forecast(city), lambda: [mark_stale(entity.to_model()) for entity in existing] or None)
 
-        # To prevent duplicates, return the existing data if it exists
-        existing_entities = self._session.scalars(query).all()
-        if existing_entities:
-            return [entity.to_model() for entity in existing_entities]
-        
-        # If the data does not exist in the database, fetch it from the API
-        self.store_five_day_weather_forecast(city)
 
-        # Grab the newly stored data from the database and return it
-        stored_entities = self._session.scalars(query).all()
-        if stored_entities is None:
-            return HTTPException(status_code=404, detail="Weather data not found")
+    async def get_five_day_forecasts(self, cities: list[str]) -> dict[str, list[Weather] | WeatherError]:
+        """
+        Retrieves the weather forecast for the current day and next five days for several locations.
+        The stored forecasts are read with one query, and only the cities whose forecast is missing or stale are fetched from the API,
+        WEATHER_BATCH_CONCURRENCY at a time. A city that could not be found or fetched gets a WeatherError instead of failing the others.
+
+        Params:
+            cities: The locations to get the forecast for
+
+        Returns:
+            dict[str, list[Weather] | WeatherError]: The forecast or error by city, in the order the cities were given
+        """
+
+        stored: dict[str, list[WeatherEntity]] = {city.lower(): [] for city in cities}
+        for entity in await self._run_db(self._stored_five_day_forecasts, cities):
+            stored[entity.city].append(entity)
+
+        forecasts: dict[str, list[Weather] | WeatherError] = {city.lower(): [entity.to_model() for entity in entities] for city, entities in stored.items() if entities and not forecast_is_stale(entities)}
+
+        async def fetch(city: str) -> list[Weather] | WeatherError:
+            stored_forecast = [mark_stale(entity.to_model()) for entity in stored[city.lower()]]
+            return await or_weather_error(self._with_stale_fallback("forecast", lambda service: service._fetch_five_day_forecast(city), lambda: stored_forecast or None))
+
+        missing = [city for city in cities if city.lower() not in forecasts]
+        fetched = await gather_limited((fetch(city) for city in missing), WEATHER_BATCH_CONCURRENCY)
+        forecasts.update({city.lower(): forecast for city, forecast in zip(missing, fetched)})
+
+        return {city: forecasts[city.lower()] for city in cities}
+
 
-        return [entity.to_model() for entity in stored_entities]
+    async def _fetch_five_day_forecast(self, city: str) -> list[Weather]:
+        """
+        Fetches and stores the forecast of a location, unless another request stored a fresh one first.
+        """
+
+        async def fetch_and_store_forecast() -> list[Weather]:
+            # Check again in case another request stored the forecast after the first check
+            existing = await self._run_db(self._stored_five_day_forecasts, [city])
+            if not existing or forecast_is_stale(existing):
+                # If the data does not exist in the database or is old, fetch it from the API
+                await self.store_five_day_weather_forecast(city)
+                existing = await self._run_db(self._stored_five_day_forecasts, [city])
+
+            return [entity.to_model() for entity in existing]
+
+        # Every concurrent request for this city waits on the same fetch and receives the same forecast
+        return await forecast_flight.do(city.lower(), fetch_and_store_forecast)
     
     
     
-    def get_current_weather_by_location(self, city: str) -> Weather:
+    def _stored_five_day_forecasts(self, cities: list[str]) -> list[WeatherEntity]:
+        """
+        Reads the stored forecast of the current day and the next five days for the given locations, ordered by city and date.
+        Rows read before are loaded again, as the forecast may have been refreshed since.
         """
-        Retrieves the weather forecast for a given location. Raises an error if no weather data for the given date is found.
+
+        start_date = datetime.now(tz).date()
+        end_date = start_date + timedelta(days=5)
+
+        # Search for existing data in the database by city, date, and is_current
+        query = select(WeatherEntity).filter(WeatherEntity.city.in_([city.lower() for city in cities]), WeatherEntity.date >= start_date, WeatherEntity.date <= end_date, WeatherEntity.is_current == False)
+
+        return self._read_session.scalars(query.order_by(WeatherEntity.city, WeatherEntity.date).execution_options(populate_existing=True)).all()
+
+
+    async def refresh_five_day_forecast(self, city: str, days_ahead: int, lead_seconds: float) -> bool:
+        """
+        Fetches the forecast of a given location again before it goes stale, or once it no longer covers the current day and the next days,
+        i.e. after midnight added a day that was never fetched. Used by the background prefetcher.
+
+        Params:
+            city: The location to refresh the forecast for
+            days_ahead: How many days after the current day must be stored
+            lead_seconds: How long before going stale the forecast is fetched again
+
+        Returns:
+            bool: Whether the forecast was fetched
+        """
+
+        last_date = datetime.now(tz).date() + timedelta(days=days_ahead)
+        existing = await self._run_db(self._stored_five_day_forecasts, [city])
+
+        if len([entity for entity in existing if entity.date <= last_date]) > days_ahead and not forecast_is_stale(existing, lead_seconds):
+            return False
+
+        async def fetch_and_store_forecast() -> list[Weather]:
+            await self.store_five_day_weather_forecast(city)
+            return [entity.to_model() for entity in await self._run_db(self._stored_five_day_forecasts, [city])]
+
+        # Shares the fetch with requests missing the forecast at the same time
+        await forecast_flight.do(city.lower(), fetch_and_store_forecast)
+
+        return True
+
+
+    async def refresh_current_weather(self, city: str, lead_seconds: float) -> bool:
+        """
+        Stores the current weather of a given location for the next freshness bucket once the current bucket ends within lead_seconds,
+        so requests at the start of the next bucket read it from the database. Before that, stores it only if the current bucket is missing it.
+        Used by the background prefetcher.
+
+        Params:
+            city: The location to refresh the current weather for
+            lead_seconds: How long before the end of the current bucket the next one is stored
+
+        Returns:
+            bool: Whether the weather was fetched
+        """
+
+        bucket_start = current_weather_bucket_start()
+        if time.time() >= bucket_start + CURRENT_WEATHER_BUCKET_SECONDS - lead_seconds:
+            bucket_start += CURRENT_WEATHER_BUCKET_SECONDS
+
+        query = select(WeatherEntity.id).filter(WeatherEntity.city == city.lower(), WeatherEntity.is_current == True, WeatherEntity.bucket_start == bucket_start)
+
+        if await self._run_db(lambda: self._read_session.scalars(query).first()) is not None:
+            return False
+
+        await current_weather_flight.do((city.lower(), bucket_start), lambda: self.store_current_weather(city, bucket_start))
+
+        return True
+
+
+    async def get_current_weather_by_location(self, city: str) -> Weather:
+        """
+        Retrieves the current weather for a given location.
+        The current weather is cached per city for a freshness bucket (CURRENT_WEATHER_BUCKET_SECONDS), in memory and in the database.
+        The weather is only fetched from the API if it has not been stored during the current bucket.
         
         Params:
-            date: The date to get the forecast for
+            city: The location to get the current weather for
             
         Returns:
-            Weather: The weather forecast for the given date
+            Weather: The current weather for the given location
         """
 
-        query = select(WeatherEntity).filter(WeatherEntity.date == datetime.now(tz), WeatherEntity.city == city.lower(), WeatherEntity.is_current == True)
+        bucket_start = current_weather_bucket_start()
 
-        entity = self._session.scalars(query).one_or_none()
+        # Repeat calls within the freshness bucket are served from memory without touching the database
+        cached = cached_current_weather(city.lower(), bucket_start)
+        if cached is not None:
+            return cached
+
+        query = select(WeatherEntity).filter(WeatherEntity.city == city.lower(), WeatherEntity.is_current == True, WeatherEntity.bucket_start == bucket_start)
+
+        entity = await self._run_db(lambda: self._read_session.scalars(query).one_or_none())
 
         if entity is None:
-            return self.store_current_weather(city)
+            # Every concurrent request for this city waits on the same fetch and receives the same weather, or the last stored weather if the fetch is slow or fails
+            return await self._with_stale_fallback(
+                "current",
+                lambda service: current_weather_flight.do((city.lower(), bucket_start), lambda: service.store_current_weather(city, bucket_start)),
+                lambda: self._last_current_weather(city)
+            )
 
-        return entity.to_model()
+        weather = entity.to_model()
+        cache_current_weather(city.lower(), bucket_start, weather)
+
+        return weather
+
+
+    async def get_current_weather_by_locations(self, cities: list[str]) -> dict[str, Weather | WeatherError]:
+        """
+        Retrieves the current weather for several locations.
+        Cities cached in memory are served from there and the rest are read with one query. Only the cities not stored during
+        the current freshness bucket are fetched from the API, WEATHER_BATCH_CONCURRENCY at a time.
+        A city that could not be found or fetched gets a WeatherError instead of failing the others.
+
+        Params:
+            cities: The locations to get the current weather for
+
+        Returns:
+            dict[str, Weather | WeatherError]: The current weather or error by city, in the order the cities were given
+        """
+
+        bucket_start = current_weather_bucket_start()
+        found: dict[str, Weather | WeatherError] = {}
+
+        for city in cities:
+            cached = cached_current_weather(city.lower(), bucket_start)
+            if cached is not None:
+                found[city.lower()] = cached
+
+        uncached = [city.lower() for city in cities if city.lower() not in found]
+        if uncached:
+            query = select(WeatherEntity).filter(WeatherEntity.city.in_(uncached), WeatherEntity.is_current == True, WeatherEntity.bucket_start == bucket_start)
+            for entity in await self._run_db(lambda: self._read_session.scalars(query).all()):
+                found[entity.city] = entity.to_model()
+                cache_current_weather(entity.city, bucket_start, found[entity.city])
+
+        async def fetch(city: str) -> Weather | WeatherError:
+            return await or_weather_error(self._with_stale_fallback(
+                "current",
+                lambda service: current_weather_flight.do((city.lower(), bucket_start), lambda: service.store_current_weather(city, bucket_start)),
+                lambda: self._last_current_weather(city)
+            ))
+
+        missing = [city for city in cities if city.lower() not in found]
+        fetched = await gather_limited((fetch(city) for city in missing), WEATHER_BATCH_CONCURRENCY)
+        found.update({city.lower(): weather for city, weather in zip(missing, fetched)})
+
+        return {city: found[city.lower()] for city in cities}
 
 
     def delete_weather(self, weather_id) -> None:
@@ -305,4 +781,10 @@ class WeatherService:
 
         if entity:
             self._session.delete(entity)
-            self._session.commit()
\ No newline at end of file
+            self._session.commit()
+
+            # Stop serving the deleted weather from memory
+            with _current_weather_cache_lock:
+                cached = current_weather_cache.get(entity.city)
+                if cached is not None and cached[1].id == weather_id:
+                    del current_weather_cache[entity.city]
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+Keeps the weather of recently requested cities fresh in the background, so requests read it from the database instead of waiting on OpenWeather.
+
+Routes track a city once its weather was served or a workout was logged there. Every interval, the prefetcher stores the current weather
+of each active city for the next freshness bucket before the current one ends, and fetches the forecast again before it goes stale or once it is missing upcoming days.
+Cities are refreshed after a random delay and only a few at a time, so the refreshes do not hit OpenWeather in bursts.
+"""
+
+from collections import OrderedDict
+from contextlib import suppress
+from threading import Lock
+import asyncio, os, random, time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from backend.metrics import weather_prefetches
+from backend.services.geocode import GeocodeService, normalize_city
+from backend.services.weather import WeatherService
+from ..database import engine, read_engine
+
+# Refresh the weather of active cities in the background
+WEATHER_PREFETCH_ENABLED = os.getenv("WEATHER_PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# How long a city stays active after it was last requested, and how many cities are kept active at most
+WEATHER_PREFETCH_ACTIVE_SECONDS = int(os.getenv("WEATHER_PREFETCH_ACTIVE_SECONDS", 24 * 60 * 60))
+WEATHER_PREFETCH_MAX_CITIES = int(os.getenv("WEATHER_PREFETCH_MAX_CITIES", 100))
+
+# How often the active cities are checked, and the largest random delay before a city is refreshed
+WEATHER_PREFETCH_INTERVAL_SECONDS = float(os.getenv("WEATHER_PREFETCH_INTERVAL_SECONDS", 30))
+WEATHER_PREFETCH_JITTER_SECONDS = float(os.getenv("WEATHER_PREFETCH_JITTER_SECONDS", 10))
+
+# How long before the current weather bucket ends, or the forecast goes stale, the weather is fetched again. Longer than the interval plus the jitter, so nothing expires first.
+WEATHER_PREFETCH_LEAD_SECONDS = float(os.getenv("WEATHER_PREFETCH_LEAD_SECONDS", 90))
+
+# The forecast is fetched again once it no longer covers the current day and this many days after it
+WEATHER_PREFETCH_FORECAST_DAYS = int(os.getenv("WEATHER_PREFETCH_FORECAST_DAYS", 4))
+
+# Cities refreshed at the same time
+WEATHER_PREFETCH_CONCURRENCY = int(os.getenv("WEATHER_PREFETCH_CONCURRENCY", 4))
+
+
+class WeatherPrefetcher:
+    """
+    Tracks recently requested cities and refreshes their weather ahead of expiry.
+    """
+
+    def __init__(self, active_seconds: float = WEATHER_PREFETCH_ACTIVE_SECONDS, max_cities: int = WEATHER_PREFETCH_MAX_CITIES, jitter_seconds: float = WEATHER_PREFETCH_JITTER_SECONDS, concurrency: int = WEATHER_PREFETCH_CONCURRENCY):
+        self.active_seconds = active_seconds
+        self.max_cities = max_cities
+        self.jitter_seconds = jitter_seconds
+        self.concurrency = concurrency
+        # Normalized city -> when it was last requested, least recently requested first
+        self._cities: OrderedDict[str, float] = OrderedDict()
+        self._lock = Lock()
+        self._task: asyncio.Task | None = None
+
+
+    def track(self, city: str) -> None:
+        """
+        Marks a city as requested, keeping it active for active_seconds.
+
+        Params:
+            city: The city whose weather was requested
+        """
+
+        key = normalize_city(city)
+
+        with self._lock:
+            self._cities[key] = time.monotonic()
+            self._cities.move_to_end(key)
+            while len(self._cities) > self.max_cities:
+                self._cities.popitem(last=False)
+
+
+    def active_cities(self) -> list[str]:
+        """
+        Lists the cities requested within active_seconds, forgetting the others.
+
+        Returns:
+            list[str]: The active cities
+        """
+
+        expired_before = time.monotonic() - self.active_seconds
+
+        with self._lock:
+            while self._cities and next(iter(self._cities.values())) < expired_before:
+                self._cities.popitem(last=False)
+
+            return list(self._cities)
+
+
+    def clear(self) -> None:
+        """
+        Forgets every tracked city. Used by the tests.
+        """
+
+        with self._lock:
+            self._cities.clear()
+
+
+    async def refresh_city(self, city: str) -> None:
+        """
+        Refreshes the current weather and the forecast of a city with sessions of its own, since it runs outside of any request.
+        A failed refresh is counted and left for the next interval. The database work runs in the threadpool, as it does for requests.
+
+        Params:
+            city: The city to refresh
+        """
+
+        with Session(engine) as session, Session(read_engine, autoflush=False, expire_on_commit=False) as read_session:
+            weather_service = WeatherService(session=session, geocode_service=GeocodeService(session=session), read_session=read_session)
+
+            refreshes = {
+                "current": lambda: weather_service.refresh_current_weather(city, WEATHER_PREFETCH_LEAD_SECONDS),
+                "forecast": lambda: weather_service.refresh_five_day_forecast(city, WEATHER_PREFETCH_FORECAST_DAYS, WEATHER_PREFETCH_LEAD_SECONDS),
+            }
+
+            for kind, refresh in refreshes.items():
+                try:
+                    outcome = "fetched" if await refresh() else "fresh"
+                except Exception:
+                    await run_in_threadpool(session.rollback)
+                    outcome = "error"
+                weather_prefetches.inc(kind, outcome)
+
+
+    async def refresh_active_cities(self) -> None:
+        """
+        Refreshes every active city, each after a random delay of up to jitter_seconds and at most concurrency at a time.
+        """
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(city: str) -> None:
+            await asyncio.sleep(random.uniform(0, self.jitter_seconds))
+            async with semaphore:
+                await self.refresh_city(city)
+
+        await asyncio.gather(*(refresh(city) for city in self.active_cities()))
+
+
+    async def run(self, interval_seconds: float = WEATHER_PREFETCH_INTERVAL_SECONDS) -> None:
+        """
+        Refreshes the active cities every interval until cancelled.
+        """
+
+        while True:
+            await self.refresh_active_cities()
+            await asyncio.sleep(interval_seconds)
+
+
+    def start(self) -> None:
+        """
+        Starts refreshing in the background of the running event loop.
+        """
+
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+
+    async def stop(self) -> None:
+        """
+        Stops refreshing, waiting for the running refreshes to be cancelled.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+# Shared by the routes that track cities and the app that runs the refreshes
+weather_prefetcher = WeatherPrefetcher()
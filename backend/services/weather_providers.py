@@ -0,0 +1,190 @@
+"""
+Sources of weather data behind WeatherService.
+
+Every provider returns the payloads of OpenWeather's forecast and current weather APIs, which the service aggregates and stores.
+Pick one with the WEATHER_PROVIDER environment variable: 'openweather' (the default), or 'file' to serve recorded responses
+from WEATHER_PROVIDER_PATH, i.e. for offline development and demos.
+"""
+
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+import json, os
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from backend.metrics import upstream_call
+from backend.services.http_client import get_http_client
+
+load_dotenv()
+
+# Which provider the weather is fetched from, 'openweather' or 'file'
+WEATHER_PROVIDER = os.getenv("WEATHER_PROVIDER", "openweather")
+
+# Directory holding forecast.json and current.json for the file provider
+WEATHER_PROVIDER_PATH = os.getenv("WEATHER_PROVIDER_PATH", "weather-fixtures")
+
+# OpenWeather endpoints, which can be pointed at a stand-in such as the load test stubs
+OPENWEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
+OPENWEATHER_FORECAST_URL = os.getenv("OPENWEATHER_FORECAST_URL", "https://api.openweathermap.org/data/2.5/forecast?")
+OPENWEATHER_CURRENT_URL = os.getenv("OPENWEATHER_CURRENT_URL", "https://api.openweathermap.org/data/2.5/weather?")
+
+# How the time of every three hour forecast entry is written
+FORECAST_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Looks up the latitude and longitude of a city
+Locate = Callable[[str], Awaitable[tuple[float, float]]]
+
+
+class WeatherUnavailableError(HTTPException):
+    """
+    Raised when the weather could not be fetched: the provider failed, took too long, or was skipped while its circuit breaker is open.
+    Sent to clients as a 503 when there is no stored weather to fall back on.
+    """
+
+    def __init__(self, detail: str = "Weather data is unavailable right now"):
+        super().__init__(status_code=503, detail=detail)
+
+
+class WeatherProvider(ABC):
+    """
+    Base class of the weather providers. A provider that does not implement every method fails when it is created.
+    """
+
+    @abstractmethod
+    async def fetch_forecast(self, city: str, locate: Locate) -> dict:
+        """
+        Retrieves the forecast for every three hours of the next five days, as OpenWeather's forecast API returns it.
+
+        Params:
+            city: The city to get the forecast for
+            locate: Looks up the latitude and longitude of the city, for providers that need them
+
+        Returns:
+            dict: The forecast, with its three hour entries in 'list'
+        """
+
+
+    @abstractmethod
+    async def fetch_current(self, city: str, locate: Locate) -> dict:
+        """
+        Retrieves the current weather, as OpenWeather's current weather API returns it.
+
+        Params:
+            city: The city to get the current weather for
+            locate: Looks up the latitude and longitude of the city, for providers that need them
+
+        Returns:
+            dict: The current weather
+        """
+
+
+class OpenWeatherProvider(WeatherProvider):
+    """
+    Fetches the weather from the OpenWeather API over the shared, pooled HTTP client.
+    """
+
+    def __init__(self, forecast_url: str = OPENWEATHER_FORECAST_URL, current_url: str = OPENWEATHER_CURRENT_URL, api_key: str | None = OPENWEATHER_API_KEY):
+        self._forecast_url = forecast_url
+        self._current_url = current_url
+        self._api_key = api_key
+
+
+    async def fetch_forecast(self, city: str, locate: Locate) -> dict:
+        return await self._get(self._forecast_url, city, locate, "fetch_forecast")
+
+
+    async def fetch_current(self, city: str, locate: Locate) -> dict:
+        return await self._get(self._current_url, city, locate, "fetch_current")
+
+
+    async def _get(self, url: str, city: str, locate: Locate, call_site: str) -> dict:
+        """
+        Calls an OpenWeather endpoint for the location of a city. Raises a WeatherUnavailableError if OpenWeather could not be reached or answered with an error.
+        """
+
+        # Get longitude and latitude from the specified city, cached after the first lookup
+        latitude, longitude = await locate(city)
+
+        params = {
+            "lat": latitude,
+            "lon": longitude,
+            "appid": self._api_key,
+            "units": "imperial"
+        }
+
+        try:
+            with upstream_call("openweather", call_site) as call:
+                response = await get_http_client().get(url, params=params)
+                call.error = response.status_code != 200
+        except httpx.HTTPError:
+            raise WeatherUnavailableError("Could not reach the weather service")
+
+        if response.status_code != 200:
+            raise WeatherUnavailableError(f"The weather service answered with status { response.status_code }")
+
+        return response.json()
+
+
+class FileWeatherProvider(WeatherProvider):
+    """
+    Serves recorded OpenWeather responses from forecast.json and current.json in a directory, for every city and without any network calls.
+    The recorded forecast is moved to start on the current day, so it is always stored as upcoming days.
+    """
+
+    def __init__(self, path: str = WEATHER_PROVIDER_PATH):
+        self._path = path
+
+
+    async def fetch_forecast(self, city: str, locate: Locate) -> dict:
+        data = self._read("forecast.json")
+        entries = data["list"]
+        if not entries:
+            return data
+
+        shift = datetime.now().date() - datetime.strptime(entries[0]["dt_txt"], FORECAST_TIME_FORMAT).date()
+
+        return {
+            **data,
+            "list": [{**entry, "dt_txt": (datetime.strptime(entry["dt_txt"], FORECAST_TIME_FORMAT) + shift).strftime(FORECAST_TIME_FORMAT)} for entry in entries]
+        }
+
+
+    async def fetch_current(self, city: str, locate: Locate) -> dict:
+        return self._read("current.json")
+
+
+    def _read(self, name: str) -> dict:
+        try:
+            with open(os.path.join(self._path, name)) as file:
+                return json.load(file)
+        except OSError:
+            raise WeatherUnavailableError(f"Could not read { name } from { self._path }")
+
+
+WEATHER_PROVIDERS: dict[str, Callable[[], WeatherProvider]] = {
+    "openweather": OpenWeatherProvider,
+    "file": FileWeatherProvider,
+}
+
+_provider: WeatherProvider | None = None
+
+
+def get_weather_provider() -> WeatherProvider:
+    """
+    Retrieves the weather provider picked with WEATHER_PROVIDER, creating it on first use.
+
+    Returns:
+        WeatherProvider: The provider shared by every request
+    """
+
+    global _provider
+
+    if _provider is None:
+        if WEATHER_PROVIDER not in WEATHER_PROVIDERS:
+            raise ValueError(f"Unknown WEATHER_PROVIDER '{ WEATHER_PROVIDER }', use one of: { ', '.join(WEATHER_PROVIDERS) }")
+        _provider = WEATHER_PROVIDERS[WEATHER_PROVIDER]()
+
+    return _provider
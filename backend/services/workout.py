@@ -1,33 +1,199 @@
-from datetime import datetime, timedelta
+from collections.abc import Iterator
+from datetime import date, datetime, timedelta
 from pytz import timezone
 
 from backend.models.weather import Weather
 tz = timezone("EST")
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import Float, Select, case, cast, delete, func, insert, literal, select, update
+from sqlalchemy.orm import Session, joinedload, selectinload
 from fastapi import Depends, HTTPException
 
-from backend.entities.workout import WorkoutEntity
+from backend.entities.workout import WorkoutEntity, workout_date, workout_pace
+from backend.entities.workout_daily_rollup import WorkoutDailyRollupEntity
 from backend.models.workout import Workout
-from ..database import db_session
+from backend.models.workout_stats import WorkoutStats
+from ..database import db_read_session, db_session, dialect_insert
+
+# Workout columns that can be aggregated by the stats engine
+STATS_METRICS = {
+    "distance": WorkoutEntity.distance,
+    "duration": WorkoutEntity.duration,
+    "pace": WorkoutEntity.pace,
+}
+
+# SQL aggregate functions supported by the stats engine
+STATS_AGGREGATES = {
+    "sum": func.sum,
+    "avg": func.avg,
+    "min": func.min,
+    "max": func.max,
+}
+
+# Stats that can be read from the daily rollup table instead of scanning the workout table
+ROLLUP_STATS = {
+    ("distance", "sum"): func.sum(WorkoutDailyRollupEntity.total_distance),
+    ("distance", "avg"): func.sum(WorkoutDailyRollupEntity.total_distance) / func.sum(WorkoutDailyRollupEntity.count),
+    ("distance", "max"): func.max(WorkoutDailyRollupEntity.max_distance),
+    ("duration", "sum"): func.sum(WorkoutDailyRollupEntity.total_duration),
+    ("duration", "avg"): cast(func.sum(WorkoutDailyRollupEntity.total_duration), Float) / func.sum(WorkoutDailyRollupEntity.count),
+    ("pace", "min"): func.min(WorkoutDailyRollupEntity.min_pace),
+}
+
+# Leaderboard orderings, each backed by an index on the workout table
+LEADERBOARD_ORDERS = {
+    "pace": WorkoutEntity.pace.asc(),
+    "distance": WorkoutEntity.distance.desc(),
+    "duration": WorkoutEntity.duration.desc(),
+}
+
+
+def stats_groups(date_column, city_column, dialect_name: str = "sqlite") -> dict:
+    """
+    Builds the expressions the stats engine can group by. SQLite stores dates as 'YYYY-MM-DD' text, PostgreSQL as DATE.
+    SQLite numbers weeks from the first Monday of the year ('%W'), PostgreSQL uses ISO weeks.
+
+    Params:
+        date_column: The date column of the table being aggregated
+        city_column: The city column of the table being aggregated
+        dialect_name: The database dialect the query will run on
+
+    Returns:
+        dict: Group expressions keyed by 'week', 'month', and 'city'
+    """
+
+    if dialect_name == "postgresql":
+        week = func.to_char(date_column, 'IYYY-"W"IW')
+        month = func.to_char(date_column, "YYYY-MM")
+    else:
+        week = func.strftime("%Y-W%W", date_column)
+        month = func.strftime("%Y-%m", date_column)
+
+    return {
+        "week": week,
+        "month": month,
+        "city": city_column,
+    }
+
+
+def with_weather(query: Select, include_weather: bool) -> Select:
+    """
+    Eager loads the weather of every workout a query returns with one extra SELECT ... IN query, instead of one query per workout.
+
+    Params:
+        query: A query that selects workout entities
+        include_weather: Whether the weather is needed at all
+
+    Returns:
+        Select: The query, loading the weather if it is needed
+    """
+
+    if include_weather:
+        return query.options(selectinload(WorkoutEntity.weather))
+
+    return query
+
+
+def workout_models(entities: list[WorkoutEntity], include_weather: bool) -> list[Workout]:
+    """
+    Converts workout entities to models for a listing. Workouts from the same city and day share their weather,
+    so each weather row is converted once and its model is shared by every workout that references it.
+
+    Params:
+        entities: The workout entities, with their weather eager loaded if it is included
+        include_weather: Include the weather of each workout
+
+    Returns:
+        list[Workout]: The workout models in the same order
+    """
+
+    if not include_weather:
+        return [entity.to_model(include_weather=False) for entity in entities]
+
+    weather_models = {}
+    models = []
+
+    for entity in entities:
+        model = entity.to_model(include_weather=False)
+        if entity.weather is not None:
+            if entity.weather_id not in weather_models:
+                weather_models[entity.weather_id] = entity.weather.to_model()
+            model.weather = weather_models[entity.weather_id]
+        models.append(model)
+
+    return models
+
 
 class WorkoutService:
-    def __init__(self, session: Session = Depends(db_session)):
+    def __init__(self, session: Session = Depends(db_session), read_session: Session = Depends(db_read_session)):
         self._session = session
+        # Reads go through a read only session, writes keep using the session they always have
+        self._read_session = read_session
+
+    def all(self, after_id: int | None = None, limit: int | None = None, include_weather: bool = False) -> list[Workout]:
+        """
+        Retrieves workouts from the table ordered by ID.
+        Supports keyset pagination: pass the ID of the last workout of a page as after_id to get the next page.
+
+        Params:
+            after_id: Optionally only retrieve workouts with an ID greater than this one
+            limit: Optionally retrieve at most this many workouts
+            include_weather: Include the weather of each workout, loaded with one extra query for the whole page
+
+        Returns:
+            list[Workout]: List of Workouts
+        """
+
+        query = with_weather(select(WorkoutEntity).order_by(WorkoutEntity.id), include_weather)
+
+        if after_id is not None:
+            query = query.filter(WorkoutEntity.id > after_id)
+        if limit is not None:
+            query = query.limit(limit)
+
+        entities = self._read_session.scalars(query).all()
+
+        return workout_models(entities, include_weather)
+
+
+    def stream_workouts_ndjson(self, after_id: int | None = None, chunk_size: int = 500, include_weather: bool = False) -> Iterator[str]:
+        """
+        Streams every workout as newline delimited JSON, reading from the database in chunks so memory stays constant.
+        Uses its own session because a streamed response outlives the request's session.
 
-    def all(self) -> list[Workout]:
+        Params:
+            after_id: Optionally only stream workouts with an ID greater than this one
+            chunk_size: The number of rows to read from the database at a time
+            include_weather: Include the weather of each workout, loaded with one extra query per chunk
+
+        Returns:
+            Iterator[str]: One chunk of JSON lines per database chunk
         """
-        Retrieves all workouts from the table
+
+        query = with_weather(select(WorkoutEntity).order_by(WorkoutEntity.id).execution_options(yield_per=chunk_size), include_weather)
+
+        if after_id is not None:
+            query = query.filter(WorkoutEntity.id > after_id)
+
+        with Session(self._read_session.get_bind()) as session:
+            for entities in session.scalars(query).partitions():
+                yield "".join(model.model_dump_json() + "\n" for model in workout_models(entities, include_weather))
+    
+
+    def get_workouts_by_ids(self, workout_ids: list[int]) -> dict[int, Workout]:
+        """
+        Retrieves several workouts by their IDs with a single query. Their weather is not included.
+
+        Params:
+            workout_ids: The IDs of the workouts to retrieve
 
         Returns:
-            list[Workout]: List of all Workouts
+            dict[int, Workout]: The workouts that exist, keyed by ID
         """
 
-        query = select(WorkoutEntity)
-        entities = self._session.scalars(query).all()
+        query = select(WorkoutEntity).where(WorkoutEntity.id.in_(workout_ids))
 
-        return [entity.to_model() for entity in entities]
+        return {entity.id: entity.to_model(include_weather=False) for entity in self._read_session.scalars(query).all()}
     
 
     def get_workout_by_id(self, workout_id: int) -> Workout:
@@ -42,7 +208,8 @@ class WorkoutService:
             Workout: The workout with the specified ID
         """
         
-        entity = self._session.get(WorkoutEntity, workout_id)
+        # Load the weather in the same query instead of a second one
+        entity = self._read_session.get(WorkoutEntity, workout_id, options=[joinedload(WorkoutEntity.weather)])
 
         if entity is None:
             raise HTTPException(status_code=404, detail=f"Workout with ID: { workout_id } does not exist")
@@ -50,10 +217,13 @@ class WorkoutService:
         return entity.to_model()
     
 
-    def get_weekly_workouts(self) -> list[Workout]:
+    def get_weekly_workouts(self, include_weather: bool = False) -> list[Workout]:
         """
         Retrieves all workouts from the past 7 days.
 
+        Params:
+            include_weather: Include the weather of each workout, loaded with one extra query for all of them
+
         Returns:
             list[Workout]: All Workouts from the current week
         """
@@ -61,12 +231,102 @@ class WorkoutService:
         start_date = datetime.now(tz).date()
         end_date = start_date - timedelta(days=7)
 
-        query = select(WorkoutEntity).filter(WorkoutEntity.date <= start_date, WorkoutEntity.date >= end_date)
-        entities = self._session.scalars(query).all()
+        query = with_weather(select(WorkoutEntity).filter(WorkoutEntity.date <= start_date, WorkoutEntity.date >= end_date), include_weather)
+        entities = self._read_session.scalars(query).all()
 
-        return [entity.to_model() for entity in entities]
+        return workout_models(entities, include_weather)
     
 
+    def get_workout_stats(self, metrics: list[str], aggregates: list[str], group_by: str | None = None, start_date: date | None = None, end_date: date | None = None) -> list[WorkoutStats]:
+        """
+        Aggregates workout data points with a single SQL SUM/AVG/MIN/MAX/COUNT ... GROUP BY query.
+        Reads from the daily rollup table when every requested stat can be derived from it.
+        Raises an error if a metric, aggregate, or group is not supported.
+
+        Params:
+            metrics: The data points to aggregate, i.e. 'distance', 'duration', or 'pace'
+            aggregates: The aggregate functions to apply to each metric, i.e. 'sum', 'avg', 'min', or 'max'
+            group_by: Optionally group the workouts by 'week', 'month', or 'city'
+            start_date: Optionally only include workouts on or after this date
+            end_date: Optionally only include workouts on or before this date
+
+        Returns:
+            list[WorkoutStats]: One row per group, or a single row if the stats are not grouped
+        """
+
+        for metric in metrics:
+            if metric not in STATS_METRICS:
+                raise HTTPException(status_code=400, detail="Invalid data point. Enter 'distance', 'duration', or 'pace'")
+
+        for aggregate in aggregates:
+            if aggregate not in STATS_AGGREGATES:
+                raise HTTPException(status_code=400, detail="Invalid aggregate. Enter 'sum', 'avg', 'min', or 'max'")
+
+        if group_by is not None and group_by not in ("week", "month", "city"):
+            raise HTTPException(status_code=400, detail="Invalid group. Enter 'week', 'month', or 'city'")
+
+        # Sums, averages, and maximum distances are served from one rollup row per day and city.
+        # Anything else falls back to aggregating the workout table directly.
+        use_rollup = all((metric, aggregate) in ROLLUP_STATS for metric in metrics for aggregate in aggregates)
+
+        if use_rollup:
+            source = WorkoutDailyRollupEntity
+            count_column = func.coalesce(func.sum(WorkoutDailyRollupEntity.count), 0)
+            stat_columns = [
+                ROLLUP_STATS[(metric, aggregate)].label(f"{metric}_{aggregate}")
+                for metric in metrics
+                for aggregate in aggregates
+            ]
+        else:
+            source = WorkoutEntity
+            count_column = func.count(WorkoutEntity.id)
+            stat_columns = [
+                STATS_AGGREGATES[aggregate](STATS_METRICS[metric]).label(f"{metric}_{aggregate}")
+                for metric in metrics
+                for aggregate in aggregates
+            ]
+
+        group_column = stats_groups(source.date, source.city, self._read_session.get_bind().dialect.name)[group_by] if group_by else literal(None)
+
+        query = select(group_column.label("group"), count_column.label("count"), *stat_columns)
+
+        if start_date is not None:
+            query = query.filter(source.date >= start_date)
+        if end_date is not None:
+            query = query.filter(source.date <= end_date)
+        if group_by is not None:
+            query = query.group_by(group_column).order_by(group_column)
+
+        rows = self._read_session.execute(query).mappings().all()
+
+        return [
+            WorkoutStats(
+                group=row["group"],
+                count=row["count"],
+                stats={column.name: row[column.name] for column in stat_columns}
+            )
+            for row in rows
+        ]
+
+
+    def get_weekly_workout_stats(self, metrics: list[str], aggregates: list[str]) -> WorkoutStats:
+        """
+        Aggregates workout data points from the last 7 days with a single SQL query.
+
+        Params:
+            metrics: The data points to aggregate, i.e. 'distance', 'duration', or 'pace'
+            aggregates: The aggregate functions to apply to each metric
+
+        Returns:
+            WorkoutStats: The aggregated stats for the last 7 days
+        """
+
+        end_date = datetime.now(tz).date()
+        start_date = end_date - timedelta(days=7)
+
+        return self.get_workout_stats(metrics, aggregates, start_date=start_date, end_date=end_date)[0]
+
+
     def get_total_weekly_aggreate_workout_data(self, data_point: str) -> float:
         """
         Retrieves the aggregate of a specific workout data point from the last 7 days.
@@ -78,18 +338,9 @@ class WorkoutService:
             float: The aggregate of the specified data point
         """
 
-        start_date = datetime.now(tz).date()
-        end_date = start_date - timedelta(days=7)
-
-        query = select(WorkoutEntity).filter(WorkoutEntity.date <= start_date, WorkoutEntity.date >= end_date)
-        entities = self._session.scalars(query).all()
+        weekly_stats = self.get_weekly_workout_stats([data_point], ["sum"])
 
-        if data_point == "distance":
-            return sum([entity.distance for entity in entities])
-        elif data_point == "duration":
-            return sum([entity.duration for entity in entities])
-        else:
-            raise HTTPException(status_code=400, detail="Invalid data point. Enter 'distance' or 'duration'")
+        return weekly_stats.stats[f"{data_point}_sum"] or 0.0
         
 
     def get_average_weekly_aggreate_workout_data(self, data_point: str) -> float:
@@ -103,54 +354,193 @@ class WorkoutService:
             float: The average of the specified data point
         """
 
-        start_date = datetime.now(tz).date()
-        end_date = start_date - timedelta(days=7)
+        weekly_stats = self.get_weekly_workout_stats([data_point], ["avg"])
 
-        query = select(WorkoutEntity).filter(WorkoutEntity.date <= start_date, WorkoutEntity.date >= end_date)
-        entities = self._session.scalars(query).all()
-
-        if data_point == "distance":
-            return round(sum([entity.distance for entity in entities]) / len(entities), 2)
-        elif data_point == "duration":
-            return round(sum([entity.duration for entity in entities]) / len(entities), 2)
-        else:
-            raise HTTPException(status_code=400, detail="Invalid data point. Enter 'distance' or 'duration'")
+        return round(weekly_stats.stats[f"{data_point}_avg"] or 0.0, 2)
         
 
     def get_personal_best_distance(self) -> str:
         """
-        Retrieves the personal bests distance
+        Retrieves the personal bests distance using the distance index
         
         Returns:
             str: The personal bests for distance and duration
         """
 
-        query = select(WorkoutEntity).order_by(WorkoutEntity.distance.desc())
-        entity = self._session.scalars(query).first()
+        query = select(WorkoutEntity).order_by(WorkoutEntity.distance.desc()).limit(1)
+        entity = self._read_session.scalars(query).first()
 
         if entity is None:
-            raise HTTPException(status_code=400, detail="No personal best duration per mile found")
+            raise HTTPException(status_code=400, detail="No personal best distance found")
 
         return f"Personal best distance: {entity.distance} miles!"
     
 
     def get_personal_best_duration_per_mile(self) -> str:
         """
-        Retrieves the personal bests for distance and duration
+        Retrieves the personal best duration per mile using the pace index.
+        Workouts without a distance have no pace and are ignored.
         
         Returns:
             str: The personal bests for distance and duration
         """
 
-        query = select(WorkoutEntity)
-        entities = self._session.scalars(query).all()
-
-        minimum = min([entity.duration / entity.distance for entity in entities])
+        query = select(WorkoutEntity).filter(WorkoutEntity.pace.is_not(None)).order_by(WorkoutEntity.pace.asc()).limit(1)
+        entity = self._read_session.scalars(query).first()
 
-        if minimum == 0 or entities is None:
+        if entity is None:
             raise HTTPException(status_code=400, detail="No personal best duration per mile found")
 
-        return f"Your personal best time per mile is {minimum} minutes per mile!"
+        return f"Your personal best time per mile is {entity.pace} minutes per mile!"
+
+
+    def get_leaderboard(self, metric: str, limit: int = 10, city: str | None = None, start_date: date | None = None, end_date: date | None = None, include_weather: bool = False) -> list[Workout]:
+        """
+        Retrieves the top workouts by fastest pace, longest distance, or longest duration.
+        Raises an error if the metric is not supported.
+
+        Params:
+            metric: The metric to rank workouts by, i.e. 'pace', 'distance', or 'duration'
+            limit: The number of workouts to return
+            city: Optionally only rank workouts from this city
+            start_date: Optionally only rank workouts on or after this date
+            end_date: Optionally only rank workouts on or before this date
+            include_weather: Include the weather of each workout, loaded with one extra query for all of them
+
+        Returns:
+            list[Workout]: The top workouts, best first
+        """
+
+        if metric not in LEADERBOARD_ORDERS:
+            raise HTTPException(status_code=400, detail="Invalid leaderboard. Enter 'pace', 'distance', or 'duration'")
+
+        query = with_weather(select(WorkoutEntity).order_by(LEADERBOARD_ORDERS[metric], WorkoutEntity.id).limit(limit), include_weather)
+
+        if metric == "pace":
+            query = query.filter(WorkoutEntity.pace.is_not(None))
+        if city is not None:
+            query = query.filter(WorkoutEntity.city == city)
+        if start_date is not None:
+            query = query.filter(WorkoutEntity.date >= start_date)
+        if end_date is not None:
+            query = query.filter(WorkoutEntity.date <= end_date)
+
+        entities = self._read_session.scalars(query).all()
+
+        return workout_models(entities, include_weather)
+
+
+    def rebuild_daily_rollup(self) -> int:
+        """
+        Rebuilds the daily rollup table from every workout in the workout table.
+        Used to backfill rollups for workouts that were logged before the rollup table existed.
+
+        Returns:
+            int: The number of rollup rows written
+        """
+
+        query = select(
+            WorkoutEntity.date,
+            WorkoutEntity.city,
+            func.count(WorkoutEntity.id),
+            func.sum(WorkoutEntity.distance),
+            func.sum(WorkoutEntity.duration),
+            func.min(WorkoutEntity.pace),
+            func.max(WorkoutEntity.distance)
+        ).group_by(WorkoutEntity.date, WorkoutEntity.city)
+
+        self._session.execute(delete(WorkoutDailyRollupEntity))
+        self._session.execute(
+            insert(WorkoutDailyRollupEntity).from_select(
+                ["date", "city", "count", "total_distance", "total_duration", "min_pace", "max_distance"],
+                query
+            )
+        )
+        self._session.commit()
+
+        return self._session.scalar(select(func.count()).select_from(WorkoutDailyRollupEntity))
+
+
+    def _increment_daily_rollup(self, date: date, city: str, count: int, total_distance: float, total_duration: int, min_pace: float | None, max_distance: float) -> None:
+        """
+        Adds workouts to the rollup row for a day and city, creating the row if it does not exist.
+        Does not commit, so the rollup is written in the same transaction as the workouts.
+
+        Params:
+            date: The day of the workouts
+            city: The location of the workouts
+            count: The number of workouts to add
+            total_distance: The sum of the workout distances
+            total_duration: The sum of the workout durations
+            min_pace: The fastest pace of the workouts, None if none of them have a distance
+            max_distance: The longest workout distance
+        """
+
+        rollup = WorkoutDailyRollupEntity
+
+        statement = dialect_insert(self._session, rollup).values(
+            date=date,
+            city=city,
+            count=count,
+            total_distance=total_distance,
+            total_duration=total_duration,
+            min_pace=min_pace,
+            max_distance=max_distance
+        )
+        excluded = statement.excluded
+
+        statement = statement.on_conflict_do_update(
+            index_elements=[rollup.date, rollup.city],
+            set_={
+                "count": rollup.count + excluded.count,
+                "total_distance": rollup.total_distance + excluded.total_distance,
+                "total_duration": rollup.total_duration + excluded.total_duration,
+                "min_pace": case(
+                    (rollup.min_pace.is_(None), excluded.min_pace),
+                    (excluded.min_pace < rollup.min_pace, excluded.min_pace),
+                    else_=rollup.min_pace
+                ),
+                "max_distance": case((excluded.max_distance > rollup.max_distance, excluded.max_distance), else_=rollup.max_distance),
+            }
+        )
+
+        self._session.execute(statement)
+
+
+    def _decrement_daily_rollup(self, date: date, city: str, distance: float, duration: int) -> None:
+        """
+        Removes one workout from the rollup row for a day and city, deleting the row once it is empty.
+        The fastest pace and longest distance are recomputed from the remaining workouts of that day and city.
+        Does not commit, so the rollup is written in the same transaction as the workouts.
+
+        Params:
+            date: The day of the removed workout
+            city: The location of the removed workout
+            distance: The distance of the removed workout
+            duration: The duration of the removed workout
+        """
+
+        rollup = WorkoutDailyRollupEntity
+
+        # Flush pending workout changes so the recomputed pace and distance no longer include the removed workout
+        self._session.flush()
+
+        remaining = (WorkoutEntity.date == date, WorkoutEntity.city == city)
+        min_pace = select(func.min(WorkoutEntity.pace)).where(*remaining)
+        max_distance = select(func.coalesce(func.max(WorkoutEntity.distance), 0.0)).where(*remaining)
+
+        self._session.execute(
+            update(rollup)
+            .where(rollup.date == date, rollup.city == city)
+            .values(
+                count=rollup.count - 1,
+                total_distance=rollup.total_distance - distance,
+                total_duration=rollup.total_duration - duration,
+                min_pace=min_pace.scalar_subquery(),
+                max_distance=max_distance.scalar_subquery()
+            )
+        )
+        self._session.execute(delete(rollup).where(rollup.date == date, rollup.city == city, rollup.count <= 0))
     
 
     def create_workout(self, workout: Workout, weather: Weather) -> Workout:
@@ -175,11 +565,70 @@ class WorkoutService:
             entity.weather_id = weather.id
 
         self._session.add(entity)
+        self._increment_daily_rollup(entity.date, entity.city, 1, entity.distance, entity.duration, entity.pace, entity.distance)
         self._session.commit()
 
         return entity.to_model()
     
 
+    def existing_workout_ids(self, workout_ids: list[int]) -> set[int]:
+        """
+        Finds which of the given workout IDs are already taken, with a single query.
+
+        Params:
+            workout_ids: The IDs to check
+
+        Returns:
+            set[int]: The IDs that already belong to a workout
+        """
+
+        if not workout_ids:
+            return set()
+
+        return set(self._session.scalars(select(WorkoutEntity.id).where(WorkoutEntity.id.in_(workout_ids))))
+
+
+    def insert_workouts(self, workouts: list[Workout]) -> None:
+        """
+        Inserts many validated workouts with batched INSERTs, updates the daily rollup once per day and city, and commits once.
+        The caller is responsible for rejecting workouts whose ID is already taken.
+
+        Params:
+            workouts: The workouts to insert
+        """
+
+        rollups = {}
+        with_id, without_id = [], []
+
+        for workout in workouts:
+            pace = workout_pace(workout.distance, workout.duration)
+            day = workout_date(workout.date)
+            row = {"name": workout.name, "city": workout.city, "distance": workout.distance, "duration": workout.duration, "date": day, "pace": pace, "weather_id": workout.weather_id}
+
+            # Rows with and without an ID have different columns, so they are inserted as separate batches
+            if workout.id is None:
+                without_id.append(row)
+            else:
+                with_id.append({"id": workout.id, **row})
+
+            rollup = rollups.setdefault((day, workout.city), {"count": 0, "total_distance": 0.0, "total_duration": 0, "min_pace": None, "max_distance": workout.distance})
+            rollup["count"] += 1
+            rollup["total_distance"] += workout.distance
+            rollup["total_duration"] += workout.duration
+            rollup["max_distance"] = max(rollup["max_distance"], workout.distance)
+            if pace is not None and (rollup["min_pace"] is None or pace < rollup["min_pace"]):
+                rollup["min_pace"] = pace
+
+        for rows in (with_id, without_id):
+            if rows:
+                self._session.execute(insert(WorkoutEntity), rows)
+
+        for (date, city), rollup in rollups.items():
+            self._increment_daily_rollup(date, city, **rollup)
+
+        self._session.commit()
+
+
     def update_workout(self, workout: Workout) -> Workout:
         """
         Updates a workout
@@ -196,12 +645,19 @@ class WorkoutService:
         if entity is None:
             raise HTTPException(status_code=404, detail=f"No workout with ID: { workout.id } to update")
 
+        previous_date, previous_city = entity.date, entity.city
+        previous_distance, previous_duration = entity.distance, entity.duration
+
         entity.name = workout.name
         entity.city = workout.city
         entity.distance = workout.distance
         entity.duration = workout.duration
-        entity.date = workout.date
-        
+        entity.date = workout_date(workout.date)
+        entity.pace = workout_pace(workout.distance, workout.duration)
+
+        # Move the workout's contribution from its previous rollup row to its current one
+        self._decrement_daily_rollup(previous_date, previous_city, previous_distance, previous_duration)
+        self._increment_daily_rollup(entity.date, entity.city, 1, entity.distance, entity.duration, entity.pace, entity.distance)
 
         self._session.commit()
 
@@ -226,4 +682,5 @@ class WorkoutService:
             raise HTTPException(status_code=404, detail=f"No workout with ID: { workout_id } to delete")
 
         self._session.delete(entity)
+        self._decrement_daily_rollup(entity.date, entity.city, entity.distance, entity.duration)
         self._session.commit()
\ No newline at end of file
@@ -0,0 +1,280 @@
+from collections import deque
+from collections.abc import AsyncIterator, Iterator
+from datetime import datetime
+import codecs, csv, json, os
+
+from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+
+from backend.models.workout import Workout
+from backend.models.workout_import_error import WorkoutImportError
+from backend.models.workout_import_result import WorkoutImportResult
+from backend.services.weather import WeatherService
+from backend.services.workout import WorkoutService
+
+# How many valid rows are inserted per transaction, and how many errors are listed in the result
+WORKOUT_IMPORT_CHUNK_SIZE = int(os.getenv("WORKOUT_IMPORT_CHUNK_SIZE", 5000))
+WORKOUT_IMPORT_MAX_ERRORS = int(os.getenv("WORKOUT_IMPORT_MAX_ERRORS", 1000))
+
+IMPORT_FORMATS = ("ndjson", "csv")
+
+# Columns that are derived on import rather than taken from the file
+DERIVED_FIELDS = ("pace", "weather_id", "weather")
+
+
+async def decode_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Decodes a stream of UTF-8 bytes into lines as the bytes arrive, so a large upload never has to be held in memory.
+
+    Params:
+        chunks: The raw body of the request
+
+    Returns:
+        AsyncIterator[str]: Every line of the body, without its line ending
+    """
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[tuple[int, str]]:
+    """
+    Reads NDJSON rows from lines, skipping blank lines.
+
+    Params:
+        lines: The lines of the file
+
+    Returns:
+        AsyncIterator[tuple[int, str]]: The line number and text of every row that is not blank
+    """
+
+    line_number = 0
+
+    async for line in lines:
+        line_number += 1
+        if line.strip():
+            yield line_number, line
+
+
+async def csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[tuple[int, list[str] | ValueError]]:
+    """
+    Reads CSV rows from lines as they arrive with a single csv.reader, so a quoted field may span several lines.
+    Lines are handed to the reader once their quotes are balanced, so it never waits on a line that has not arrived yet.
+
+    Params:
+        lines: The lines of the file, without their line endings
+
+    Returns:
+        AsyncIterator[tuple[int, list[str] | ValueError]]: The line every row that is not blank starts on, and its values or why it could not be read
+    """
+
+    pending: deque[str] = deque()
+    # popleft raises an IndexError instead of ending the reader when a row is still missing lines
+    reader = csv.reader(iter(pending.popleft, None))
+    quotes = 0
+
+    def read_pending() -> Iterator[tuple[int, list[str] | ValueError]]:
+        while pending:
+            line_number = reader.line_num + 1
+            try:
+                values = next(reader)
+            except IndexError:
+                yield line_number, ValueError("Expected a closing quote")
+                continue
+            except csv.Error as error:
+                yield line_number, ValueError(str(error))
+                continue
+            if "".join(values).strip():
+                yield line_number, values
+
+    async for line in lines:
+        # The reader keeps line breaks inside quoted fields only if the lines end with them
+        pending.append(line + "\n")
+        quotes += line.count('"')
+        if quotes % 2 == 0:
+            for row in read_pending():
+                yield row
+
+    # The file ended inside a quoted field
+    for row in read_pending():
+        yield row
+
+
+class WorkoutImportService:
+    """
+    Stores the business logic for importing workouts in bulk from NDJSON or CSV files.
+    Rows are validated as they are read and inserted in chunks, and every row that fails is reported by line without failing the import.
+    """
+
+    def __init__(self, workout_service: WorkoutService = Depends(WorkoutService), weather_service: WeatherService = Depends(WeatherService)):
+        self._workout_service = workout_service
+        self._weather_service = weather_service
+
+
+    async def import_workouts(self, lines: AsyncIterator[str], format: str) -> WorkoutImportResult:
+        """
+        Imports every row of an NDJSON or CSV file. CSV files start with a header row naming the columns.
+        Workouts dated today are linked to the current weather of their city, which is looked up once per city.
+
+        Params:
+            lines: The lines of the file
+            format: 'ndjson' or 'csv'
+
+        Returns:
+            WorkoutImportResult: How many rows were imported and which rows failed
+        """
+
+        if format not in IMPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported import format: { format }")
+
+        result = WorkoutImportResult()
+        # City -> current weather ID, so each city is looked up once per import
+        weather_ids: dict[str, int | None] = {}
+        # IDs given in the file so far, so a repeated ID is reported instead of failing a whole chunk
+        seen_ids: set[int] = set()
+        header = None
+        chunk = []
+
+        async for line_number, row in csv_rows(lines) if format == "csv" else ndjson_rows(lines):
+            if format == "csv" and header is None:
+                header = row if isinstance(row, list) else []
+                continue
+
+            try:
+                workout = self._parse_row(row, header)
+            except ValueError as error:
+                self._report_error(result, line_number, error)
+                continue
+
+            if workout.id is not None:
+                if workout.id in seen_ids:
+                    self._report_error(result, line_number, f"Workout with ID: { workout.id } is repeated in the file")
+                    continue
+                seen_ids.add(workout.id)
+
+            chunk.append((line_number, workout))
+
+            if len(chunk) >= WORKOUT_IMPORT_CHUNK_SIZE:
+                await self._import_chunk(chunk, weather_ids, result)
+                chunk = []
+
+        if chunk:
+            await self._import_chunk(chunk, weather_ids, result)
+
+        # Taken IDs are only found when a chunk is inserted, after later rows were parsed
+        result.errors.sort(key=lambda error: error.line)
+
+        return result
+
+
+    def _parse_row(self, row: str | list[str] | ValueError, header: list[str] | None) -> Workout:
+        """
+        Parses and validates one row. Raises a ValueError if the row is not a valid workout.
+
+        Params:
+            row: The NDJSON line, the CSV values, or why the CSV row could not be read
+            header: The CSV column names, None for NDJSON
+
+        Returns:
+            Workout: The validated workout
+        """
+
+        if isinstance(row, ValueError):
+            raise row
+
+        if header is None:
+            row = json.loads(row)
+            if not isinstance(row, dict):
+                raise ValueError("Expected a JSON object")
+        else:
+            values = row
+            if len(values) != len(header):
+                raise ValueError(f"Expected { len(header) } columns but found { len(values) }")
+            # Empty cells are left out so optional columns fall back to their defaults
+            row = {column: value for column, value in zip(header, values) if value != ""}
+
+        for field in DERIVED_FIELDS:
+            row.pop(field, None)
+
+        # The model rejects dates that are not formatted as 'YYYY-MM-DD'
+        workout = Workout.model_validate(row)
+
+        # A row without a date is dated today, but an explicit null would be stored as today without today's weather
+        if workout.date is None:
+            raise ValueError("date: Expected a date formatted as YYYY-MM-DD, not null")
+
+        return workout
+
+
+    async def _import_chunk(self, chunk: list[tuple[int, Workout]], weather_ids: dict[str, int | None], result: WorkoutImportResult) -> None:
+        """
+        Links the weather of a chunk of validated workouts and inserts them in a single transaction.
+
+        Params:
+            chunk: The line number and workout of every row in the chunk
+            weather_ids: The current weather ID of every city looked up so far
+            result: The result to count the imported and failed rows in
+        """
+
+        taken_ids = await run_in_threadpool(self._workout_service.existing_workout_ids, [workout.id for _, workout in chunk if workout.id is not None])
+        today = datetime.now().date().strftime("%Y-%m-%d")
+        workouts = []
+
+        for line_number, workout in chunk:
+            if workout.id in taken_ids:
+                self._report_error(result, line_number, f"Workout with ID: { workout.id } already exists")
+                continue
+
+            # Only today's weather is available, the same as when a single workout is created
+            if workout.date == today:
+                if workout.city not in weather_ids:
+                    weather_ids[workout.city] = await self._current_weather_id(workout.city)
+                workout.weather_id = weather_ids[workout.city]
+
+            workouts.append(workout)
+
+        if workouts:
+            await run_in_threadpool(self._workout_service.insert_workouts, workouts)
+            result.imported += len(workouts)
+
+
+    async def _current_weather_id(self, city: str) -> int | None:
+        """
+        Looks up the current weather of a city. A failed lookup leaves the workouts without weather instead of failing them.
+        """
+
+        try:
+            weather = await self._weather_service.get_current_weather_by_location(city)
+        except HTTPException:
+            return None
+
+        return weather.id
+
+
+    def _report_error(self, result: WorkoutImportResult, line_number: int, error: Exception | str) -> None:
+        """
+        Counts a failed row and lists it in the result, up to WORKOUT_IMPORT_MAX_ERRORS rows.
+        """
+
+        result.failed += 1
+
+        if len(result.errors) >= WORKOUT_IMPORT_MAX_ERRORS:
+            return
+
+        if isinstance(error, ValidationError):
+            message = "; ".join(f"{ '.'.join(str(location) for location in detail['loc']) }: { detail['msg'] }" for detail in error.errors())
+        else:
+            message = str(error)
+
+        result.errors.append(WorkoutImportError(line=line_number, error=message))
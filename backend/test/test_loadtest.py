@@ -0,0 +1,34 @@
+import os
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+
+# The routers import the OpenAI client, which is created on import and requires an API key
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from backend.api import metrics, weather, workout
+from backend.loadtest.run import percentile, summarize
+from backend.loadtest.scenarios import SCENARIOS
+from backend.loadtest.stubs import create_stub_app
+
+def test_scenarios_cover_every_route():
+    routes = {(method, route.path) for router in (workout.api, weather.api, metrics.api) for route in router.routes if isinstance(route, APIRoute) for method in route.methods}
+    assert routes == {(scenario.method, scenario.route) for scenario in SCENARIOS}
+
+def test_summarize_percentiles():
+    latencies = [index / 1000 for index in range(1, 101)]
+    summary = summarize("GET /workouts/", latencies, [200] * 99 + [500], elapsed=2)
+    assert summary["latency_ms"]["p50"] == 50
+    assert summary["latency_ms"]["p95"] == 95
+    assert summary["latency_ms"]["p99"] == 99
+    assert summary["errors"] == 1
+    assert summary["throughput_rps"] == 50
+    assert percentile([], 50) == 0
+
+def test_stubs_inject_errors():
+    client = TestClient(create_stub_app(error_rate=1))
+    assert client.get("/nominatim/search", params={"q": "Durham"}).status_code == 500
+    client = TestClient(create_stub_app())
+    assert client.get("/nominatim/search", params={"q": "Atlantis"}).json() == []
+    assert len(client.get("/openweather/forecast").json()["list"]) == 40
+    stream = client.post("/openai/v1/chat/completions", json={"model": "gpt-4o-mini", "stream": True}).text
+    assert stream.endswith("data: [DONE]\n\n")
@@ -0,0 +1,91 @@
+import re, time
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+from backend import metrics
+from backend.api.responses import TimedAPIRoute, TimedJSONResponse
+from backend.metrics import Histogram, render_metrics, upstream_call
+from backend.middleware import MetricsMiddleware
+from pydantic import BaseModel, field_validator
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.clear_metrics()
+    yield
+    metrics.clear_metrics()
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    assert list(histogram.render())[2:] == [
+        'test_seconds_bucket{route="/a",le="0.1"} 1',
+        'test_seconds_bucket{route="/a",le="1"} 2',
+        'test_seconds_bucket{route="/a",le="+Inf"} 2',
+        'test_seconds_sum{route="/a"} 0.55',
+        'test_seconds_count{route="/a"} 2',
+    ]
+
+def test_upstream_call_counts_errors():
+    with upstream_call("openweather", "fetch_current_weather_from_api") as call:
+        call.error = True
+    with pytest.raises(ValueError):
+        with upstream_call("openweather", "fetch_current_weather_from_api"):
+            raise ValueError
+    with upstream_call("nominatim", "fetch_coordinates_from_api"):
+        pass
+
+    rendered = render_metrics()
+    assert 'upstream_errors_total{upstream="openweather",call_site="fetch_current_weather_from_api"} 2' in rendered
+    assert 'upstream_request_duration_seconds_count{upstream="nominatim",call_site="fetch_coordinates_from_api"} 1' in rendered
+    assert 'upstream_errors_total{upstream="nominatim"' not in rendered
+
+def test_middleware_records_sql_per_route_and_server_timing():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    app = FastAPI(default_response_class=TimedJSONResponse)
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        return {"id": item_id}
+
+    response = TestClient(app).get("/items/1")
+
+    assert 'db;dur=' in response.headers["server-timing"]
+    assert 'desc="2 queries"' in response.headers["server-timing"]
+    rendered = render_metrics()
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}",status="200"} 1' in rendered
+    assert 'http_request_db_statements_sum{method="GET",route="/items/{item_id}"} 2' in rendered
+
+class SlowModel(BaseModel):
+    value: int
+
+    @field_validator("value")
+    @classmethod
+    def validate_slowly(cls, value: int) -> int:
+        time.sleep(0.01)
+        return value
+
+@pytest.mark.parametrize("async_endpoint", [True, False])
+def test_serialize_timing_covers_response_model_validation(async_endpoint):
+    app = FastAPI(default_response_class=TimedJSONResponse)
+    app.add_middleware(MetricsMiddleware)
+    router = APIRouter(route_class=TimedAPIRoute)
+
+    async def get_async():
+        return [{"value": value} for value in range(5)]
+    def get_sync():
+        return [{"value": value} for value in range(5)]
+    router.get("/items", response_model=list[SlowModel])(get_async if async_endpoint else get_sync)
+    app.include_router(router)
+
+    response = TestClient(app).get("/items")
+
+    assert response.json() == [{"value": value} for value in range(5)]
+    # FastAPI validates the five items against the response_model after the route returned, which counts as serialize time
+    assert float(re.search(r"serialize;dur=([\d.]+)", response.headers["server-timing"]).group(1)) >= 50
@@ -0,0 +1,153 @@
+import asyncio, os, threading
+import pytest
+from unittest.mock import MagicMock
+from datetime import timedelta
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+# The OpenAI client is created on import and requires an API key
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from backend.database import Base
+from backend.services import advice_cache, openai
+from backend.services.advice_cache import AdviceCacheService, advice_fingerprint, quantize
+from backend.services.openai import OpenAIService
+from backend.entities.advice_cache import AdviceCacheEntity
+from backend.models.workout import Workout
+
+# A real in-memory SQLite database for the advice cache
+@pytest.fixture
+def sqlite_session():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+@pytest.fixture
+def advice_cache_service(sqlite_session):
+    return AdviceCacheService(session=sqlite_session)
+
+@pytest.fixture
+def openai_service(sqlite_session, advice_cache_service):
+    return OpenAIService(session=sqlite_session, advice_cache=advice_cache_service)
+
+# Replace the OpenAI client with one that counts completions
+@pytest.fixture
+def mock_completions(monkeypatch):
+    mock_client = MagicMock()
+    mock_client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content="Run easy."))]
+    monkeypatch.setattr(openai, "client", mock_client)
+    return mock_client.chat.completions.create
+
+def test_quantize():
+    assert quantize(71.4, 5) == 70
+    assert quantize(72.6, 5) == 75
+    assert quantize(3.2, 0.5) == 3.0
+    assert quantize(3.3, 0.5) == 3.5
+
+def test_advice_fingerprint_ignores_key_order():
+    assert advice_fingerprint("outfit", {"a": 1, "b": 2}) == advice_fingerprint("outfit", {"b": 2, "a": 1})
+    assert advice_fingerprint("outfit", {"a": 1}) != advice_fingerprint("improvement", {"a": 1})
+
+def test_similar_workouts_share_cached_advice(openai_service, mock_completions):
+    first = openai_service.generate_workout_improvement_advice(Workout(name="Run", city="Chapel Hill", distance=3.1, duration=31, date="2024-09-13"))
+    second = openai_service.generate_workout_improvement_advice(Workout(name="Run", city="Raleigh", distance=2.9, duration=29, date="2024-09-14"))
+    assert first == second == "Run easy."
+    assert mock_completions.call_count == 1
+
+def test_bypass_cache_generates_new_advice(openai_service, mock_completions, sqlite_session):
+    openai_service.generate_all_workout_improvement_advice(3.0, 30)
+    openai_service.generate_all_workout_improvement_advice(3.0, 30, bypass_cache=True)
+    assert mock_completions.call_count == 2
+    assert sqlite_session.scalar(select(func.count()).select_from(AdviceCacheEntity)) == 1
+
+def test_expired_advice_is_not_served(advice_cache_service, sqlite_session):
+    advice_cache_service.store("fingerprint", "outfit", "Wear shorts.")
+    assert advice_cache_service.get("fingerprint") == "Wear shorts."
+    entity = sqlite_session.get(AdviceCacheEntity, "fingerprint")
+    entity.created_at -= timedelta(seconds=advice_cache.ADVICE_CACHE_TTL_SECONDS)
+    sqlite_session.commit()
+    assert advice_cache_service.get("fingerprint") is None
+
+def test_least_recently_used_advice_is_evicted(advice_cache_service, sqlite_session, monkeypatch):
+    monkeypatch.setattr(advice_cache, "ADVICE_CACHE_MAX_ENTRIES", 2)
+    advice_cache_service.store("first", "outfit", "1")
+    advice_cache_service.store("second", "outfit", "2")
+    sqlite_session.get(AdviceCacheEntity, "first").last_used_at += timedelta(minutes=1)
+    sqlite_session.commit()
+    advice_cache_service.store("third", "outfit", "3")
+    assert set(sqlite_session.scalars(select(AdviceCacheEntity.fingerprint))) == {"first", "third"}
+
+def test_stream_advice_forwards_tokens_and_caches(openai_service, mock_completions, advice_cache_service):
+    mock_completions.return_value = iter([
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=token))]) for token in ["Run ", "easy", None]
+    ])
+    workout = Workout(name="Run", city="Chapel Hill", distance=3.0, duration=30, date="2024-09-13")
+    events = list(openai_service.stream_workout_improvement_advice(workout))
+    assert events == ['data: {"text": "Run "}\n\n', 'data: {"text": "easy"}\n\n', 'event: done\ndata: {"cached": false}\n\n']
+    assert mock_completions.call_args.kwargs["stream"] is True
+
+    replayed = list(openai_service.stream_workout_improvement_advice(workout))
+    assert replayed == ['data: {"text": "Run easy"}\n\n', 'event: done\ndata: {"cached": true}\n\n']
+    assert mock_completions.call_count == 1
+
+def test_stream_advice_reports_failures_without_caching(openai_service, mock_completions, sqlite_session):
+    mock_completions.side_effect = RuntimeError("upstream down")
+    events = list(openai_service.stream_all_workout_improvement_advice(3.0, 30))
+    assert events == ['event: error\ndata: {"detail": "Advice generation failed"}\n\n']
+    assert sqlite_session.scalar(select(func.count()).select_from(AdviceCacheEntity)) == 0
+
+# Batch advice runs each call in a worker thread with its own session, so it needs a database every thread can open
+@pytest.fixture
+def file_openai_service(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/advice.db")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield OpenAIService(session=session, advice_cache=AdviceCacheService(session))
+
+def test_batch_advice_is_concurrent_bounded_and_reports_failures(file_openai_service, monkeypatch):
+    monkeypatch.setattr(openai, "ADVICE_BATCH_CONCURRENCY", 3)
+    monkeypatch.setattr(openai, "ADVICE_BATCH_TIMEOUT_SECONDS", 0.5)
+    lock, all_slots_busy, release_hung_call = threading.Lock(), threading.Event(), threading.Event()
+    in_flight, peak, timeouts = 0, 0, set()
+
+    def create(timeout, **kwargs):
+        nonlocal in_flight, peak
+        prompt = kwargs["messages"][1]["content"]
+        with lock:
+            timeouts.add(timeout)
+            in_flight += 1
+            peak = max(peak, in_flight)
+            if in_flight == 3:
+                all_slots_busy.set()
+        # The first calls only return once three run at the same time, and the call for 9 miles hangs until the batch is done
+        (release_hung_call if "with 9.0 miles" in prompt else all_slots_busy).wait(5)
+        with lock:
+            in_flight -= 1
+        if "with 8.0 miles" in prompt:
+            raise RuntimeError("upstream down")
+        return MagicMock(choices=[MagicMock(message=MagicMock(content=prompt.split(" miles")[0][-3:]))])
+
+    mock_client = MagicMock()
+    mock_client.with_options.side_effect = lambda timeout, max_retries: MagicMock(chat=MagicMock(completions=MagicMock(create=lambda **kwargs: create(timeout, **kwargs))))
+    monkeypatch.setattr(openai, "client", mock_client)
+    workouts = {id: Workout(id=id, name="Run", city="Chapel Hill", distance=id, duration=10 * id, date="2024-09-13") for id in range(1, 10)}
+    workouts[99] = None
+
+    async def collect():
+        results = [advice async for advice in file_openai_service.generate_workout_improvement_advice_batch(workouts)]
+        release_hung_call.set()
+        return results
+
+    results = asyncio.run(collect())
+
+    by_id = {result.workout_id: result for result in results}
+    assert results[0].workout_id == 99 and "does not exist" in results[0].error
+    assert by_id[1].advice == "1.0"
+    assert by_id[8].error == "Advice generation failed"
+    assert by_id[9].error == "Advice generation timed out"
+    # Calls run three at a time, and the call that timed out kept its slot while it was still running
+    assert peak == 3
+    # Every call is given the batch timeout
+    assert timeouts == {0.5}
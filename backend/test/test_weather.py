@@ -0,0 +1,503 @@
+import asyncio, threading, time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from datetime import date, datetime, timedelta, timezone
+from fastapi import HTTPException
+from backend.services import geocode
+from backend.services.geocode import GeocodeService, clear_geocode_cache
+from backend.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from backend.services.single_flight import SingleFlight
+from backend.services import weather
+from backend.services.weather import WeatherService, current_weather_bucket_start, split_cities
+from backend.services.weather_prefetcher import WeatherPrefetcher
+from backend.services import weather_providers
+from backend.services.weather_providers import FileWeatherProvider, OpenWeatherProvider, WeatherUnavailableError
+from backend.models.weather import Weather
+from backend.models.weather_error import WeatherError
+from backend.entities.geocode_cache import GeocodeCacheEntity
+from backend.entities.weather import WeatherEntity
+from backend.entities.workout import WorkoutEntity
+from backend.database import Base, create_database_engine
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.orm import Session
+
+# Mock the session and the database model
+@pytest.fixture
+def mock_session():
+    return MagicMock()
+
+# A database file, so the sessions of background fetches get connections of their own as they do in the app
+@pytest.fixture
+def sqlite_session(tmp_path):
+    engine = create_database_engine(f"sqlite:///{ tmp_path / 'weather.db' }", echo=False)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+@pytest.fixture
+def geocode_service(mock_session):
+    return GeocodeService(session=mock_session)
+
+@pytest.fixture
+def sqlite_geocode_service(sqlite_session):
+    return GeocodeService(session=sqlite_session)
+
+@pytest.fixture
+def weather_service(mock_session, geocode_service):
+    return WeatherService(session=mock_session, geocode_service=geocode_service, read_session=mock_session)
+
+def forecast_entry(dt_txt, temp, main, description):
+    return {
+        "dt_txt": dt_txt,
+        "main": {"feels_like": temp, "humidity": 50, "temp_min": temp - 5, "temp_max": temp + 5, "temp": temp},
+        "wind": {"speed": 4},
+        "weather": [{"main": main, "description": description}]
+    }
+
+# Mock the shared HTTP client so no test calls Nominatim
+@pytest.fixture
+def mock_http_client(monkeypatch):
+    mock_http_client = MagicMock()
+    mock_http_client.get = AsyncMock()
+    monkeypatch.setattr(geocode, "get_http_client", lambda: mock_http_client)
+    return mock_http_client
+
+def nominatim_response(results):
+    return MagicMock(status_code=200, json=MagicMock(return_value=results))
+
+@pytest.fixture(autouse=True)
+def reset_geocode_cache():
+    clear_geocode_cache()
+    yield
+    clear_geocode_cache()
+
+@pytest.fixture(autouse=True)
+def reset_current_weather_cache():
+    weather.current_weather_cache.clear()
+    yield
+    weather.current_weather_cache.clear()
+
+@pytest.fixture(autouse=True)
+def reset_weather_breaker():
+    weather.weather_breaker.reset()
+    yield
+    weather.weather_breaker.reset()
+
+def current_weather_entity(**overrides):
+    values = dict(id=1, city="chapel hill", date=date(2024, 9, 13), fetched_at=datetime(2024, 9, 13, 9, 0), feels_like=70, humidity=50, temp_min=65, temp_max=75, temp_avg=70, wind_speed=4, weather_main="Clear", weather_description="clear sky", is_current=True, bucket_start=current_weather_bucket_start())
+    return WeatherEntity(**{**values, **overrides})
+
+def cached_city(session, city):
+    return session.get(GeocodeCacheEntity, city, populate_existing=True)
+
+def test_geocode_caches_in_memory(sqlite_geocode_service, sqlite_session, mock_http_client):
+    mock_http_client.get.return_value = nominatim_response([{"lat": "35.9", "lon": "-79.0"}])
+    assert asyncio.run(sqlite_geocode_service.geocode("Chapel Hill")) == (35.9, -79.0)
+    assert asyncio.run(sqlite_geocode_service.geocode("  chapel   HILL ")) == (35.9, -79.0)
+    mock_http_client.get.assert_called_once()
+    assert (cached_city(sqlite_session, "chapel hill").latitude, cached_city(sqlite_session, "chapel hill").longitude) == (35.9, -79.0)
+    stats = sqlite_geocode_service.cache_stats()
+    assert stats.misses == 1
+    assert stats.memory_hits == 1
+
+def test_geocode_caches_unknown_city(sqlite_geocode_service, sqlite_session, mock_http_client):
+    mock_http_client.get.return_value = nominatim_response([])
+    for _ in range(2):
+        with pytest.raises(HTTPException) as err:
+            asyncio.run(sqlite_geocode_service.geocode("Atlantis"))
+        assert err.value.status_code == 404
+    mock_http_client.get.assert_called_once()
+    assert cached_city(sqlite_session, "atlantis").latitude is None
+    assert sqlite_geocode_service.cache_stats().negative_hits == 1
+
+def test_geocode_upstream_error_is_not_cached(sqlite_geocode_service, sqlite_session, mock_http_client):
+    mock_http_client.get.return_value = MagicMock(status_code=503)
+    with pytest.raises(HTTPException) as err:
+        asyncio.run(sqlite_geocode_service.geocode("Raleigh"))
+    assert err.value.status_code == 502
+    assert cached_city(sqlite_session, "raleigh") is None
+    assert sqlite_geocode_service.cache_stats().memory_size == 0
+
+def test_geocode_database_hit(sqlite_geocode_service, sqlite_session, mock_http_client):
+    sqlite_session.add(GeocodeCacheEntity(city="raleigh", latitude=35.8, longitude=-78.6, fetched_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+    sqlite_session.commit()
+    assert asyncio.run(sqlite_geocode_service.geocode("Raleigh")) == (35.8, -78.6)
+    mock_http_client.get.assert_not_called()
+    assert sqlite_geocode_service.cache_stats().database_hits == 1
+
+def test_geocode_database_entry_expired(sqlite_geocode_service, sqlite_session, mock_http_client):
+    sqlite_session.add(GeocodeCacheEntity(city="raleigh", latitude=0.0, longitude=0.0, fetched_at=datetime(2000, 1, 1)))
+    sqlite_session.commit()
+    mock_http_client.get.return_value = nominatim_response([{"lat": "35.8", "lon": "-78.6"}])
+    assert asyncio.run(sqlite_geocode_service.geocode("Raleigh")) == (35.8, -78.6)
+    mock_http_client.get.assert_called_once()
+    assert cached_city(sqlite_session, "raleigh").latitude == 35.8
+
+def test_geocode_does_not_commit_pending_changes_of_the_request(tmp_path, mock_http_client):
+    engine = create_engine(f"sqlite:///{ tmp_path / 'geocode.db' }")
+    Base.metadata.create_all(engine)
+    mock_http_client.get.return_value = nominatim_response([{"lat": "35.9", "lon": "-79.0"}])
+    with Session(engine) as session:
+        session.add(GeocodeCacheEntity(city="pending", latitude=1.0, longitude=1.0, fetched_at=datetime(2024, 9, 13)))
+        asyncio.run(GeocodeService(session=session).geocode("Chapel Hill"))
+        session.rollback()
+    with Session(engine) as session:
+        assert session.scalars(select(GeocodeCacheEntity.city)).all() == ["chapel hill"]
+
+def test_geocode_spaces_out_nominatim_calls(sqlite_geocode_service, mock_http_client, monkeypatch):
+    monkeypatch.setattr(geocode, "NOMINATIM_MIN_INTERVAL_SECONDS", 0.2)
+    calls = []
+    async def get(url, params):
+        calls.append(time.monotonic())
+        return nominatim_response([{"lat": "35.9", "lon": "-79.0"}])
+    mock_http_client.get = get
+
+    async def geocode_both():
+        return await asyncio.gather(sqlite_geocode_service.geocode("Durham"), sqlite_geocode_service.geocode("Raleigh"))
+    asyncio.run(geocode_both())
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.2
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ["forecast"]
+
+    async def fetch_concurrently():
+        return await asyncio.gather(*[flight.do("chapel hill", fetch) for _ in range(5)])
+
+    results = asyncio.run(fetch_concurrently())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise HTTPException(status_code=404)
+
+    async def found():
+        return "found"
+
+    async def fetch_concurrently():
+        return await asyncio.gather(*[flight.do("atlantis", fail) for _ in range(3)], return_exceptions=True)
+
+    errors = asyncio.run(fetch_concurrently())
+    assert all(isinstance(error, HTTPException) for error in errors)
+
+    # Once the failed call finishes, the next call runs again
+    assert asyncio.run(flight.do("atlantis", found)) == "found"
+
+def test_store_five_day_weather_forecast(weather_service, mock_session):
+    weather_service.fetch_five_day_forecast_from_api = AsyncMock(return_value={"list": [
+        forecast_entry("2024-09-13 09:00:00", 60, "Rain", "light rain"),
+        forecast_entry("2024-09-13 12:00:00", 70, "Clear", "clear sky"),
+        forecast_entry("2024-09-13 15:00:00", 80, "Clear", "clear sky"),
+        # dt_txt is in UTC, so this entry is on the evening of the 13th in the app's timezone
+        forecast_entry("2024-09-14 03:00:00", 70, "Clear", "clear sky"),
+        forecast_entry("2024-09-14 06:00:00", 50, "Clouds", "few clouds"),
+    ]})
+    mock_session.scalars().all.side_effect = lambda: [WeatherEntity(id=id, **row) for id, row in enumerate(mock_session.scalars.call_args.args[1])]
+    result = asyncio.run(weather_service.store_five_day_weather_forecast("Chapel Hill"))
+    assert [weather.date for weather in result] == ["2024-09-13", "2024-09-14"]
+    assert result[0].city == "chapel hill"
+    assert result[0].temp_avg == 70
+    assert result[0].temp_max == 75
+    assert result[0].weather_main == "Clear"
+    assert result[0].weather_description == "clear sky"
+    assert result[1].weather_main == "Clouds"
+    # Every day is stored with one batched insert and a single commit
+    mock_session.commit.assert_called_once()
+
+def test_store_five_day_weather_forecast_upserts_days(sqlite_session, geocode_service):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    service.fetch_five_day_forecast_from_api = AsyncMock(return_value={"list": [
+        forecast_entry("2024-09-13 09:00:00", 60, "Rain", "light rain"),
+        forecast_entry("2024-09-14 06:00:00", 50, "Clouds", "few clouds"),
+    ]})
+    first = asyncio.run(service.store_five_day_weather_forecast("Chapel Hill"))
+    service.fetch_five_day_forecast_from_api.return_value["list"][0]["main"]["temp"] = 65
+    second = asyncio.run(service.store_five_day_weather_forecast("Chapel Hill"))
+    # Storing the forecast again refreshes the same rows instead of adding new ones
+    assert [weather.id for weather in second] == [weather.id for weather in first]
+    assert second[0].temp_avg == 65
+    assert sqlite_session.scalar(select(func.count()).select_from(WeatherEntity)) == 2
+
+def test_get_five_day_forecast_fetches_only_when_stale(sqlite_session, geocode_service, monkeypatch):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    today = datetime.now(weather.tz).date()
+    monkeypatch.setattr(WeatherService, "fetch_five_day_forecast_from_api", AsyncMock(return_value={"list": [forecast_entry(f"{ today } 12:00:00", 70, "Clear", "clear sky")]}))
+    asyncio.run(service.get_five_day_forecast("Chapel Hill"))
+    asyncio.run(service.get_five_day_forecast("Chapel Hill"))
+    WeatherService.fetch_five_day_forecast_from_api.assert_called_once()
+
+    sqlite_session.execute(update(WeatherEntity).values(fetched_at=weather.fetched_now() - timedelta(seconds=weather.FORECAST_STALE_SECONDS + 60)))
+    sqlite_session.commit()
+    forecast = asyncio.run(service.get_five_day_forecast("Chapel Hill"))
+    assert WeatherService.fetch_five_day_forecast_from_api.call_count == 2
+    assert len(forecast) == 1
+
+def test_forecast_without_the_current_day_is_not_fetched_again(sqlite_session, geocode_service, monkeypatch):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    today = datetime.now(weather.tz).date()
+    sqlite_session.add(WeatherEntity(city="durham", date=today, fetched_at=weather.fetched_now() - timedelta(hours=12), feels_like=60, humidity=50, temp_min=55, temp_max=70, temp_avg=62, wind_speed=5, weather_main="Clear", weather_description="clear sky", is_current=False))
+    sqlite_session.commit()
+    # Late in the evening the forecast starts on the next day, so the stored current day is not refreshed
+    monkeypatch.setattr(WeatherService, "fetch_five_day_forecast_from_api", AsyncMock(return_value={"list": [forecast_entry(f"{ today + timedelta(days=day) } 18:00:00", 70, "Rain", "light rain") for day in (1, 2)]}))
+
+    for _ in range(3):
+        forecast = asyncio.run(service.get_five_day_forecast("Durham"))
+    WeatherService.fetch_five_day_forecast_from_api.assert_called_once()
+    assert [(day.date, day.weather_main) for day in forecast] == [(str(today), "Clear"), (str(today + timedelta(days=1)), "Rain"), (str(today + timedelta(days=2)), "Rain")]
+
+def test_database_work_runs_off_the_event_loop(sqlite_session, geocode_service, monkeypatch):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    threads = []
+    stored_five_day_forecasts = service._stored_five_day_forecasts
+    def record_thread(cities):
+        threads.append(threading.get_ident())
+        return stored_five_day_forecasts(cities)
+    service._stored_five_day_forecasts = record_thread
+    monkeypatch.setattr(WeatherService, "fetch_five_day_forecast_from_api", AsyncMock(return_value={"list": [forecast_entry(f"{ datetime.now(weather.tz).date() } 12:00:00", 70, "Clear", "clear sky")]}))
+
+    async def get_forecast():
+        return threading.get_ident(), await service.get_five_day_forecast("Chapel Hill")
+    loop_thread, forecast = asyncio.run(get_forecast())
+    assert len(forecast) == 1
+    assert threads and loop_thread not in threads
+
+def test_split_cities():
+    assert split_cities(" Durham,raleigh,, DURHAM ,Chapel Hill") == ["Durham", "raleigh", "Chapel Hill"]
+    for cities in (" , ", ",".join(f"City { index }" for index in range(weather.WEATHER_BATCH_MAX_CITIES + 1))):
+        with pytest.raises(HTTPException) as err:
+            split_cities(cities)
+        assert err.value.status_code == 400
+
+def test_get_current_weather_by_locations_fetches_misses_concurrently(sqlite_session, geocode_service, monkeypatch):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    weather.current_weather_cache["durham"] = (current_weather_bucket_start(), current_weather_entity(id=7, city="durham").to_model())
+    sqlite_session.add(current_weather_entity(id=8, city="raleigh"))
+    sqlite_session.commit()
+
+    fetching, most_at_once = set(), 0
+    async def fetch_current_weather_from_api(self, city):
+        nonlocal most_at_once
+        fetching.add(city)
+        most_at_once = max(most_at_once, len(fetching))
+        await asyncio.sleep(0.01)
+        fetching.remove(city)
+        return {"main": {"feels_like": 70, "humidity": 50, "temp_min": 65, "temp_max": 75, "temp": 70}, "wind": {"speed": 4}, "weather": [{"main": "Clear", "description": "clear sky"}]}
+    monkeypatch.setattr(WeatherService, "fetch_current_weather_from_api", fetch_current_weather_from_api)
+
+    result = asyncio.run(service.get_current_weather_by_locations(["Durham", "Boone", "Raleigh", "Asheville"]))
+    assert list(result) == ["Durham", "Boone", "Raleigh", "Asheville"]
+    assert [result[city].city for city in result] == ["durham", "boone", "raleigh", "asheville"]
+    assert (result["Durham"].id, result["Raleigh"].id) == (7, 8)
+    # Only the two misses were fetched, at the same time
+    assert most_at_once == 2
+
+def test_get_five_day_forecasts_fetches_only_missing_cities(sqlite_session, geocode_service, monkeypatch):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    today = datetime.now(weather.tz).date()
+    sqlite_session.add(WeatherEntity(city="durham", date=today, fetched_at=weather.fetched_now(), feels_like=60, humidity=50, temp_min=55, temp_max=70, temp_avg=62, wind_speed=5, weather_main="Clear", weather_description="clear sky", is_current=False))
+    sqlite_session.commit()
+    monkeypatch.setattr(WeatherService, "fetch_five_day_forecast_from_api", AsyncMock(return_value={"list": [forecast_entry(f"{ today } 12:00:00", 70, "Rain", "light rain")]}))
+
+    result = asyncio.run(service.get_five_day_forecasts(["Raleigh", "Durham"]))
+    assert list(result) == ["Raleigh", "Durham"]
+    assert [forecast[0].weather_main for forecast in result.values()] == ["Rain", "Clear"]
+    WeatherService.fetch_five_day_forecast_from_api.assert_called_once_with("Raleigh")
+
+def test_batch_reports_failed_cities_without_failing_the_others(sqlite_session, geocode_service, monkeypatch):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    today = datetime.now(weather.tz).date()
+    async def fetch_current_weather_from_api(self, city):
+        if city == "Atlantis":
+            raise HTTPException(status_code=404, detail="Could not find the location of Atlantis")
+        if city == "Boone":
+            raise WeatherUnavailableError()
+        return {"main": {"feels_like": 70, "humidity": 50, "temp_min": 65, "temp_max": 75, "temp": 70}, "wind": {"speed": 4}, "weather": [{"main": "Clear", "description": "clear sky"}]}
+    monkeypatch.setattr(WeatherService, "fetch_current_weather_from_api", fetch_current_weather_from_api)
+    async def fetch_five_day_forecast_from_api(self, city):
+        await fetch_current_weather_from_api(self, city)
+        return {"list": [forecast_entry(f"{ today } 12:00:00", 70, "Clear", "clear sky")]}
+    monkeypatch.setattr(WeatherService, "fetch_five_day_forecast_from_api", fetch_five_day_forecast_from_api)
+
+    current = asyncio.run(service.get_current_weather_by_locations(["Durham", "Atlantis", "Boone"]))
+    assert current["Durham"].temp_avg == 70
+    assert current["Atlantis"] == WeatherError(status_code=404, error="Could not find the location of Atlantis")
+    assert current["Boone"].status_code == 503
+
+    forecasts = asyncio.run(service.get_five_day_forecasts(["Durham", "Atlantis"]))
+    assert [day.weather_main for day in forecasts["Durham"]] == ["Clear"]
+    assert forecasts["Atlantis"].status_code == 404
+
+def test_refresh_current_weather_stores_next_bucket_ahead(weather_service, mock_session, monkeypatch):
+    bucket_start = current_weather_bucket_start()
+    monkeypatch.setattr(weather.time, "time", lambda: bucket_start + weather.CURRENT_WEATHER_BUCKET_SECONDS - 30)
+    mock_session.scalars().first.return_value = None
+    weather_service.store_current_weather = AsyncMock()
+    assert asyncio.run(weather_service.refresh_current_weather("Chapel Hill", lead_seconds=60))
+    weather_service.store_current_weather.assert_called_once_with("Chapel Hill", bucket_start + weather.CURRENT_WEATHER_BUCKET_SECONDS)
+    # Nothing is fetched once the bucket is stored
+    mock_session.scalars().first.return_value = 5
+    assert not asyncio.run(weather_service.refresh_current_weather("Chapel Hill", lead_seconds=60))
+    weather_service.store_current_weather.assert_called_once()
+
+def test_prefetcher_refreshes_active_cities_few_at_a_time():
+    prefetcher = WeatherPrefetcher(max_cities=3, jitter_seconds=0, concurrency=2)
+    for city in ("Durham", "Chapel Hill", "Raleigh", "  chapel HILL", "Boone"):
+        prefetcher.track(city)
+    # The least recently requested city is dropped once more than max_cities are active
+    assert prefetcher.active_cities() == ["raleigh", "chapel hill", "boone"]
+
+    refreshing, refreshed, most_at_once = set(), [], 0
+    async def refresh_city(city):
+        nonlocal most_at_once
+        refreshing.add(city)
+        most_at_once = max(most_at_once, len(refreshing))
+        await asyncio.sleep(0.01)
+        refreshing.remove(city)
+        refreshed.append(city)
+    prefetcher.refresh_city = refresh_city
+    asyncio.run(prefetcher.refresh_active_cities())
+    assert sorted(refreshed) == ["boone", "chapel hill", "raleigh"]
+    assert most_at_once == 2
+
+    prefetcher.active_seconds = 0
+    assert prefetcher.active_cities() == []
+
+def test_get_current_weather_from_database_then_memory(weather_service, mock_session):
+    mock_session.scalars().one_or_none.return_value = current_weather_entity()
+    mock_session.scalars.reset_mock()
+    first = asyncio.run(weather_service.get_current_weather_by_location("Chapel Hill"))
+    second = asyncio.run(weather_service.get_current_weather_by_location("Chapel Hill"))
+    assert first.id == second.id == 1
+    # The second call is served from memory without a query
+    mock_session.scalars.assert_called_once()
+
+def test_current_weather_cache_evicts_least_recently_used_city(monkeypatch):
+    monkeypatch.setattr(weather, "CURRENT_WEATHER_CACHE_MAX_ENTRIES", 2)
+    bucket_start = current_weather_bucket_start()
+    for city in ("durham", "raleigh"):
+        weather.cache_current_weather(city, bucket_start, current_weather_entity(city=city).to_model())
+    assert weather.cached_current_weather("durham", bucket_start).city == "durham"
+    weather.cache_current_weather("boone", bucket_start, current_weather_entity(city="boone").to_model())
+    assert list(weather.current_weather_cache) == ["durham", "boone"]
+    assert weather.cached_current_weather("raleigh", bucket_start) is None
+
+def test_get_current_weather_fetches_once_per_bucket(sqlite_session, geocode_service, monkeypatch):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    monkeypatch.setattr(WeatherService, "fetch_current_weather_from_api", AsyncMock(return_value={
+        "main": {"feels_like": 70, "humidity": 50, "temp_min": 65, "temp_max": 75, "temp": 70},
+        "wind": {"speed": 4},
+        "weather": [{"main": "Clear", "description": "clear sky"}]
+    }))
+    results = [asyncio.run(service.get_current_weather_by_location("Chapel Hill")) for _ in range(3)]
+    assert len({result.id for result in results}) == 1
+    WeatherService.fetch_current_weather_from_api.assert_called_once()
+    assert sqlite_session.scalar(select(func.count()).select_from(WeatherEntity)) == 1
+
+def test_get_current_weather_expired_bucket(weather_service, mock_session):
+    stale = Weather(**{**current_weather_entity().to_model().model_dump(), "id": 3})
+    weather.current_weather_cache["chapel hill"] = (current_weather_bucket_start() - weather.CURRENT_WEATHER_BUCKET_SECONDS, stale)
+    mock_session.scalars().one_or_none.return_value = current_weather_entity(id=4)
+    assert asyncio.run(weather_service.get_current_weather_by_location("Chapel Hill")).id == 4
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05, failures=(ValueError,))
+    async def fail():
+        raise ValueError
+    async def slow():
+        await asyncio.sleep(1)
+    async def succeed():
+        return "ok"
+
+    with pytest.raises(ValueError):
+        asyncio.run(breaker.call(fail, 1))
+    # Passing the deadline counts as a failure too
+    with pytest.raises(TimeoutError):
+        asyncio.run(breaker.call(slow, 0.01))
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(breaker.call(succeed, 1))
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert asyncio.run(breaker.call(succeed, 1)) == "ok"
+    assert breaker.state == "closed"
+
+def test_openweather_provider_raises_on_error_status(mock_http_client, monkeypatch):
+    monkeypatch.setattr(weather_providers, "get_http_client", lambda: mock_http_client)
+    mock_http_client.get.return_value = MagicMock(status_code=500)
+    with pytest.raises(WeatherUnavailableError) as err:
+        asyncio.run(OpenWeatherProvider().fetch_current("Durham", AsyncMock(return_value=(35.9, -78.9))))
+    assert err.value.status_code == 503
+
+def test_incomplete_provider_fails_when_created():
+    class CurrentOnlyProvider(weather_providers.WeatherProvider):
+        async def fetch_current(self, city, locate):
+            return {}
+    with pytest.raises(TypeError):
+        CurrentOnlyProvider()
+
+def test_file_provider_moves_forecast_to_today(tmp_path):
+    (tmp_path / "forecast.json").write_text('{"list": [{"dt_txt": "2024-09-13 21:00:00"}, {"dt_txt": "2024-09-14 00:00:00"}]}')
+    forecast = asyncio.run(FileWeatherProvider(str(tmp_path)).fetch_forecast("Durham", AsyncMock()))
+    today = datetime.now().date()
+    assert [entry["dt_txt"] for entry in forecast["list"]] == [f"{ today } 21:00:00", f"{ today + timedelta(days=1) } 00:00:00"]
+    with pytest.raises(WeatherUnavailableError):
+        asyncio.run(FileWeatherProvider(str(tmp_path)).fetch_current("Durham", AsyncMock()))
+
+def test_slow_provider_serves_stale_weather_and_refreshes_in_background(sqlite_session, geocode_service, monkeypatch):
+    monkeypatch.setattr(weather, "WEATHER_REQUEST_DEADLINE_SECONDS", 0.01)
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    sqlite_session.add(current_weather_entity(id=1, bucket_start=current_weather_bucket_start() - weather.CURRENT_WEATHER_BUCKET_SECONDS))
+    sqlite_session.commit()
+    async def fetch_current_weather_from_api(self, city):
+        await asyncio.sleep(0.05)
+        return {"main": {"feels_like": 80, "humidity": 50, "temp_min": 75, "temp_max": 85, "temp": 80}, "wind": {"speed": 4}, "weather": [{"main": "Clear", "description": "clear sky"}]}
+    monkeypatch.setattr(WeatherService, "fetch_current_weather_from_api", fetch_current_weather_from_api)
+    sessions = []
+    upsert_returning = WeatherService._upsert_returning
+    def record_session(self, statement):
+        sessions.append(self._session)
+        return upsert_returning(self, statement)
+    monkeypatch.setattr(WeatherService, "_upsert_returning", record_session)
+
+    async def request_then_wait():
+        stale = await service.get_current_weather_by_location("Chapel Hill")
+        # The request ends and closes its session while the fetch keeps running
+        sqlite_session.close()
+        await asyncio.sleep(0.1)
+        return stale, await service.get_current_weather_by_location("Chapel Hill")
+    stale, fresh = asyncio.run(request_then_wait())
+
+    assert (stale.id, stale.stale, stale.temp_avg) == (1, True, 70)
+    assert (fresh.stale, fresh.temp_avg) == (False, 80)
+    # The background fetch stored the weather with a session of its own
+    assert sessions and sqlite_session not in sessions
+
+def test_unavailable_provider_without_stored_weather_fails(sqlite_session, geocode_service, monkeypatch):
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    monkeypatch.setattr(WeatherService, "fetch_current_weather_from_api", AsyncMock(side_effect=WeatherUnavailableError()))
+    with pytest.raises(WeatherUnavailableError):
+        asyncio.run(service.get_current_weather_by_location("Chapel Hill"))
+
+def test_open_breaker_serves_stale_forecast(sqlite_session, geocode_service, monkeypatch):
+    monkeypatch.setattr(weather, "get_weather_provider", lambda: FileWeatherProvider("missing"))
+    service = WeatherService(session=sqlite_session, geocode_service=geocode_service, read_session=sqlite_session)
+    today = datetime.now(weather.tz).date()
+    sqlite_session.add(WeatherEntity(city="durham", date=today, fetched_at=datetime(2024, 9, 13), feels_like=60, humidity=50, temp_min=55, temp_max=70, temp_avg=62, wind_speed=5, weather_main="Clear", weather_description="clear sky", is_current=False))
+    sqlite_session.commit()
+
+    for _ in range(weather.WEATHER_BREAKER_FAILURE_THRESHOLD + 1):
+        forecast = asyncio.run(service.get_five_day_forecast("Durham"))
+        assert [(day.temp_avg, day.stale) for day in forecast] == [(62, True)]
+    assert weather.weather_breaker.state == "open"
@@ -1,11 +1,30 @@
+import asyncio, csv, io, json, os
 import pytest
-from unittest.mock import MagicMock
-from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+from datetime import date, datetime, timedelta
 from pytz import timezone
-from fastapi import HTTPException
-from backend.services.workout import WorkoutService
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+# The routers import the OpenAI client, which is created on import and requires an API key
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from backend.api.responses import ModelListResponse
+from backend.api.workout import get_workouts
+from backend.database import Base
+from backend.middleware import GZipMiddleware
+from backend.services.workout import WorkoutService, workout_models
+from backend.services.workout_import import WorkoutImportService, decode_lines
+from backend.services import export
+from backend.services.export import ExportService
+from backend.entities.workout_daily_rollup import WorkoutDailyRollupEntity
 from backend.models.workout import Workout
-from backend.entities.workout import WorkoutEntity
+from backend.entities.workout import WorkoutEntity, workout_pace
+from backend.entities.weather import WeatherEntity
 
 tz = timezone("EST")
 
@@ -16,12 +35,20 @@ def mock_session():
 
 @pytest.fixture
 def workout_service(mock_session):
-    return WorkoutService(session=mock_session)
+    return WorkoutService(session=mock_session, read_session=mock_session)
+
+# A real in-memory SQLite database for tests that depend on the SQL that is executed. Shared with the threadpool like the app's engine.
+@pytest.fixture
+def sqlite_session():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
 
 def test_all_workouts(workout_service, mock_session):
     mock_session.scalars().all.return_value = [
-        WorkoutEntity(id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date="2024-09-13"),
-        WorkoutEntity(id=2, name='Evening Walk', city="Raleigh", distance=2.0, duration=25, date="2024-09-12")
+        WorkoutEntity(id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date=date.fromisoformat("2024-09-13")),
+        WorkoutEntity(id=2, name='Evening Walk', city="Raleigh", distance=2.0, duration=25, date=date.fromisoformat("2024-09-12"))
     ]
     result = workout_service.all()
     assert len(result) == 2
@@ -29,9 +56,48 @@ def test_all_workouts(workout_service, mock_session):
     assert result[1].name == 'Evening Walk'
 
 
+def test_all_workouts_keyset_pagination(workout_service, mock_session):
+    mock_session.scalars().all.return_value = []
+    workout_service.all(after_id=10, limit=2)
+    query = str(mock_session.scalars.call_args.args[0])
+    assert "workout.id >" in query
+    assert "ORDER BY workout.id" in query
+    assert "LIMIT" in query
+
+def test_get_workouts_returns_the_next_page_cursor(sqlite_session):
+    for index in range(3):
+        sqlite_session.add(WorkoutEntity(name=f"Run { index }", city="Durham", distance=3.0, duration=30, date=date(2024, 9, 13)))
+    sqlite_session.commit()
+    workout_service = WorkoutService(session=sqlite_session, read_session=sqlite_session)
+
+    first = get_workouts(after_id=None, limit=2, include=None, workout_service=workout_service)
+    assert [workout["id"] for workout in json.loads(first.body)] == [1, 2]
+    assert first.headers["X-Next-After-Id"] == "2"
+    last = get_workouts(after_id=2, limit=2, include=None, workout_service=workout_service)
+    assert [workout["id"] for workout in json.loads(last.body)] == [3]
+    assert "X-Next-After-Id" not in last.headers
+
+def test_stream_workouts_ndjson(sqlite_session):
+    sqlite_session.add_all([
+        WorkoutEntity(id=id, name=f'Run {id}', city="Chapel Hill", distance=3.0, duration=30, date=date.fromisoformat("2024-09-13")) for id in range(1, 6)
+    ])
+    sqlite_session.commit()
+    chunks = list(WorkoutService(session=sqlite_session, read_session=sqlite_session).stream_workouts_ndjson(after_id=1, chunk_size=2))
+    lines = "".join(chunks).splitlines()
+    assert len(chunks) == 2
+    assert [json.loads(line)["id"] for line in lines] == [2, 3, 4, 5]
+
+def test_get_workouts_by_ids(workout_service, mock_session):
+    mock_session.scalars().all.return_value = [
+        WorkoutEntity(id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date=date.fromisoformat("2024-09-13"))
+    ]
+    result = workout_service.get_workouts_by_ids([1, 2])
+    assert list(result) == [1]
+    assert "workout.id IN" in str(mock_session.scalars.call_args.args[0])
+
 def test_get_workout_by_id(workout_service, mock_session):
     mock_session.get.return_value = WorkoutEntity(
-        id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date=datetime.now(tz).strftime("%Y-%m-%d")
+        id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date=datetime.now(tz).date()
     )
     result = workout_service.get_workout_by_id(1)
     assert result.id == 1
@@ -49,6 +115,7 @@ def test_create_workout(workout_service, mock_session):
     result = workout_service.create_workout(mock_workout, weather=None)
     assert result.id == 1
     assert result.name == 'Morning Run'
+    assert result.pace == 30 / 3.5
 
 def test_create_workout_already_exists(workout_service, mock_session):
     mock_workout = Workout(id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date=datetime.now(tz).strftime("%Y-%m-%d"))
@@ -59,17 +126,17 @@ def test_create_workout_already_exists(workout_service, mock_session):
 
 def test_get_weekly_workouts(workout_service, mock_session):
     mock_session.scalars().all.return_value = [
-        WorkoutEntity(id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date=(datetime.now(tz) - timedelta(days=2)).strftime("%Y-%m-%d")),
-        WorkoutEntity(id=2, name='Evening Walk', city="Raleigh", distance=2.0, duration=25, date=(datetime.now(tz) - timedelta(days=5)).strftime("%Y-%m-%d"))
+        WorkoutEntity(id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date=(datetime.now(tz) - timedelta(days=2)).date()),
+        WorkoutEntity(id=2, name='Evening Walk', city="Raleigh", distance=2.0, duration=25, date=(datetime.now(tz) - timedelta(days=5)).date())
     ]
     result = workout_service.get_weekly_workouts()
     assert len(result) == 2
     assert all((datetime.now(tz).date() - timedelta(days=7)) <= datetime.strptime(workout.date, "%Y-%m-%d").date() <= datetime.now(tz).date() for workout in result)
 
 def test_get_total_weekly_aggregate_workout_data(workout_service, mock_session):
-    mock_session.scalars().all.return_value = [
-        WorkoutEntity(distance=3.5, duration=30),
-        WorkoutEntity(distance=2.0, duration=25)
+    mock_session.execute().mappings().all.side_effect = [
+        [{"group": None, "count": 2, "distance_sum": 5.5}],
+        [{"group": None, "count": 2, "duration_sum": 55}]
     ]
     total_distance = workout_service.get_total_weekly_aggreate_workout_data("distance")
     total_duration = workout_service.get_total_weekly_aggreate_workout_data("duration")
@@ -82,9 +149,9 @@ def test_get_total_weekly_aggregate_workout_data_invalid_data_point(workout_serv
     assert err.value.status_code == 400
 
 def test_get_average_weekly_aggregate_workout_data(workout_service, mock_session):
-    mock_session.scalars().all.return_value = [
-        WorkoutEntity(distance=3.5, duration=30),
-        WorkoutEntity(distance=2.0, duration=25)
+    mock_session.execute().mappings().all.side_effect = [
+        [{"group": None, "count": 2, "distance_avg": 2.75}],
+        [{"group": None, "count": 2, "duration_avg": 27.5}]
     ]
     average_distance = workout_service.get_average_weekly_aggreate_workout_data("distance")
     average_duration = workout_service.get_average_weekly_aggreate_workout_data("duration")
@@ -96,26 +163,68 @@ def test_get_average_weekly_aggregate_workout_data_invalid_data_point(workout_se
         workout_service.get_average_weekly_aggreate_workout_data("invalid_point")
     assert err.value.status_code == 400
 
+def test_get_weekly_aggregate_workout_data_no_workouts(workout_service, mock_session):
+    mock_session.execute().mappings().all.return_value = [{"group": None, "count": 0, "distance_avg": None}]
+    assert workout_service.get_average_weekly_aggreate_workout_data("distance") == 0.0
+
+def test_get_workout_stats_grouped(workout_service, mock_session):
+    mock_session.execute().mappings().all.return_value = [
+        {"group": "Chapel Hill", "count": 2, "distance_sum": 5.5, "distance_max": 3.5},
+        {"group": "Raleigh", "count": 1, "distance_sum": 2.0, "distance_max": 2.0}
+    ]
+    result = workout_service.get_workout_stats(["distance"], ["sum", "max"], group_by="city")
+    assert [row.group for row in result] == ["Chapel Hill", "Raleigh"]
+    assert result[0].count == 2
+    assert result[0].stats == {"distance_sum": 5.5, "distance_max": 3.5}
+
+def test_get_workout_stats_invalid_aggregate(workout_service, mock_session):
+    with pytest.raises(HTTPException) as err:
+        workout_service.get_workout_stats(["distance"], ["median"])
+    assert err.value.status_code == 400
+
+def test_get_workout_stats_invalid_group(workout_service, mock_session):
+    with pytest.raises(HTTPException) as err:
+        workout_service.get_workout_stats(["distance"], ["sum"], group_by="year")
+    assert err.value.status_code == 400
+
 def test_get_personal_best_distance(workout_service, mock_session):
     mock_session.scalars().first.return_value = WorkoutEntity(distance=5.0)
     result = workout_service.get_personal_best_distance()
     assert result == "Personal best distance: 5.0 miles!"
 
+def test_get_personal_best_distance_no_workouts(workout_service, mock_session):
+    mock_session.scalars().first.return_value = None
+    with pytest.raises(HTTPException) as err:
+        workout_service.get_personal_best_distance()
+    assert err.value.status_code == 400
+
 def test_get_personal_best_duration_per_mile(workout_service, mock_session):
-    mock_session.scalars().all.return_value = [
-        WorkoutEntity(distance=3.5, duration=30),
-        WorkoutEntity(distance=2.0, duration=15)
-    ]
+    mock_session.scalars().first.return_value = WorkoutEntity(distance=2.0, duration=15, pace=7.5)
     result = workout_service.get_personal_best_duration_per_mile()
     assert result == "Your personal best time per mile is 7.5 minutes per mile!"
 
+def test_get_leaderboard(workout_service, mock_session):
+    mock_session.scalars().all.return_value = [
+        WorkoutEntity(id=2, name='Tempo Run', city="Raleigh", distance=2.0, duration=15, pace=7.5, date=date.fromisoformat("2024-09-12")),
+        WorkoutEntity(id=1, name='Morning Run', city="Raleigh", distance=3.5, duration=30, pace=30 / 3.5, date=date.fromisoformat("2024-09-13"))
+    ]
+    result = workout_service.get_leaderboard("pace", limit=2, city="Raleigh")
+    assert [workout.id for workout in result] == [2, 1]
+    assert result[0].pace == 7.5
+
+def test_get_leaderboard_invalid_metric(workout_service, mock_session):
+    with pytest.raises(HTTPException) as err:
+        workout_service.get_leaderboard("elevation")
+    assert err.value.status_code == 400
+
 def test_update_workout(workout_service, mock_session):
-    mock_session.get.return_value = WorkoutEntity(id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date="2024-09-13")
+    mock_session.get.return_value = WorkoutEntity(id=1, name='Morning Run', city="Chapel Hill", distance=3.5, duration=30, date=date.fromisoformat("2024-09-13"))
     updated_workout = Workout(id=1, name='Morning Run Updated', city="Chapel Hill", distance=4.0, duration=35, date="2024-09-14")
     result = workout_service.update_workout(updated_workout)
     assert result.name == 'Morning Run Updated'
     assert result.distance == 4.0
     assert result.duration == 35
+    assert result.pace == 35 / 4.0
 
 def test_update_workout_not_found(workout_service, mock_session):
     mock_session.get.return_value = None
@@ -129,8 +238,183 @@ def test_delete_workout(workout_service, mock_session):
     workout_service.delete_workout(1)
     mock_session.delete.assert_called_once()
 
+def test_workout_pace():
+    assert workout_pace(2.0, 15) == 7.5
+    assert workout_pace(0, 10) is None
+
 def test_delete_workout_not_found(workout_service, mock_session):
     mock_session.get.return_value = None
     with pytest.raises(HTTPException) as err:
         workout_service.delete_workout(999)
     assert err.value.status_code == 404
+
+def test_insert_workouts_matches_rollup_rebuild(sqlite_session):
+    service = WorkoutService(session=sqlite_session, read_session=sqlite_session)
+    service.insert_workouts([
+        Workout(id=5, name='Run', city="Chapel Hill", distance=3.0, duration=30, date="2024-09-13"),
+        Workout(name='Run', city="Chapel Hill", distance=6.0, duration=48, date="2024-09-13"),
+        Workout(name='Run', city="Raleigh", distance=0.0, duration=10, date="2024-09-12"),
+    ])
+    incremental = sqlite_session.scalars(select(WorkoutDailyRollupEntity).order_by(WorkoutDailyRollupEntity.date)).all()
+    incremental = [(rollup.date, rollup.city, rollup.count, rollup.total_distance, rollup.min_pace, rollup.max_distance) for rollup in incremental]
+    service.rebuild_daily_rollup()
+    rebuilt = sqlite_session.scalars(select(WorkoutDailyRollupEntity).order_by(WorkoutDailyRollupEntity.date)).all()
+    assert incremental == [(rollup.date, rollup.city, rollup.count, rollup.total_distance, rollup.min_pace, rollup.max_distance) for rollup in rebuilt]
+    assert incremental[1] == (date(2024, 9, 13), "Chapel Hill", 2, 9.0, 8.0, 6.0)
+    assert sqlite_session.get(WorkoutEntity, 5).pace == 10.0
+
+def test_import_workouts_reports_row_errors(sqlite_session):
+    service = WorkoutImportService(WorkoutService(session=sqlite_session, read_session=sqlite_session), weather_service=MagicMock())
+    sqlite_session.add(WorkoutEntity(id=1, name='Run', city="Durham", distance=1.0, duration=10, date=date.fromisoformat("2024-09-01")))
+    sqlite_session.commit()
+    body = [
+        b'{"name": "Run", "city": "Durham", "distance": 3, "duration": 30, "date": "2024-09-13"}\n{"name": ',
+        b'"Run", "city": "Durham", "distance": "far", "duration": 30}\nnot json\n',
+        b'{"id": 1, "name": "Run", "city": "Durham", "distance": 3, "duration": 30, "date": "2024-09-13"}\n',
+        b'{"id": 2, "name": "Run", "city": "Durham", "distance": 3, "duration": 30, "date": "2024-9-13"}\n',
+        b'{"id": 3, "name": "Run", "city": "Durham", "distance": 3, "duration": 30, "date": null}',
+    ]
+
+    async def chunks():
+        for chunk in body:
+            yield chunk
+
+    result = asyncio.run(service.import_workouts(decode_lines(chunks()), "ndjson"))
+    assert result.imported == 1
+    assert result.failed == 5
+    assert [error.line for error in result.errors] == [2, 3, 4, 5, 6]
+    assert result.errors[0].error.startswith("distance:")
+    assert "already exists" in result.errors[2].error
+    assert result.errors[4].error.startswith("date:")
+
+def test_import_workouts_csv_links_weather_once_per_city(sqlite_session):
+    weather_service = MagicMock()
+    weather_service.get_current_weather_by_location = AsyncMock(return_value=MagicMock(id=7))
+    service = WorkoutImportService(WorkoutService(session=sqlite_session, read_session=sqlite_session), weather_service=weather_service)
+    today = datetime.now().date().strftime("%Y-%m-%d")
+    lines = ["name,city,distance,duration,date", f"A,Durham,3,30,{today}", f'B,Durham,3,30,{today}', 'C,"Durham, NC",3,30,2024-09-13', "D,Durham,3"]
+
+    async def csv_lines():
+        for line in lines:
+            yield line
+
+    result = asyncio.run(service.import_workouts(csv_lines(), "csv"))
+    assert (result.imported, result.failed) == (3, 1)
+    assert result.errors[0].error == "Expected 5 columns but found 3"
+    weather_service.get_current_weather_by_location.assert_awaited_once_with("Durham")
+    assert list(sqlite_session.scalars(select(WorkoutEntity.weather_id).order_by(WorkoutEntity.id))) == [7, 7, None]
+
+def test_import_workouts_csv_reads_quoted_line_breaks(sqlite_session):
+    service = WorkoutImportService(WorkoutService(session=sqlite_session, read_session=sqlite_session), weather_service=MagicMock())
+    body = [b'name,city,distance,duration,date\n"Long\r\nrun, then ""stretch""",Durham,3,30,2024-09-13\n', b'"Ride\n\n', b'home",Durham,10,40,2024-09-13\nD,Durham,3\n"Walk,Durham,1,20,2024-09-13']
+
+    async def chunks():
+        for chunk in body:
+            yield chunk
+
+    result = asyncio.run(service.import_workouts(decode_lines(chunks()), "csv"))
+    assert (result.imported, result.failed) == (2, 2)
+    assert list(sqlite_session.scalars(select(WorkoutEntity.name).order_by(WorkoutEntity.id))) == ['Long\nrun, then "stretch"', "Ride\n\nhome"]
+    assert [(error.line, error.error) for error in result.errors] == [(7, "Expected 5 columns but found 3"), (8, "Expected a closing quote")]
+
+def test_export_workouts_csv_in_chunks(sqlite_session, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_CHUNK_SIZE", 2)
+    sqlite_session.add_all([
+        WorkoutEntity(id=id, name=f'Run, {id}', city="Chapel Hill", distance=3.0, duration=30, pace=10.0, date=date.fromisoformat("2024-09-13")) for id in range(1, 6)
+    ])
+    sqlite_session.commit()
+    chunks = list(ExportService(read_session=sqlite_session).export_workouts("csv", include_weather=True))
+    rows = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+    assert len(chunks) == 3
+    assert rows[0][:3] == ["id", "name", "city"] and "temp_avg" in rows[0]
+    assert rows[1][:2] == ["1", "Run, 1"]
+    assert len(rows) == 6
+
+def test_export_parquet_requires_pyarrow(sqlite_session, monkeypatch):
+    monkeypatch.setattr(export, "pyarrow", None)
+    with pytest.raises(HTTPException) as error:
+        ExportService(read_session=sqlite_session).export_workouts("parquet")
+    assert error.value.status_code == 501
+
+def test_export_workouts_parquet(sqlite_session):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    sqlite_session.add(WorkoutEntity(id=1, name='Run', city="Chapel Hill", distance=3.0, duration=30, pace=10.0, date=date.fromisoformat("2024-09-13")))
+    sqlite_session.commit()
+    table = parquet.read_table(io.BytesIO(b"".join(ExportService(read_session=sqlite_session).export_workouts("parquet"))))
+    assert table.column("pace").to_pylist() == [10.0]
+    assert table.column("weather_id").to_pylist() == [None]
+
+def count_queries(session, function):
+    session.expunge_all()
+    statements = []
+    listener = lambda connection, cursor, statement, parameters, context, executemany: statements.append(statement)
+    event.listen(session.get_bind(), "before_cursor_execute", listener)
+    try:
+        function()
+    finally:
+        event.remove(session.get_bind(), "before_cursor_execute", listener)
+    return len(statements)
+
+def add_workouts_with_weather(session, count):
+    today = datetime.now(tz).date()
+    for _ in range(count):
+        weather = WeatherEntity(city="chapel hill", date=today, feels_like=60, humidity=50, temp_min=55, temp_max=70, temp_avg=62, wind_speed=5, weather_main="Clear", weather_description="clear sky", is_current=True)
+        session.add(WorkoutEntity(name='Run', city="Chapel Hill", distance=3.0, duration=30, pace=10.0, date=today, weather=weather))
+    session.commit()
+
+@pytest.mark.parametrize("include_weather", [False, True])
+def test_workout_listings_use_constant_queries(sqlite_session, include_weather):
+    service = WorkoutService(session=sqlite_session, read_session=sqlite_session)
+    listings = {
+        "all": lambda: service.all(include_weather=include_weather),
+        "weekly": lambda: service.get_weekly_workouts(include_weather),
+        "leaderboard": lambda: service.get_leaderboard("pace", limit=100, include_weather=include_weather),
+        "stream": lambda: list(service.stream_workouts_ndjson(chunk_size=1000, include_weather=include_weather)),
+    }
+
+    add_workouts_with_weather(sqlite_session, 2)
+    few = {name: count_queries(sqlite_session, listing) for name, listing in listings.items()}
+    add_workouts_with_weather(sqlite_session, 30)
+    many = {name: count_queries(sqlite_session, listing) for name, listing in listings.items()}
+
+    assert few == many
+    assert set(many.values()) == {2 if include_weather else 1}
+    workouts = service.all(include_weather=include_weather)
+    assert all((workout.weather is not None) == include_weather for workout in workouts)
+
+def test_get_workout_by_id_loads_weather_in_one_query(sqlite_session):
+    add_workouts_with_weather(sqlite_session, 1)
+    service = WorkoutService(session=sqlite_session, read_session=sqlite_session)
+    assert count_queries(sqlite_session, lambda: service.get_workout_by_id(1).weather.city) == 1
+
+def test_model_list_response_matches_pydantic_json(sqlite_session):
+    add_workouts_with_weather(sqlite_session, 2)
+    sqlite_session.add(WorkoutEntity(name='Walk', city="Durham", distance=1.0, duration=20, pace=20.0, date=date.fromisoformat("2024-09-13")))
+    sqlite_session.commit()
+    entities = sqlite_session.scalars(select(WorkoutEntity).order_by(WorkoutEntity.id)).all()
+
+    workouts = workout_models(entities, include_weather=True)
+    expected = TypeAdapter(list[Workout]).dump_json([entity.to_model(include_weather=True) for entity in entities])
+    assert json.loads(ModelListResponse(workouts).body) == json.loads(expected)
+    assert workouts[2].weather is None
+
+def test_gzip_middleware_skips_streams():
+    app = FastAPI()
+    app.add_middleware(GZipMiddleware)
+    app.get("/json")(lambda: JSONResponse(["run"] * 1000))
+    app.get("/events")(lambda: StreamingResponse(iter(["data: run\n\n"] * 1000), media_type="text/event-stream"))
+    app.get("/small")(lambda: JSONResponse(["run"]))
+    app.get("/csv")(lambda: StreamingResponse(iter(["run\n"] * 1000), media_type="text/csv"))
+    client = TestClient(app)
+
+    response = client.get("/json", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == ["run"] * 1000
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    # Streamed responses are compressed as they are written
+    response = client.get("/csv", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == "run\n" * 1000
+    response = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text.count("data: run") == 1000